@@ -8,6 +8,7 @@ python cli.py -c D:/cli.ini  -m c:/Users/c1/Videos/1.mp4 使用 D:/cli.ini, 忽
 
 
 """
+import multiprocessing
 import os
 import re
 import sys
@@ -34,6 +35,8 @@ def __init__():
 
 
 if __name__ == '__main__':
+    # 打包后使用多进程需要
+    multiprocessing.freeze_support()
     parser = argparse.ArgumentParser(description='cli.ini and source mp4')
     parser.add_argument('-c', type=str, help='cli.ini file absolute filepath', default=os.path.join(os.getcwd(), 'cli.ini'))
     parser.add_argument('-m', type=str, help='mp4 absolute filepath', default="")
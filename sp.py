@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import multiprocessing
 import sys, os
 from pathlib import Path
 import time
@@ -76,6 +77,8 @@ class StartWindow(QtWidgets.QWidget):
 
 
 if __name__ == "__main__":
+    # 打包后使用多进程需要
+    multiprocessing.freeze_support()
     app = QtWidgets.QApplication(sys.argv)
     try:
         startwin = StartWindow()
@@ -6,6 +6,7 @@ import datetime
 import os
 import time
 
+import numpy as np
 from PySide6.QtCore import QThread
 from pydub import AudioSegment
 
@@ -14,7 +15,8 @@ from videotrans.configure.config import logger, homedir
 from videotrans.translator import run as run_trans
 from videotrans.recognition import run as run_recogn
 from videotrans.tts import run as run_tts, text_to_speech
-from videotrans.util import tools
+from videotrans.util import tools, duration, silence
+from videotrans.util.encoder import PcmEncoder
 from videotrans.util.tools import runffmpeg, get_subtitle_from_srt, ms_to_time_string, set_process_box, speed_up_mp3
 
 
@@ -192,14 +194,19 @@ class WorkerTTS(QThread):
                 set_p=False
             )
 
-            runffmpeg([
+            cmd = [
                 '-y',
                 '-i',
                 f'{mp3}',
                 "-c:a",
                 "pcm_s16le",
                 f'{self.wavname}.wav',
-            ])
+            ]
+            # 转为 wav 时顺便去掉首尾静音
+            trim = silence.trim_offsets(mp3) if config.settings['remove_silence'] else None
+            if trim:
+                cmd[3:3] = ["-af", f"atrim=start_sample={trim[0]}:end_sample={trim[1]}"]
+            runffmpeg(cmd)
             if os.path.exists(mp3):
                 os.unlink(mp3)
         except Exception as e:
@@ -213,6 +220,9 @@ class WorkerTTS(QThread):
     # 1. 将每个配音的实际长度加入 dubb_time
     #
     def _add_dubb_time(self, queue_tts):
+        durations = duration.get_durations([it['filename'] for it in queue_tts])
+        # 去掉首尾静音时只记录采样偏移，加速和合并时截取
+        trims = silence.trim_offsets_many([it['filename'] for it in queue_tts]) if config.settings['remove_silence'] else [None] * len(queue_tts)
         for i, it in enumerate(queue_tts):
             # 防止开始时间比上个结束时间还小
             if i > 0 and it['start_time'] < queue_tts[i - 1]['end_time']:
@@ -226,12 +236,12 @@ class WorkerTTS(QThread):
             # 记录原字母区间时长
             it['raw_duration'] = it['end_time'] - it['start_time']
 
-            if tools.vail_file(it['filename']):
-                the_ext = it['filename'].split('.')[-1]
-                it['dubb_time'] = len(AudioSegment.from_file(it['filename'], format="mp4" if the_ext == 'm4a' else the_ext))
-            else:
-                # 不存在配音
-                it['dubb_time'] = 0
+            # 不存在配音时为0
+            it['dubb_time'] = durations[i]
+            it['trim'] = None
+            if trims[i]:
+                it['trim'] = trims[i][:2]
+                it['dubb_time'] = int(round((trims[i][1] - trims[i][0]) * 1000 / trims[i][2]))
             queue_tts[i] = it
 
         return queue_tts
@@ -293,43 +303,37 @@ class WorkerTTS(QThread):
 
         # 再次遍历，调整字幕开始结束时间对齐实际音频时长
         # 每次 start_time 和 end_time 需要添加的长度 offset 为当前所有 add_time 之和
+        speed_jobs = []
         for i, it in enumerate(queue_tts):
-            # 需要音频加速，否则跳过
-            if not it['speed'] or config.settings['audio_rate'] <= 1:
-                it['startraw'] = tools.ms_to_time_string(ms=it['start_time'])
-                it['endraw'] = tools.ms_to_time_string(ms=it['end_time'])
-                queue_tts[i] = it
-                continue
-
-            if tools.vail_file(it['filename']):
-                # 调整音频
-                tmp_mp3 = os.path.join(self.tmpdir, f'{it["filename"]}-speed.mp3')
-                # 需要加速的倍数如果大于2，并且大于1s才需要判断是否视频慢速，否则不慢速，以避免过差效果
-                speed=it['dubb_time']/it['raw_duration']
-                # 确定变化后的配音时长，如果倍数低于 audio_rate 限制，则设为原字幕时长，否则设定 配音时长/最大倍数
-                audio_extend = it['raw_duration'] if speed <= float(config.settings['audio_rate']) else int(it['dubb_time'] / float(config.settings['audio_rate']))
-                tools.precise_speed_up_audio(file_path=it['filename'], out=tmp_mp3,
-                                             target_duration_ms=audio_extend,
-                                             max_rate=min(config.settings['audio_rate'], 100))
-
-                # 获取实际加速完毕后的真实配音时长，因为精确度原因，未必和上述计算出的一致
-                #如果视频需要变化，更新视频时长需要变化的长度
-                if tools.vail_file(tmp_mp3):
-                    mp3_len = len(AudioSegment.from_file(tmp_mp3, format="mp3"))
-                else:
-                    # 加速失败使用原配音文件
-                    tmp_mp3=it['filename']
-                    mp3_len = it['dubb_time']
-
-
-                # 变化后的真实配音时长
-                it['dubb_time'] = mp3_len
-                it['filename'] = tmp_mp3
-
             # 更改时间戳
             it['startraw'] = ms_to_time_string(ms=it['start_time'])
             it['endraw'] = ms_to_time_string(ms=it['end_time'])
             queue_tts[i] = it
+            # 需要音频加速，否则跳过
+            if not it['speed'] or config.settings['audio_rate'] <= 1 or not tools.vail_file(it['filename']):
+                continue
+            # 调整音频
+            tmp_file = os.path.join(self.tmpdir, f'{it["filename"]}-speed.{it["filename"].split(".")[-1]}')
+            # 需要加速的倍数如果大于2，并且大于1s才需要判断是否视频慢速，否则不慢速，以避免过差效果
+            speed=it['dubb_time']/it['raw_duration']
+            # 确定变化后的配音时长，如果倍数低于 audio_rate 限制，则设为原字幕时长，否则设定 配音时长/最大倍数
+            audio_extend = it['raw_duration'] if speed <= float(config.settings['audio_rate']) else int(it['dubb_time'] / float(config.settings['audio_rate']))
+            speed_jobs.append((i, {
+                "file_path": it['filename'],
+                "out": tmp_file,
+                "trim": it.get('trim'),
+                "duration_ms": it['dubb_time'],
+                "target_duration_ms": audio_extend,
+                "max_rate": min(config.settings['audio_rate'], 100)
+            }))
+
+        # 多进程批量加速，获取实际加速完毕后的真实配音时长，加速失败使用原配音文件
+        results = tools.speed_up_audio_many([job for _, job in speed_jobs])
+        for (i, job), ok in zip(speed_jobs, results):
+            if ok and tools.vail_file(job['out']):
+                queue_tts[i]['trim'] = None
+                queue_tts[i]['dubb_time'] = duration.get_duration(job['out'])
+                queue_tts[i]['filename'] = job['out']
         return queue_tts
 
     # 配音预处理，去掉无效字符，整理开始时间
@@ -365,7 +369,7 @@ class WorkerTTS(QThread):
                     "language": self.langcode,
                     "pitch":self.pitch,
                     "volume":self.volume,
-                    "filename": f"{self.tmpdir}/tts-{it['start_time']}.mp3"})
+                    "filename": f"{self.tmpdir}/tts-{it['start_time']}.{tools.tts_ext()}"})
             try:
                 run_tts(queue_tts=copy.deepcopy(queue_tts), language=self.langcode, set_p=False)
 
@@ -391,7 +395,10 @@ class WorkerTTS(QThread):
                 segments = []
                 for i, it in enumerate(queue_tts):
                     if os.path.exists(it['filename']) and os.path.getsize(it['filename']) > 0:
-                        segments.append(AudioSegment.from_file(it['filename'], format="mp3"))
+                        segment = AudioSegment.from_file(it['filename'], format=it['filename'].split('.')[-1])
+                        if it.get('trim'):
+                            segment = segment.get_sample_slice(*it['trim'])
+                        segments.append(segment)
                     else:
                         segments.append(AudioSegment.silent(duration=it['end_time'] - it['start_time']))
                 self.merge_audio_segments(segments=segments, video_time=0, queue_tts=copy.deepcopy(queue_tts),
@@ -407,52 +414,47 @@ class WorkerTTS(QThread):
         return errs, length - errs
 
     def merge_audio_segments(self, *, segments=None, queue_tts=None, video_time=0, out=None):
-        merged_audio = AudioSegment.empty()
-        # start is not 0
-        if queue_tts[0]['start_time'] > 0:
-            silence_duration = queue_tts[0]['start_time']
-            silence = AudioSegment.silent(duration=silence_duration)
-            merged_audio += silence
-        # join
-        offset = 0
-        for i, it in enumerate(queue_tts):
-            segment = segments[i]
-            the_dur = len(segment)
-            # 字幕可用时间
-            raw_dur = it['raw_duration']
-            it['start_time'] += offset
-            it['end_time'] += offset
-
-            diff = the_dur - raw_dur
-            # 配音大于字幕时长，后延，延长时间
-            if diff >= 0:
-                it['end_time'] += diff
-                offset += diff
-            #else:
-                # 配音小于原时长，添加静音
-            #    merged_audio += AudioSegment.silent(duration=abs(diff))
-
-            if i > 0:
-                silence_duration = it['start_time'] - queue_tts[i - 1]['end_time']
-                # 前面一个和当前之间存在静音区间
-                if silence_duration > 0:
-                    silence = AudioSegment.silent(duration=silence_duration)
-                    merged_audio += silence
-            it['startraw'] = ms_to_time_string(ms=it['start_time'])
-            it['endraw'] = ms_to_time_string(ms=it['end_time'])
-            queue_tts[i] = it
-            merged_audio += segment
-
-        #if video_time > 0 and (len(merged_audio) < video_time):
-            # 末尾补静音
-        #    silence = AudioSegment.silent(duration=video_time - len(merged_audio))
-        #    merged_audio += silence
-        # 创建配音后的文件
+        # 所有片段统一为最高的采样率和声道数，按顺序流式写入 ffmpeg，不再在内存中反复拼接后导出
+        frame_rate = max(segment.frame_rate for segment in segments)
+        channels = max(segment.channels for segment in segments)
+        total = 0
         try:
-            merged_audio.export(out, format="wav")
+            with PcmEncoder(out, frame_rate=frame_rate, channels=channels, args=['-c:a', 'pcm_s16le'],
+                            is_cancelled=lambda: config.exit_soft or config.box_tts != 'ing') as sink:
+                # start is not 0
+                if queue_tts[0]['start_time'] > 0:
+                    sink.write_silence(queue_tts[0]['start_time'])
+                    total += queue_tts[0]['start_time']
+                # join
+                offset = 0
+                for i, it in enumerate(queue_tts):
+                    segment = segments[i].set_sample_width(2).set_frame_rate(frame_rate).set_channels(channels)
+                    the_dur = len(segment)
+                    # 字幕可用时间
+                    raw_dur = it['raw_duration']
+                    it['start_time'] += offset
+                    it['end_time'] += offset
+
+                    diff = the_dur - raw_dur
+                    # 配音大于字幕时长，后延，延长时间
+                    if diff >= 0:
+                        it['end_time'] += diff
+                        offset += diff
+
+                    if i > 0:
+                        silence_duration = it['start_time'] - queue_tts[i - 1]['end_time']
+                        # 前面一个和当前之间存在静音区间
+                        if silence_duration > 0:
+                            sink.write_silence(silence_duration)
+                            total += silence_duration
+                    it['startraw'] = ms_to_time_string(ms=it['start_time'])
+                    it['endraw'] = ms_to_time_string(ms=it['end_time'])
+                    queue_tts[i] = it
+                    sink.write(np.frombuffer(segment.raw_data, dtype=np.int16).reshape(-1, channels))
+                    total += the_dur
         except Exception as e:
             raise Exception(f'merge_audio:{str(e)}')
-        return len(merged_audio), queue_tts
+        return total, queue_tts
 
     def post_message(self, type, text=""):
         set_process_box(text=text, type=type, func_name=self.func_name)
@@ -72,12 +72,11 @@ geshi_num = 0
 queue_mp4 = []
 # 存放视频分离为无声视频进度，noextname为key，用于判断某个视频是否是否已预先创建好 novice_mp4, “ing”=需等待，end=成功完成，error=出错了
 queue_novice = {}
+# 分离视频的进度百分比
+queue_novice_progress = {}
 
 # 倒计时
 task_countdown = 60
-# 获取的视频信息 全局缓存
-video_cache = {}
-
 #youtube是否取消了下载
 canceldown=False
 #工具箱翻译进行状态,ing进行中，其他停止
@@ -143,7 +142,21 @@ def parse_init():
         "zijiehuoshan_model":"",
         "separate_sec":600,
         "audio_rate":3,
+        "audio_speed_engine":"ffmpeg",
+        "tts_format":"wav",
+        "tts_sample_rate":44100,
+        "audio_io_backend":"pyav",
         "video_rate":20,
+        "video_segment_workers":0,
+        "video_stream_copy":True,
+        "segment_cache_size":2048,
+        "ffmpeg_workers":0,
+        "media_plan_dry_run":False,
+        "burn_workers":0,
+        "smart_render":True,
+        "whisper_pool_size":4096,
+        "whisper_pool_idle":300,
+        "batch_size":1,
         "initial_prompt_zh":"Please break sentences correctly and retain punctuation",
         "fontsize":16,
         "fontname":"黑体",
@@ -760,6 +760,7 @@ class SecWindow():
         if question == QMessageBox.Yes:
             shutil.rmtree(config.TEMP_DIR, ignore_errors=True)
             shutil.rmtree(config.homedir + "/tmp", ignore_errors=True)
+            shutil.rmtree(config.homedir + "/cache", ignore_errors=True)
             tools.remove_qsettings_data()
             QMessageBox.information(self.main, 'Please restart the software' if config.defaulelang != 'zh' else '请重启软件',
                                     'Please restart the software' if config.defaulelang != 'zh' else '软件将自动关闭，请重新启动')
@@ -0,0 +1,134 @@
+# 多个片段批量识别
+# 均等分割和预先分割模式中每个静音分割的片段单独调用一次 transcribe，片段较短时编码器的批处理能力基本闲置
+# 将不超过 30s 的片段每 batch_size 个一组同时编码和解码：
+# 1. faster-whisper 带有 BatchedInferencePipeline 时，以 clip_timestamps 指定该组各片段，支持词级时间戳
+# 2. 否则自行将各片段的特征补齐为 30s 后一次编码，批量解码，只得到文本，时间使用片段起止时间
+# 超过 30s 的片段、batch_size<=1、或未指定语言时逐个识别，和原来相同
+# 片段数据由 pcmstore.prefetch 在后台线程提前读入内存，识别当前片段时下一片段已就绪
+import bisect
+from collections import namedtuple
+
+import numpy as np
+
+from videotrans.configure import config
+from videotrans.util import pcmstore
+
+# 结果中的识别段和词，时间为相对片段开始的秒数，和 faster-whisper 的 Segment 用法相同
+Segment = namedtuple('Segment', ['text', 'start', 'end', 'words'])
+Word = namedtuple('Word', ['word', 'start', 'end'])
+
+# 单次编码的最大时长 ms
+MAX_CHUNK = 30000
+SAMPLE_RATE = 16000
+
+
+def batch_size():
+    return max(1, int(config.settings['batch_size']))
+
+
+# 按 chunks 的顺序依次生成每个片段的识别段列表，chunks 为 [(start_ms, end_ms, ...)]
+# options 为 model.transcribe 的参数，取用某个片段时才识别其所在的一组
+# clips 不为 None 时为各片段的 clip_timestamps [开始秒, 结束秒, ...]，只识别其中的时间段
+def transcribe(model, pcm, chunks, clips=None, **options):
+    audios = pcmstore.prefetch(pcm, SAMPLE_RATE, chunks)
+    clips = clips or [None] * len(chunks)
+    auto = options.get('language') in (None, '', 'auto')
+    pipeline = _pipeline(model) if batch_size() > 1 and not auto else None
+    # 自行分组时没有词级时间戳
+    if batch_size() <= 1 or auto or (pipeline is None and options.get('word_timestamps')):
+        for audio, clip in zip(audios, clips):
+            yield _serial(model, audio, clip, options)
+        return
+    group = []
+    for chunk, audio, clip in zip(chunks, audios, clips):
+        if chunk[1] - chunk[0] > MAX_CHUNK:
+            if group:
+                yield from _batch(model, pipeline, group, options)
+                group = []
+            yield _serial(model, audio, clip, options)
+            continue
+        group.append((audio, clip))
+        if len(group) >= batch_size():
+            yield from _batch(model, pipeline, group, options)
+            group = []
+    if group:
+        yield from _batch(model, pipeline, group, options)
+
+
+def _serial(model, audio, clip, options):
+    if clip is not None:
+        options = dict(options, clip_timestamps=clip)
+    segments, _ = model.transcribe(audio, **options)
+    return list(segments)
+
+
+# faster-whisper 1.1 起 BatchedInferencePipeline 支持 clip_timestamps，旧版本返回 None
+def _pipeline(model):
+    try:
+        import inspect
+        from faster_whisper import BatchedInferencePipeline
+        if 'clip_timestamps' not in inspect.signature(BatchedInferencePipeline.transcribe).parameters:
+            return None
+        return BatchedInferencePipeline(model=model)
+    except Exception:
+        return None
+
+
+# 识别一组 (音频, clip_timestamps)，返回每个片段的识别段列表
+def _batch(model, pipeline, group, options):
+    if pipeline is not None:
+        return _batch_pipeline(pipeline, group, options)
+    # 自行编码时识别整个片段，clip_timestamps 之外只有较短的静音
+    return _batch_encode(model, [audio for audio, _ in group], options)
+
+
+# 各片段首尾相接后以 clip_timestamps 分别指定
+def _batch_pipeline(pipeline, group, options):
+    args = {k: v for k, v in options.items() if k not in ('vad_filter', 'vad_parameters', 'condition_on_previous_text')}
+    audios = [audio for audio, _ in group]
+    starts = [0.0]
+    for audio in audios[:-1]:
+        starts.append(starts[-1] + len(audio) / SAMPLE_RATE)
+    clip_timestamps = []
+    for s, (audio, clip) in zip(starts, group):
+        clip = clip or [0, len(audio) / SAMPLE_RATE]
+        clip_timestamps += [{"start": s + clip[i], "end": s + clip[i + 1]} for i in range(0, len(clip) - 1, 2)]
+    segments, _ = pipeline.transcribe(
+        np.concatenate(audios),
+        vad_filter=False,
+        clip_timestamps=clip_timestamps,
+        # 每个语音区间都是一个 30s 窗口，同时解码的数量不超过 batch_size 设置
+        batch_size=min(batch_size(), len(clip_timestamps)),
+        **args)
+    result = [[] for _ in audios]
+    for seg in segments:
+        # 按开始时间归入所在片段，时间改为相对片段开始
+        n = max(0, bisect.bisect_right(starts, seg.start + 0.001) - 1)
+        words = [Word(w.word, w.start - starts[n], w.end - starts[n]) for w in seg.words or []]
+        result[n].append(Segment(seg.text, seg.start - starts[n], seg.end - starts[n], words))
+    return result
+
+
+# 补齐为 30s 的特征一次编码，批量解码，不含时间戳
+def _batch_encode(model, audios, options):
+    from faster_whisper.audio import pad_or_trim
+    from faster_whisper.tokenizer import Tokenizer
+
+    tokenizer = Tokenizer(model.hf_tokenizer, model.model.is_multilingual, task="transcribe",
+                          language=options['language'])
+    prompt = []
+    if options.get('initial_prompt'):
+        prompt = [tokenizer.sot_prev] + tokenizer.encode(" " + options['initial_prompt'].strip())[-223:]
+    prompt += list(tokenizer.sot_sequence) + [tokenizer.no_timestamps]
+    features = np.stack([
+        pad_or_trim(model.feature_extractor(audio)) for audio in audios])
+    encoder_output = model.encode(features)
+    results = model.model.generate(
+        encoder_output,
+        [prompt] * len(audios),
+        beam_size=options.get('beam_size', 5),
+        max_length=len(prompt) + options['max_new_tokens'] if options.get('max_new_tokens') else getattr(model, 'max_length', 448),
+        suppress_blank=True,
+        suppress_tokens=[-1])
+    return [[Segment(tokenizer.decode(res.sequences_ids[0]), 0, len(audio) / SAMPLE_RATE, [])]
+            for audio, res in zip(audios, results)]
@@ -4,35 +4,14 @@ import re
 import time
 from datetime import timedelta
 
-from pydub import AudioSegment
-from pydub.silence import detect_nonsilent
-
 from videotrans.configure import config
-from videotrans.util import tools
+from videotrans.util import tools, pcmstore, silence
 
 
 # split audio by silence
-def shorten_voice_old(normalized_sound):
-    normalized_sound = tools.match_target_amplitude(normalized_sound, -20.0)
-    max_interval = config.settings['interval_split'] * 1000
-    buffer = int(config.settings['voice_silence'])
-    nonsilent_data = []
-    audio_chunks = detect_nonsilent(normalized_sound, min_silence_len=int(config.settings['voice_silence']),
-                                    silence_thresh=-20 - 25)
-    # print(audio_chunks)
-    for i, chunk in enumerate(audio_chunks):
-
-        start_time, end_time = chunk
-        n = 0
-        while end_time - start_time >= max_interval:
-            n += 1
-            # new_end = start_time + max_interval+buffer
-            new_end = start_time + max_interval + buffer
-            new_start = start_time
-            nonsilent_data.append((new_start, new_end, True))
-            start_time += max_interval
-        nonsilent_data.append((start_time, end_time, False))
-    return nonsilent_data
+def shorten_voice_old(pcm):
+    return silence.voice_chunks(pcm, 16000, config.settings['interval_split'] * 1000,
+                                int(config.settings['voice_silence']), buffer=int(config.settings['voice_silence']))
 
 
 def recogn(*,
@@ -58,13 +37,14 @@ def recogn(*,
             raise Exception(config.transobj["createdirerror"])
     if not tools.vail_file(audio_file):
         raise Exception(f'[error]not exists {audio_file}')
-    normalized_sound = AudioSegment.from_wav(audio_file)  # -20.0
+    # 16k 单声道 PCM，内存映射只读，按时间切片送入识别
+    pcm = pcmstore.load(audio_file, 16000)
     nonslient_file = f'{tmp_path}/detected_voice.json'
     if tools.vail_file(nonslient_file):
         with open(nonslient_file, 'r') as infile:
             nonsilent_data = json.load(infile)
     else:
-        nonsilent_data = shorten_voice_old(normalized_sound)
+        nonsilent_data = shorten_voice_old(pcm)
         with open(nonslient_file, 'w') as outfile:
             json.dump(nonsilent_data, outfile)
 
@@ -78,6 +58,10 @@ def recogn(*,
     except Exception as e:
         raise Exception(f'使用Google识别需要设置代理')
 
+    # 后台线程提前读入下一片段
+    audios = pcmstore.prefetch(pcm, 16000, [
+        (start, end + int(config.settings['voice_silence']) if start == end else end, buffered)
+        for start, end, buffered in nonsilent_data])
     for i, duration in enumerate(nonsilent_data):
         if config.exit_soft or (config.current_status != 'ing' and config.box_recogn != 'ing'):
             return False
@@ -85,23 +69,19 @@ def recogn(*,
         if start_time == end_time:
             end_time += int(config.settings['voice_silence'])
 
-        chunk_filename = tmp_path + f"/c{i}_{start_time // 1000}_{end_time // 1000}.wav"
-        audio_chunk = normalized_sound[start_time:end_time]
-        audio_chunk.export(chunk_filename, format="wav")
+        audio_chunk = next(audios)
 
         text = ""
         try:
-            with sr.AudioFile(chunk_filename) as source:
-                # Record the audio data
-                audio_data = recognizer.record(source)
-                try:
-                    # Recognize the speech
-                    text = recognizer.recognize_google(audio_data, language=detect_language)
-                except sr.UnknownValueError:
-                    text = ""
-                    print("Speech recognition could not understand the audio.")
-                except sr.RequestError as e:
-                    raise Exception(f"Google识别出错，请检查代理是否正确：{e}")
+            audio_data = sr.AudioData(pcmstore.to_int16(audio_chunk).tobytes(), 16000, 2)
+            try:
+                # Recognize the speech
+                text = recognizer.recognize_google(audio_data, language=detect_language)
+            except sr.UnknownValueError:
+                text = ""
+                print("Speech recognition could not understand the audio.")
+            except sr.RequestError as e:
+                raise Exception(f"Google识别出错，请检查代理是否正确：{e}")
         except Exception as e:
             raise Exception('Google识别出错：' + str(e.args))
 
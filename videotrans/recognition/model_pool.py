@@ -0,0 +1,191 @@
+# 语音识别模型池
+# 每次识别都重新加载模型，批量处理时每个视频都要等待加载并占用一次内存峰值
+# 已加载的模型按 (后端, 模型名, 设备, 计算类型, 线程数) 保存在进程内，同样参数的下次识别直接使用，
+# 占用估算超过 whisper_pool_size MB 时按最近使用时间卸载，空闲超过 whisper_pool_idle 秒的自动卸载
+# 同一个模型同时只借给一个任务，其他任务等待归还
+import gc
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from videotrans.configure import config
+from videotrans.util import tools
+
+# 各模型常驻内存的估算 MB，按模型名中包含的关键字匹配，未知的按 large 估算
+MODEL_MB = [
+    ('tiny', 150),
+    ('base', 300),
+    ('small', 900),
+    ('medium', 2500),
+    ('large', 4500),
+]
+# 空闲检查间隔秒
+CHECK_INTERVAL = 30
+
+
+class _Entry():
+
+    def __init__(self, key, model, size, load_time):
+        self.key = key
+        self.model = model
+        self.size = size
+        self.load_time = load_time
+        self.last_used = time.time()
+        self.lock = threading.Lock()
+        self.in_use = False
+
+
+_lock = threading.Lock()
+# key: _Entry
+_entries = {}
+# key: 加载锁
+_loading = {}
+_stats = {"hits": 0, "misses": 0, "load_time": 0.0, "evicted": 0}
+_reaper = []
+
+
+def estimate_mb(model_name, compute_type='default'):
+    name = model_name.lower()
+    size = next((mb for k, mb in MODEL_MB if k in name), MODEL_MB[-1][1])
+    # distil 模型层数较少
+    if 'distil' in name:
+        size //= 2
+    if 'int8' in str(compute_type):
+        size //= 2
+    return size
+
+
+# 借出模型，loader() 加载新模型，with 结束时归还，是否命中、加载耗时和命中率写入 btnkey 对应任务的日志
+# whisper_pool_size=0 时不保存模型，归还后立即卸载，和不使用模型池时相同
+@contextmanager
+def checkout(backend, model_name, *, device, loader, compute_type='default', cpu_threads=0, btnkey=""):
+    key = (backend, model_name, device, compute_type, cpu_threads)
+    start = time.time()
+    hit = True
+    while True:
+        with _lock:
+            entry = _entries.get(key)
+            loading = _loading.setdefault(key, threading.Lock())
+        if entry is None:
+            # 同一模型只加载一次，同时请求的任务等待加载完成后排队使用
+            with loading:
+                with _lock:
+                    exists = key in _entries
+                if not exists:
+                    entry = _load(key, model_name, compute_type, loader)
+                    hit = False
+                    break
+            continue
+        entry.lock.acquire()
+        # 等待期间可能已被卸载
+        with _lock:
+            if _entries.get(key) is entry:
+                _stats['hits'] += 1
+                break
+        entry.lock.release()
+    entry.in_use = True
+    msg = f'model_pool:{key=},{hit=},wait={time.time() - start:.1f}s,load_time={entry.load_time:.1f}s,{_summary()}'
+    if btnkey:
+        # 同时写入日志文件
+        tools.set_process(msg, btnkey=btnkey)
+    else:
+        config.logger.info(msg)
+    try:
+        yield entry.model
+    finally:
+        entry.in_use = False
+        entry.last_used = time.time()
+        entry.lock.release()
+        if int(config.settings['whisper_pool_size']) <= 0:
+            unload(key)
+        _start_reaper()
+
+
+def _load(key, model_name, compute_type, loader):
+    size = estimate_mb(model_name, compute_type)
+    # 先按预算卸载最久未用的模型，避免加载时同时占用两份内存
+    _evict(int(config.settings['whisper_pool_size']) - size)
+    start = time.time()
+    model = loader()
+    entry = _Entry(key, model, size, time.time() - start)
+    entry.lock.acquire()
+    with _lock:
+        _stats['misses'] += 1
+        _stats['load_time'] += entry.load_time
+        _entries[key] = entry
+    return entry
+
+
+# 卸载未在使用的模型，直到总占用不超过 limit MB
+def _evict(limit):
+    with _lock:
+        idle = sorted((it for it in _entries.values() if not it.in_use), key=lambda it: it.last_used)
+        total = sum(it.size for it in _entries.values())
+    for it in idle:
+        if total <= limit:
+            break
+        if unload(it.key):
+            total -= it.size
+
+
+# 卸载指定的模型，正在使用时返回 False
+def unload(key):
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None or not entry.lock.acquire(blocking=False):
+            return False
+        _entries.pop(key)
+        _stats['evicted'] += 1
+    entry.model = None
+    entry.lock.release()
+    config.logger.info(f'model_pool:unload {key=}')
+    gc.collect()
+    if key[2] == 'cuda' and 'torch' in sys.modules:
+        try:
+            sys.modules['torch'].cuda.empty_cache()
+        except Exception:
+            pass
+    return True
+
+
+# 卸载全部未在使用的模型
+def clear():
+    for key in list(_entries.keys()):
+        unload(key)
+
+
+# 后台线程定时卸载空闲超时的模型，全部卸载后退出
+def _start_reaper():
+    with _lock:
+        if not _entries or (_reaper and _reaper[0].is_alive()):
+            return
+        t = threading.Thread(target=_reap, daemon=True)
+        _reaper[:] = [t]
+    t.start()
+
+
+def _reap():
+    while True:
+        time.sleep(CHECK_INTERVAL)
+        idle = int(config.settings['whisper_pool_idle'])
+        with _lock:
+            if not _entries:
+                return
+            expired = [it.key for it in _entries.values() if not it.in_use and time.time() - it.last_used > idle]
+        for key in expired:
+            unload(key)
+
+
+def _summary():
+    total = _stats['hits'] + _stats['misses']
+    return (f"hits={_stats['hits']},misses={_stats['misses']},"
+            f"hit_rate={_stats['hits'] / total if total else 0:.0%},"
+            f"load_time_total={_stats['load_time']:.1f}s,loaded={len(_entries)}")
+
+
+# 当前状态和累计数据
+def stats():
+    with _lock:
+        return dict(_stats, loaded=[{"key": it.key, "size": it.size, "in_use": it.in_use,
+                                     "idle": round(time.time() - it.last_used, 1)} for it in _entries.values()])
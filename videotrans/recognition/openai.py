@@ -5,11 +5,10 @@ import re
 from datetime import timedelta
 
 import zhconv
-from pydub import AudioSegment
-from pydub.silence import detect_nonsilent
 
 from videotrans.configure import config
-from videotrans.util import tools
+from videotrans.util import tools, pcmstore
+from videotrans.recognition import model_pool
 import whisper
 from whisper.utils import get_writer
 
@@ -41,78 +40,82 @@ def recogn(*,
     
     raw_subtitles = []
 
-    model = whisper.load_model(
-            model_name,
-            device="cuda" if is_cuda else "cpu",
-            download_root=config.rootdir + "/models"
-        )
-    last_line=1
+    device = "cuda" if is_cuda else "cpu"
+    with model_pool.checkout('openai', model_name, device=device,
+                             btnkey=inst.init['btnkey'] if inst else "",
+                             loader=lambda: whisper.load_model(
+                                 model_name,
+                                 device=device,
+                                 download_root=config.rootdir + "/models")) as model:
+        last_line=1
     
-    inter=1200000
-    normalized_sound = AudioSegment.from_wav(audio_file)  # -20.0
-    total_length=1+(len(normalized_sound)//inter)
-
-    for i in range(total_length):
-
-        print(f'{i=}')
-        if config.exit_soft or (config.current_status != 'ing' and config.box_recogn != 'ing'):
-
-            return False
-        start_time=i*inter
-        if i<total_length-1:
-            end_time = start_time + inter
-        else:
-            end_time=len(normalized_sound)
-
-
-        chunk_filename = tmp_path + f"/c{i}_{start_time // 1000}_{end_time // 1000}.wav"
-        audio_chunk = normalized_sound[start_time:end_time]
-        audio_chunk.export(chunk_filename, format="wav")
-
-        text = ""
-        try:
-
-            result = model.transcribe(chunk_filename,
-                                  language=detect_language,
-                                  word_timestamps=True,
-                                  initial_prompt=config.settings['initial_prompt_zh'],
-                                  condition_on_previous_text=config.settings['condition_on_previous_text']
-            )
-            srtname=f'{end_time}.srt'
-
-            srt_writer = get_writer("srt", tmp_path)
-            srt_writer(result, srtname, {"max_line_count":1,"max_line_width":20 if detect_language.lower()[:2] in ['zh','ja','ko'] else 50})
-            with open(tmp_path+f'/{srtname}','r',encoding='utf-8') as f:
-                srt_text=f.read()
-            tmp_srts=tools.get_subtitle_from_srt(srt_text,is_file=False)
-            for n,it in enumerate(tmp_srts):
-                print(f'{it["text"]=}')
-                if detect_language[:2] == 'zh' and config.settings['zh_hant_s']:
-                    tmp_srts[n]['text'] = zhconv.convert(tmp_srts[n]['text'], 'zh-hans')
-
-                tmp_srts[n]['line']=n+last_line
-                tmp_srts[n]['start_time']+=start_time
-                tmp_srts[n]['end_time']+=start_time
-                tmp_srts[n]['endraw'] = tools.ms_to_time_string(ms=tmp_srts[n]['end_time'])
-                tmp_srts[n]['startraw'] = tools.ms_to_time_string(ms=tmp_srts[n]['start_time'])
-                tmp_srts[n]['time']=f"{tmp_srts[n]['startraw']} --> {tmp_srts[n]['endraw']}"
-            raw_subtitles+=tmp_srts
-
-
-            #clen=
-            last_line=len(raw_subtitles)
-            if set_p:
-                if inst and inst.precent < 75:
-                    inst.precent += 0.1
-                tools.set_process(f"{config.transobj['yuyinshibiejindu']} {last_line}/{total_length}", btnkey=inst.init['btnkey'] if inst else "")
-                
-                tools.set_process(srt_text, 'subtitle')
+        inter=1200000
+        # 16k 单声道 PCM，内存映射只读，按时间切片送入识别
+        pcm = pcmstore.load(audio_file, 16000)
+        audio_length = len(pcm) * 1000 // 16000
+        total_length=1+(audio_length//inter)
+        # 后台线程提前读入下一段
+        audios = pcmstore.prefetch(pcm, 16000, [(i * inter, min((i + 1) * inter, audio_length)) for i in range(total_length)])
+
+        for i in range(total_length):
+
+            print(f'{i=}')
+            if config.exit_soft or (config.current_status != 'ing' and config.box_recogn != 'ing'):
+
+                return False
+            start_time=i*inter
+            if i<total_length-1:
+                end_time = start_time + inter
             else:
-                tools.set_process_box(text=srt_text, type="set", func_name="shibie")
-        except Exception as e:
-            print(e)
-            #del model
-            raise Exception(str(e.args)+str(e))
+                end_time=audio_length
+
+
+            audio_chunk = next(audios)
+
+            text = ""
+            try:
+
+                result = model.transcribe(audio_chunk,
+                                      language=detect_language,
+                                      word_timestamps=True,
+                                      initial_prompt=config.settings['initial_prompt_zh'],
+                                      condition_on_previous_text=config.settings['condition_on_previous_text']
+                )
+                srtname=f'{end_time}.srt'
+
+                srt_writer = get_writer("srt", tmp_path)
+                srt_writer(result, srtname, {"max_line_count":1,"max_line_width":20 if detect_language.lower()[:2] in ['zh','ja','ko'] else 50})
+                with open(tmp_path+f'/{srtname}','r',encoding='utf-8') as f:
+                    srt_text=f.read()
+                tmp_srts=tools.get_subtitle_from_srt(srt_text,is_file=False)
+                for n,it in enumerate(tmp_srts):
+                    print(f'{it["text"]=}')
+                    if detect_language[:2] == 'zh' and config.settings['zh_hant_s']:
+                        tmp_srts[n]['text'] = zhconv.convert(tmp_srts[n]['text'], 'zh-hans')
+
+                    tmp_srts[n]['line']=n+last_line
+                    tmp_srts[n]['start_time']+=start_time
+                    tmp_srts[n]['end_time']+=start_time
+                    tmp_srts[n]['endraw'] = tools.ms_to_time_string(ms=tmp_srts[n]['end_time'])
+                    tmp_srts[n]['startraw'] = tools.ms_to_time_string(ms=tmp_srts[n]['start_time'])
+                    tmp_srts[n]['time']=f"{tmp_srts[n]['startraw']} --> {tmp_srts[n]['endraw']}"
+                raw_subtitles+=tmp_srts
+
+
+                #clen=
+                last_line=len(raw_subtitles)
+                if set_p:
+                    if inst and inst.precent < 75:
+                        inst.precent += 0.1
+                    tools.set_process(f"{config.transobj['yuyinshibiejindu']} {last_line}/{total_length}", btnkey=inst.init['btnkey'] if inst else "")
+                
+                    tools.set_process(srt_text, 'subtitle')
+                else:
+                    tools.set_process_box(text=srt_text, type="set", func_name="shibie")
+            except Exception as e:
+                print(e)
+                #del model
+                raise Exception(str(e.args)+str(e))
     if set_p:
         tools.set_process(f"{config.transobj['yuyinshibiewancheng']} / {len(raw_subtitles)}", 'logs',btnkey=inst.init['btnkey'] if inst else "")
     # 写入原语言字幕到目标文件夹
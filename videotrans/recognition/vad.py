@@ -0,0 +1,53 @@
+# 语音活动检测，每个任务只运行一次
+# 预先分割模式原来先按音量分割，每个片段识别时又以 vad_filter=True 对该片段运行一次 Silero VAD
+# 现在对整段音频运行一次 Silero VAD，语音区间保存在 detected_voice.json 同目录的 speech_segments.json，
+# 同时用于确定识别片段的边界和每个片段的 clip_timestamps，识别时关闭 faster-whisper 内置的 VAD
+import json
+
+import numpy as np
+
+from videotrans.configure import config
+from videotrans.util import tools
+
+SAMPLE_RATE = 16000
+
+
+# 返回整段音频的语音区间 [[开始ms, 结束ms]]，pcm 为 16k 单声道 float32 数组，结果缓存在 tmp_path 中
+def speech_segments(pcm, tmp_path):
+    cache_file = f'{tmp_path}/speech_segments.json'
+    if tools.vail_file(cache_file):
+        with open(cache_file, 'r') as f:
+            return json.load(f)
+    from faster_whisper.vad import VadOptions, get_speech_timestamps
+    options = VadOptions(
+        min_silence_duration_ms=config.settings['overall_silence'],
+        max_speech_duration_s=config.settings['overall_maxsecs'],
+        threshold=config.settings['overall_threshold'],
+        speech_pad_ms=config.settings['overall_speech_pad_ms'])
+    segments = [[it['start'] * 1000 // SAMPLE_RATE, -(-it['end'] * 1000 // SAMPLE_RATE)]
+                for it in get_speech_timestamps(np.asarray(pcm, dtype=np.float32), options)]
+    with open(cache_file, 'w') as f:
+        json.dump(segments, f)
+    return segments
+
+
+# 将语音区间合并为识别片段，间隔小于 min_silence_len ms 的相邻区间属于同一片段，超过 max_interval ms 的区间强制分割
+# 返回 (片段 [(开始ms, 结束ms, 是否强制分割)], 各片段的 clip_timestamps [开始秒, 结束秒, ...]，相对片段开始)
+def voice_chunks(segments, max_interval, min_silence_len):
+    groups = []
+    for start, end in segments:
+        if groups and start - groups[-1][-1][1] < min_silence_len and end - groups[-1][0][0] <= max_interval:
+            groups[-1].append([start, end])
+        else:
+            groups.append([[start, end]])
+    chunks, clips = [], []
+    for group in groups:
+        start_time, end_time = group[0][0], group[-1][1]
+        while end_time - start_time >= max_interval:
+            chunks.append((start_time, start_time + max_interval, True))
+            clips.append([0, max_interval / 1000])
+            start_time += max_interval
+        chunks.append((start_time, end_time, False))
+        clips.append([t for s, e in group if e > start_time
+                      for t in ((max(s, start_time) - start_time) / 1000, (e - start_time) / 1000)])
+    return chunks, clips
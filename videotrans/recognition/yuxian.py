@@ -6,31 +6,15 @@ from datetime import timedelta
 
 import zhconv
 from faster_whisper import WhisperModel
-from pydub import AudioSegment
-from pydub.silence import detect_nonsilent
 
 from videotrans.configure import config
-from videotrans.util import tools
+from videotrans.util import tools, pcmstore, silence
+from videotrans.recognition import model_pool, batched, vad
 
 
 # split audio by silence
-def shorten_voice(normalized_sound, max_interval=1200000):
-    normalized_sound = tools.match_target_amplitude(normalized_sound, -20.0)
-    nonsilent_data = []
-    audio_chunks = detect_nonsilent(normalized_sound, min_silence_len=int(config.settings['voice_silence']),
-                                    silence_thresh=-20 - 25)
-    for i, chunk in enumerate(audio_chunks):
-        start_time, end_time = chunk
-        n = 0
-        while end_time - start_time >= max_interval:
-            n += 1
-            # new_end = start_time + max_interval+buffer
-            new_end = start_time + max_interval
-            new_start = start_time
-            nonsilent_data.append((new_start, new_end, True))
-            start_time += max_interval
-        nonsilent_data.append((start_time, end_time, False))
-    return nonsilent_data
+def shorten_voice(pcm, max_interval=1200000):
+    return silence.voice_chunks(pcm, 16000, max_interval, int(config.settings['voice_silence']))
 
 
 def recogn(*,
@@ -55,16 +39,27 @@ def recogn(*,
             raise Exception(config.transobj["createdirerror"])
     if not tools.vail_file(audio_file):
         raise Exception(f'[error]not exists {audio_file}')
-    normalized_sound = AudioSegment.from_wav(audio_file)  # -20.0
+    # 16k 单声道 PCM，内存映射只读，按时间切片送入识别
+    pcm = pcmstore.load(audio_file, 16000)
     nonslient_file = f'{tmp_path}/detected_voice.json'
-    if tools.vail_file(nonslient_file):
+    clips = None
+    if config.settings['vad']:
+        # 只运行一次 VAD，语音区间同时决定片段边界和每个片段识别的时间段
+        if inst and inst.precent < 55:
+            inst.precent += 0.1
+        tools.set_process(config.transobj['qiegeshujuhaoshi'], btnkey=inst.init['btnkey'] if inst else "")
+        nonsilent_data, clips = vad.voice_chunks(vad.speech_segments(pcm, tmp_path), 1200000,
+                                                 int(config.settings['voice_silence']))
+        with open(nonslient_file, 'w') as outfile:
+            json.dump(nonsilent_data, outfile)
+    elif tools.vail_file(nonslient_file):
         with open(nonslient_file, 'r') as infile:
             nonsilent_data = json.load(infile)
     else:
         if inst and inst.precent < 55:
             inst.precent += 0.1
         tools.set_process(config.transobj['qiegeshujuhaoshi'], btnkey=inst.init['btnkey'] if inst else "")
-        nonsilent_data = shorten_voice(normalized_sound)
+        nonsilent_data = shorten_voice(pcm)
         with open(nonslient_file, 'w') as outfile:
             json.dump(nonsilent_data, outfile)
 
@@ -83,75 +78,70 @@ def recogn(*,
             inst.parent.status_text='下载模型中，用时可能较久' if config.defaulelang=='zh'else 'Download model from huggingface'
         else:
             inst.parent.status_text='加载或下载模型中，用时可能较久' if config.defaulelang=='zh'else 'Load model from local or download model from huggingface'
-    model = WhisperModel(
-            model_name,
-            device="cuda" if is_cuda else "cpu",
-            compute_type=com_type,
-            download_root=down_root,
-            local_files_only=local_res)
-    for i, duration in enumerate(nonsilent_data):
-        if config.exit_soft or (config.current_status != 'ing' and config.box_recogn != 'ing'):
-            #del model
-            return False
-        start_time, end_time, buffered = duration
-
-        chunk_filename = tmp_path + f"/c{i}_{start_time // 1000}_{end_time // 1000}.wav"
-        audio_chunk = normalized_sound[start_time:end_time]
-        audio_chunk.export(chunk_filename, format="wav")
+    device = "cuda" if is_cuda else "cpu"
+    with model_pool.checkout('faster', model_name, device=device, compute_type=com_type,
+                             btnkey=inst.init['btnkey'] if inst else "",
+                             loader=lambda: WhisperModel(
+                                 model_name,
+                                 device=device,
+                                 compute_type=com_type,
+                                 download_root=down_root,
+                                 local_files_only=local_res)) as model:
+        # 每 batch_size 个片段一组同时识别，取用某个片段的结果时才识别其所在的一组
+        results = batched.transcribe(model, pcm, nonsilent_data, clips,
+                                     beam_size=config.settings['beam_size'],
+                                     best_of=config.settings['best_of'],
+                                     condition_on_previous_text=config.settings['condition_on_previous_text'],
+                                     temperature=0 if config.settings['temperature'] == 0 else [0.0, 0.2, 0.4, 0.6, 0.8, 1.0],
+                                     vad_filter=False,
+                                     word_timestamps=True,
+                                     language=detect_language,
+                                     initial_prompt=config.settings['initial_prompt_zh'])
+        for i, duration in enumerate(nonsilent_data):
+            if config.exit_soft or (config.current_status != 'ing' and config.box_recogn != 'ing'):
+                #del model
+                return False
+            start_time, end_time, buffered = duration
 
-        if config.exit_soft or (config.current_status != 'ing' and config.box_recogn != 'ing'):
-            #del model
-            return False
-        text = ""
-        try:
-            segments, _ = model.transcribe(chunk_filename,
-                                           beam_size=config.settings['beam_size'],
-                                           best_of=config.settings['best_of'],
-                                           condition_on_previous_text=config.settings['condition_on_previous_text'],
-                                           temperature=0 if config.settings['temperature'] == 0 else [0.0, 0.2, 0.4, 0.6, 0.8, 1.0],
-                                           vad_filter=bool(config.settings['vad']),
-                                           vad_parameters=dict(
-                                               min_silence_duration_ms=config.settings['overall_silence'],
-                                               max_speech_duration_s=config.settings['overall_maxsecs'],
-                                               threshold=config.settings['overall_threshold'],
-                                                speech_pad_ms=config.settings['overall_speech_pad_ms']
-                                           ),
-                                           word_timestamps=True,
-                                           language=detect_language,
-                                           initial_prompt=config.settings['initial_prompt_zh'])
-            for t in segments:
-                if t.text == config.settings['initial_prompt_zh']:
-                    continue
-                start_time, end_time, buffered = duration
-                text = t.text
-                text = f"{text.capitalize()}. ".replace('&#39;', "'")
-                text = re.sub(r'&#\d+;', '', text).strip().strip('.')
-                if text == config.settings['initial_prompt_zh']:
-                    continue
-                if not text or re.match(r'^[，。、？‘’“”；：（｛｝【】）:;"\'\s \d`!@#$%^&*()_+=.,?/\\-]*$', text):
-                    continue
-                if detect_language[:2] == 'zh' and config.settings['zh_hant_s']:
-                    text = zhconv.convert(text, 'zh-hans')
-                end_time = start_time + t.words[-1].end * 1000
-                start_time += t.words[0].start * 1000
-                start = tools.ms_to_time_string(ms=start_time)
+            if config.exit_soft or (config.current_status != 'ing' and config.box_recogn != 'ing'):
+                #del model
+                return False
+            text = ""
+            try:
+                segments = next(results)
+                for t in segments:
+                    if t.text == config.settings['initial_prompt_zh']:
+                        continue
+                    start_time, end_time, buffered = duration
+                    text = t.text
+                    text = f"{text.capitalize()}. ".replace('&#39;', "'")
+                    text = re.sub(r'&#\d+;', '', text).strip().strip('.')
+                    if text == config.settings['initial_prompt_zh']:
+                        continue
+                    if not text or re.match(r'^[，。、？‘’“”；：（｛｝【】）:;"\'\s \d`!@#$%^&*()_+=.,?/\\-]*$', text):
+                        continue
+                    if detect_language[:2] == 'zh' and config.settings['zh_hant_s']:
+                        text = zhconv.convert(text, 'zh-hans')
+                    end_time = start_time + t.words[-1].end * 1000
+                    start_time += t.words[0].start * 1000
+                    start = tools.ms_to_time_string(ms=start_time)
 
-                end = tools.ms_to_time_string(ms=end_time)
+                    end = tools.ms_to_time_string(ms=end_time)
 
-                srt_line = {"line": len(raw_subtitles) + 1, "time": f"{start} --> {end}", "text": text}
-                raw_subtitles.append(srt_line)
-                if set_p:
-                    if inst and inst.precent < 55:
-                        inst.precent += 0.1
-                    tools.set_process(f"{config.transobj['yuyinshibiejindu']} {srt_line['line']}",
-                                      btnkey=inst.init['btnkey'] if inst else "")
-                    msg = f"{srt_line['line']}\n{srt_line['time']}\n{srt_line['text']}\n\n"
-                    tools.set_process(msg, 'subtitle')
-                else:
-                    tools.set_process_box(text=f"{srt_line['line']}\n{srt_line['time']}\n{srt_line['text']}\n\n", func_name="shibie", type="set")
-        except Exception as e:
-            #del model
-            raise Exception(str(e.args)+str(e))
+                    srt_line = {"line": len(raw_subtitles) + 1, "time": f"{start} --> {end}", "text": text}
+                    raw_subtitles.append(srt_line)
+                    if set_p:
+                        if inst and inst.precent < 55:
+                            inst.precent += 0.1
+                        tools.set_process(f"{config.transobj['yuyinshibiejindu']} {srt_line['line']}",
+                                          btnkey=inst.init['btnkey'] if inst else "")
+                        msg = f"{srt_line['line']}\n{srt_line['time']}\n{srt_line['text']}\n\n"
+                        tools.set_process(msg, 'subtitle')
+                    else:
+                        tools.set_process_box(text=f"{srt_line['line']}\n{srt_line['time']}\n{srt_line['text']}\n\n", func_name="shibie", type="set")
+            except Exception as e:
+                #del model
+                raise Exception(str(e.args)+str(e))
 
     if set_p:
         tools.set_process(f"{config.transobj['yuyinshibiewancheng']} / {len(raw_subtitles)}", 'logs',btnkey=inst.init['btnkey'] if inst else "")
@@ -0,0 +1,115 @@
+# 配音字幕表
+# 按列保存所有配音字幕的时间信息，每列一个 NumPy int64 数组，单位 ms
+# 去除静音、移除间隔、计算可用时长、视频延长后的偏移等步骤均为整列向量化计算，
+# 传递时切片共享数组或仅复制数组，不再 copy.deepcopy 整个字典列表，需要字典形式时用 to_dicts() 导出
+import numpy as np
+
+from videotrans.util import tools
+
+# 数值列
+# start_time/end_time 会随移除静音、间隔、加速变化，*_source 为原始字幕时间戳，视频慢速后随之延长
+# raw_duration 当前字幕区间时长，raw_duration_source 原始字幕区间时长，dubb_time 配音时长
+# video_extend -1代表未经过音频加速，仅仅进行视频慢速处理，0 代表无需视频慢速，>0 需要视频慢放增加的时长
+TIME_COLUMNS = ('start_time', 'end_time', 'start_time_source', 'end_time_source',
+                'raw_duration', 'raw_duration_source', 'dubb_time', 'video_extend')
+# 对象列，每行一个值
+OBJECT_COLUMNS = ('text', 'filename', 'trim')
+
+
+class CueTable():
+
+    def __init__(self, cues=None):
+        cues = cues or []
+        for name in TIME_COLUMNS:
+            setattr(self, name, np.round(np.array([it.get(name, 0) for it in cues], dtype=np.float64)).astype(np.int64))
+        # 是否需要音频加速
+        self.speed = np.array([bool(it.get('speed')) for it in cues], dtype=bool)
+        for name in OBJECT_COLUMNS:
+            setattr(self, name, [it.get(name) for it in cues])
+        # 其余不参与计算的字段，如 role rate volume pitch tts_type，导出时原样返回
+        skip = set(TIME_COLUMNS + OBJECT_COLUMNS + ('speed', 'startraw', 'endraw'))
+        self.extra = [{k: v for k, v in it.items() if k not in skip} for it in cues]
+
+    def __len__(self):
+        return len(self.start_time)
+
+    # 切片返回共享数组的视图，修改视图即修改原表，其他索引方式返回副本
+    def __getitem__(self, key):
+        table = CueTable.__new__(CueTable)
+        if not isinstance(key, slice):
+            key = np.asarray(key)
+        for name in TIME_COLUMNS + ('speed',):
+            setattr(table, name, getattr(self, name)[key])
+        for name in OBJECT_COLUMNS + ('extra',):
+            column = getattr(self, name)
+            setattr(table, name, column[key] if isinstance(key, slice) else [column[i] for i in np.arange(len(self))[key]])
+        return table
+
+    def copy(self):
+        table = CueTable.__new__(CueTable)
+        for name in TIME_COLUMNS + ('speed',):
+            setattr(table, name, getattr(self, name).copy())
+        for name in OBJECT_COLUMNS:
+            setattr(table, name, list(getattr(self, name)))
+        table.extra = [dict(it) for it in self.extra]
+        return table
+
+    # 导出为原有的字典列表形式，startraw/endraw 由当前 start_time/end_time 生成
+    def to_dicts(self):
+        cues = []
+        for i in range(len(self)):
+            it = dict(self.extra[i])
+            for name in TIME_COLUMNS:
+                it[name] = int(getattr(self, name)[i])
+            for name in OBJECT_COLUMNS:
+                it[name] = getattr(self, name)[i]
+            it['speed'] = bool(self.speed[i])
+            it['startraw'] = tools.ms_to_time_string(ms=it['start_time'])
+            it['endraw'] = tools.ms_to_time_string(ms=it['end_time'])
+            cues.append(it)
+        return cues
+
+    # 开始时间不早于上一条结束时间，结束时间不早于开始时间
+    # 逐条处理时 end[i]=max(end[i], start[i], end[i-1])，即 max(start, end) 的累积最大值
+    def fix_overlap(self):
+        if len(self) < 1:
+            return self
+        end = np.maximum.accumulate(np.maximum(self.start_time, self.end_time))
+        self.start_time[1:] = np.maximum(self.start_time[1:], end[:-1])
+        self.end_time[:] = end
+        return self
+
+    # 配音短于字幕区间时，字幕结束时间前移到配音结束处
+    def remove_srt_silence(self):
+        mask = (self.dubb_time > 0) & (self.dubb_time < self.raw_duration)
+        self.end_time[mask] -= self.raw_duration[mask] - self.dubb_time[mask]
+        self.raw_duration[mask] = self.dubb_time[mask]
+        return self
+
+    # 移除相邻字幕间大于 white_ms 的空白，每处移除 white_ms，white_ms=-1 时移除全部空白
+    # 前面的字幕整体前移后，相邻两条的间隔不变，因此每条的累计偏移只取决于原始间隔
+    def remove_white_ms(self, white_ms):
+        if len(self) < 2:
+            return self
+        gap = self.start_time[1:] - self.end_time[:-1]
+        diff = np.where(gap > white_ms, gap if white_ms < 0 else white_ms, 0)
+        offset = np.concatenate(([0], np.cumsum(diff)))
+        self.start_time -= offset
+        self.end_time -= offset
+        return self
+
+    # 每条配音可用时长，从本条开始到下一条开始，最后一条到视频结束
+    def able_time(self, video_time):
+        able = np.empty_like(self.start_time)
+        able[:-1] = self.start_time[1:] - self.start_time[:-1]
+        if len(able) > 0:
+            able[-1] = video_time - self.start_time[-1]
+        return able
+
+    # 视频慢速延长后，原字幕时间戳依次后移之前所有片段延长的时长
+    def apply_video_extend(self):
+        extend = np.maximum(self.video_extend, 0)
+        offset = np.cumsum(extend) - extend
+        self.start_time_source += offset
+        self.end_time_source += offset + extend
+        return self
@@ -5,7 +5,7 @@ from PySide6.QtCore import QThread, Signal as pyqtSignal
 
 from videotrans.configure import config
 from videotrans.tts import text_to_speech
-from videotrans.util import tools
+from videotrans.util import ffmpeg_pool, tools
 from videotrans.util.tools import pygameaudio
 from pathlib import Path
 
@@ -18,15 +18,17 @@ class PlayMp3(QThread):
         try:
             self.obj['voice_file']=self.obj['voice_file'].replace('%','')
             if not tools.vail_file(self.obj['voice_file']):
-                text_to_speech(
-                    text=self.obj['text'],
-                    role=self.obj['role'],
-                    tts_type=self.obj['tts_type'],
-                    filename=self.obj['voice_file'],
-                    play=True,
-                    volume=self.obj['volume'],
-                    pitch=self.obj['pitch'],
-                    language=self.obj['language'])
+                # 试听时的 ffmpeg 处理优先于后台任务的编码
+                with ffmpeg_pool.priority(ffmpeg_pool.HIGH):
+                    text_to_speech(
+                        text=self.obj['text'],
+                        role=self.obj['role'],
+                        tts_type=self.obj['tts_type'],
+                        filename=self.obj['voice_file'],
+                        play=True,
+                        volume=self.obj['volume'],
+                        pitch=self.obj['pitch'],
+                        language=self.obj['language'])
             else:
                 pygameaudio(self.obj['voice_file'])
         except Exception as e:
@@ -1,4 +1,3 @@
-import copy
 import hashlib
 import math
 import os
@@ -8,11 +7,14 @@ import textwrap
 import time
 from pathlib import Path
 
-from pydub import AudioSegment
+import numpy as np
 
 from videotrans import translator
 from videotrans.configure import config
-from videotrans.util import tools
+from videotrans.util import tools, duration, silence, pcmstore, segment_render, media_plan, burn_render, probe_cache
+from videotrans.util.timeline import AudioTimeline
+from videotrans.util.encoder import PcmEncoder
+from videotrans.task.cuetable import CueTable
 from videotrans.recognition import run as run_recogn
 from videotrans.translator import run as run_trans
 from videotrans.tts import run as run_tts
@@ -46,6 +48,7 @@ class Runstep():
             # 判断已存在的字幕文件中是否存在有效字幕纪录
             if self.config_params['app_mode']=='tiqu':
                 shutil.copy2(self.init['source_sub'], f"{self.obj['output']}/{self.obj['raw_noextname']}.srt")
+            pcmstore.remove(self.init['shibie_audio'])
             self._unlink(self.init['shibie_audio'])
             return True
 
@@ -69,6 +72,7 @@ class Runstep():
                 cache_folder=self.init['cache_folder'],
                 is_cuda=self.config_params['cuda'],
                 inst=self)
+            pcmstore.remove(self.init['shibie_audio'])
             self._unlink(self.init['shibie_audio'])
         except Exception as e:
             msg = f'{str(e)}{str(e.args)}'
@@ -236,100 +240,62 @@ class Runstep():
         return True
 
     def _merge_audio_segments(self, *, queue_tts=None, video_time=0):
-        merged_audio = AudioSegment.empty()
-        # start is not 0
-        if queue_tts[0]['start_time_source'] > 0:
-            silence = AudioSegment.silent(duration=queue_tts[0]['start_time_source'])
-            merged_audio += silence
-
+        # 按视频时长预先分配整条音轨，每个配音片段仅解码一次并写入其所在位置，静音部分无需写入
+        timeline = AudioTimeline(max(video_time, int(queue_tts.end_time_source[-1])))
 
         # 开始时间
-        cur=queue_tts[0]['start_time_source']
-        length=len(queue_tts)
-        for i, it in enumerate(queue_tts):
-
-            # 存在有效配音文件则加入，否则配音时长大于0则加入静音
-            segment=None
-            the_ext = it['filename'].split('.')[-1]
-
-            # 原始字幕时长
-            raw_source=it['end_time_source']-it['start_time_source']
-            if raw_source==0:
+        cur=int(queue_tts.start_time_source[0])
+        for i in range(len(queue_tts)):
+            start_source=int(queue_tts.start_time_source[i])
+            end_source=int(queue_tts.end_time_source[i])
+            # 原始字幕时长为0
+            if end_source==start_source:
                 continue
-            # 存在配音文件
-            if tools.vail_file(it['filename']):
-                segment = AudioSegment.from_file(it['filename'], format="mp4" if the_ext == 'm4a' else the_ext)
-                it['dubb_time']=len(segment)
-
-            else:
-                # 不存在配音文件
-                segment = AudioSegment.silent(duration=raw_source)
-                it['dubb_time']=raw_source
-
-            if i==0:
-                it['start_time']=it['start_time_source']
-                it['end_time']=it['start_time_source']+it['dubb_time']
-                cur=it['end_time']
-                merged_audio+=segment
+            # 存在有效配音文件则加入，否则该区间保持静音
+            segment=None
+            if tools.vail_file(queue_tts.filename[i]):
+                segment = timeline.load(queue_tts.filename[i])
+                if queue_tts.trim[i]:
+                    segment = segment.get_sample_slice(*queue_tts.trim[i])
+                queue_tts.dubb_time[i]=len(segment)
             else:
-                if it['start_time_source']<cur:
-                    # 如果开始时间和上一个结束片段重合
-                    it['start_time']=cur
-                    it['end_time']=it['start_time']+it['dubb_time']
-                    cur=it['end_time']
-                    merged_audio+=segment
-                elif it['start_time_source']>=cur:
-                    # 如果当前开始时间和上一个结束时间之间有间隔，则添加静音
-                    if it['start_time_source']>cur:
-                        merged_audio +=AudioSegment.silent(duration=it['start_time_source']-cur)
-                    it['start_time']=it['start_time_source']
-                    it['end_time']=it['start_time']+it['dubb_time']
-                    merged_audio+=segment
-                    cur=it['end_time']
-
-            if cur < it['end_time_source']:
-                merged_audio += AudioSegment.silent(duration=it['end_time_source']-cur)
-                cur=it['end_time_source']
-                it['end_time']=cur
-
-
-            print(f'{i=},{it["start_time_source"]=},{it["end_time_source"]=}')
-            print(f'{i=},{it["start_time"]=},{it["end_time"]=}')
-
-
-
-
-            it['startraw'] = tools.ms_to_time_string(ms=it['start_time'])
-            it['endraw'] = tools.ms_to_time_string(ms=it['end_time'])
-            queue_tts[i]=it
+                queue_tts.dubb_time[i]=end_source-start_source
+
+            # 如果开始时间和上一个结束片段重合，则从上一个结束时间开始，否则中间间隔保持静音
+            start=max(start_source,cur)
+            if segment is not None:
+                timeline.write(segment, start)
+            # 配音短于原字幕时，结束时间仍为原字幕结束时间
+            cur=max(start+int(queue_tts.dubb_time[i]),end_source)
+            queue_tts.start_time[i]=start
+            queue_tts.end_time[i]=cur
             tools.set_process(text=f"audio concat:{i}", btnkey=self.init['btnkey'])
 
-
-
-        print(f'合成音频后时长={len(merged_audio)},{video_time=}')
-        # 移除尾部静音
-
-        if not self.config_params['video_autorate'] and video_time > 0 and merged_audio and (len(merged_audio) < video_time):
+        audio_length=cur
+        print(f'合成音频后时长={audio_length},{video_time=}')
+        if not self.config_params['video_autorate'] and video_time > 0 and audio_length < video_time:
             # 末尾补静音
-            silence = AudioSegment.silent(duration=video_time - len(merged_audio))
-            merged_audio += silence
+            audio_length=video_time
 
         # 创建配音后的文件
+        # 整条音轨直接流式写入 ffmpeg 编码，不再导出 wav 临时文件
         try:
-            wavfile = self.init['cache_folder'] + "/target.wav"
-            merged_audio.export(wavfile, format="wav")
-
+            pcm = timeline.finish(audio_length)
             if self.config_params['app_mode'] == 'peiyin' and tools.vail_file(self.init['background_music']):
-                cmd = ['-y', '-i', wavfile, '-i', self.init['background_music'], '-filter_complex',
-                       "[0:a][1:a]amix=inputs=2:duration=first:dropout_transition=2", '-ac', '2',
-                       self.init['target_wav']]
-                tools.runffmpeg(cmd)
+                args = ['-i', Path(self.init['background_music']).as_posix(), '-filter_complex',
+                        "[0:a][1:a]amix=inputs=2:duration=first:dropout_transition=2", '-ac', '2']
             else:
-                tools.wav2m4a(wavfile, self.init['target_wav'])
+                args = ['-c:a', 'aac']
+            with PcmEncoder(self.init['target_wav'],
+                            frame_rate=timeline.frame_rate,
+                            channels=timeline.channels,
+                            args=args,
+                            is_cancelled=lambda: config.exit_soft or config.current_status != 'ing') as sink:
+                sink.write(pcm)
         except Exception as e:
             raise Exception(f'[error]merged_audio:{str(e)}')
-        print(f'合成音频返回时 {len(merged_audio)=}')
-        return len(merged_audio), queue_tts
+        print(f'合成音频返回时 {audio_length=}')
+        return audio_length, queue_tts
 
     # 保存字幕文件 到目标文件夹
     def _save_srt_target(self, srtstr, file):
@@ -375,6 +341,14 @@ class Runstep():
             rate = f"{rate}%"
         # 取出设置的每行角色
         line_roles = self.config_params["line_roles"] if "line_roles" in self.config_params else None
+        # clone-voice 音色片段从已解码的 44.1k PCM 中切片写出，不再逐条调用 ffmpeg
+        clone_pcm = None
+        if self.config_params['tts_type'] == 'clone-voice' and self.config_params['app_mode'] != 'peiyin':
+            if self.config_params['is_separate'] and not tools.vail_file(self.init['vocal']):
+                raise Exception(f"背景分离出错 {self.init['vocal']}")
+            if tools.vail_file(self.init['source_wav']):
+                clone_pcm = pcmstore.load(
+                    self.init['vocal'] if self.config_params['is_separate'] else self.init['source_wav'], 44100)
         # 取出每一条字幕，行号\n开始时间 --> 结束时间\n内容
         for i, it in enumerate(subs):
             # 判断是否存在单独设置的行角色，如果不存在则使用全局
@@ -382,27 +356,24 @@ class Runstep():
             if line_roles and f'{it["line"]}' in line_roles:
                 voice_role = line_roles[f'{it["line"]}']
             newrole = voice_role.replace('/', '-').replace('\\', '/')
-            filename = f'{i}-{newrole}-{self.config_params["voice_rate"]}-{self.config_params["voice_autorate"]}-{it["text"]}-{self.config_params["volume"].replace("%", "")}-{self.config_params["pitch"]}'
+            # 配音文件格式和采样率不同时不可复用缓存
+            filename = f'{i}-{newrole}-{self.config_params["voice_rate"]}-{self.config_params["voice_autorate"]}-{it["text"]}-{self.config_params["volume"].replace("%", "")}-{self.config_params["pitch"]}-{tools.tts_ext()}-{config.settings["tts_sample_rate"]}'
             md5_hash = hashlib.md5()
             md5_hash.update(f"{filename}".encode('utf-8'))
             # 要保存到的文件
             # clone-voice同时也是音色复制源
-            filename = self.init['cache_folder'] + "/" + md5_hash.hexdigest() + ".mp3"
+            filename = self.init['cache_folder'] + "/" + md5_hash.hexdigest() + "." + tools.tts_ext()
             # 如果是clone-voice类型， 需要截取对应片段
             if it['end_time'] <= it['start_time']:
                 continue
-            if self.config_params['tts_type'] == 'clone-voice':
-                if self.config_params['is_separate'] and not tools.vail_file(self.init['vocal']):
-                    raise Exception(f"背景分离出错 {self.init['vocal']}")
-                    # clone 方式文件为wav格式
-                if self.config_params['app_mode'] != 'peiyin' and tools.vail_file(self.init['source_wav']):
-                    tools.cut_from_audio(
-                        audio_file=self.init['vocal'] if self.config_params[
-                            'is_separate'] else self.init['source_wav'],
-                        ss=it['startraw'],
-                        to=it['endraw'],
-                        out_file=filename
-                    )
+            if clone_pcm is not None:
+                chunk = pcmstore.slice_ms(clone_pcm, 44100, it['start_time'], it['end_time'])
+                if filename.endswith('.wav'):
+                    pcmstore.write_wav(chunk, 44100, filename)
+                else:
+                    pcmstore.write_wav(chunk, 44100, filename + '.wav')
+                    tools.wav2mp3(filename + '.wav', filename)
+                    Path(filename + '.wav').unlink(missing_ok=True)
 
             queue_tts.append({
                 "text": it['text'],
@@ -418,166 +389,112 @@ class Runstep():
                 "filename": filename})
         return queue_tts
 
-    # 1. 将每个配音的实际长度加入 dubb_time
+    # 1. 将每个配音的实际长度加入 dubb_time，转为按列存储的 CueTable，后续各步骤均对其向量化处理
     def _add_dubb_time(self, queue_tts):
-        for i, it in enumerate(queue_tts):
-            tools.set_process(text=f"audio:{i}", btnkey=self.init['btnkey'])
-            # 防止开始时间比上个结束时间还小
-            if i > 0 and it['start_time'] < queue_tts[i - 1]['end_time']:
-                it['start_time'] = queue_tts[i - 1]['end_time']
-            # 防止结束时间小于开始时间
-            if it['end_time'] < it['start_time']:
-                it['end_time'] = it['start_time']
-            # 保存原始字幕时间戳
-            it['start_time_source'] = it['start_time']
-            it['end_time_source'] = it['end_time']
-            # 记录原始字幕区间时长,不随去除字幕间空白、加速等变化，永远固定
-            it['raw_duration_source'] = it['end_time'] - it['start_time']
-
-            # 会随去除字幕间空白、加速等变化
-            it['raw_duration'] = it['end_time'] - it['start_time']
-
-            # -1代表未经过音频加速，仅仅进行视频慢速处理
-            # 0 代表经过了音频慢速，但是视频无需加速
-            # >0 需要视频慢放到的实际时长
-            it['video_extend']=-1
-
-            # 记录实际配音后，未经任何处理的真实配音时长
-            if tools.vail_file(it['filename']):
-                the_ext = it['filename'].split('.')[-1]
-                it['dubb_time'] = len(
-                    AudioSegment.from_file(it['filename'], format="mp4" if the_ext == 'm4a' else the_ext))
-            else:
-                # 不存在配音
-                it['dubb_time'] = 0
-                it['video_extend']=0
-            queue_tts[i] = it
-
+        queue_tts = CueTable(queue_tts)
+        tools.set_process(text=f"audio:{len(queue_tts)}", btnkey=self.init['btnkey'])
+        # 并发读取所有配音文件头信息获取时长，无需解码
+        durations = duration.get_durations(queue_tts.filename)
+        # 需要去掉首尾静音时只计算采样偏移，不改写配音文件，加速和合并时按偏移截取
+        trims = silence.trim_offsets_many(queue_tts.filename) if config.settings['remove_silence'] else [None] * len(queue_tts)
+        # 防止开始时间比上个结束时间还小，防止结束时间小于开始时间
+        queue_tts.fix_overlap()
+        # 保存原始字幕时间戳
+        queue_tts.start_time_source[:] = queue_tts.start_time
+        queue_tts.end_time_source[:] = queue_tts.end_time
+        # 记录原始字幕区间时长,不随去除字幕间空白、加速等变化，永远固定
+        queue_tts.raw_duration_source[:] = queue_tts.end_time - queue_tts.start_time
+        # 会随去除字幕间空白、加速等变化
+        queue_tts.raw_duration[:] = queue_tts.raw_duration_source
+
+        # 记录实际配音后，未经任何处理的真实配音时长，去掉首尾静音时为截取后的时长
+        for i, trim in enumerate(trims):
+            queue_tts.trim[i] = None
+            if trim:
+                queue_tts.trim[i] = trim[:2]
+                durations[i] = int(round((trim[1] - trim[0]) * 1000 / trim[2]))
+        queue_tts.dubb_time[:] = np.maximum(durations, 0)
+
+        # -1代表未经过音频加速，仅仅进行视频慢速处理
+        # 0 代表经过了音频慢速，但是视频无需加速，或不存在配音
+        # >0 需要视频慢放到的实际时长
+        queue_tts.video_extend[:] = np.where(queue_tts.dubb_time > 0, -1, 0)
         return queue_tts
 
     # 2.  移除原字幕多于配音的时长，实际是字幕结束时间向前移动，和下一条之间的空白更加多了
     # 配音时长不变， end_time 时间戳变化， raw_duration变化
     def _remove_srt_silence(self, queue_tts):
-        # 如果需要移除多出来的静音
-        for i, it in enumerate(queue_tts):
-            # 配音小于 原时长，移除默认静音
-            if it['dubb_time'] > 0 and it['dubb_time'] < it['raw_duration']:
-                diff = it['raw_duration'] - it['dubb_time']
-                it['end_time'] -= diff
-                it['endraw']=tools.ms_to_time_string(ms=it['end_time'])
-                it['raw_duration'] = it['dubb_time']
-            queue_tts[i] = it
-        return queue_tts
+        return queue_tts.remove_srt_silence()
 
     #   移除2个字幕间的空白间隔 config.settings[remove_white_ms] ms
     # 配音时长不变。raw_duration不变
     def _remove_white_ms(self, queue_tts):
-        offset = 0
-        for i, it in enumerate(queue_tts):
-            if i > 0:
-                it['start_time'] -= offset
-                it['end_time'] -= offset
-                # 配音小于 原时长，移除默认静音
-                dt = it['start_time'] - queue_tts[i - 1]['end_time']
-                if dt > config.settings['remove_white_ms']:
-                    diff = config.settings['remove_white_ms'] if config.settings['remove_white_ms']>-1 else dt
-                    it['end_time'] -= diff
-                    it['start_time'] -= diff
-                    offset += diff
-                it['startraw']=tools.ms_to_time_string(ms=it['start_time'])
-                it['endraw']=tools.ms_to_time_string(ms=it['end_time'])
-                queue_tts[i] = it
-        return queue_tts
+        return queue_tts.remove_white_ms(config.settings['remove_white_ms'])
 
     # 2. 先对配音加速，每条字幕信息中写入加速倍数 speed和延长的时间 add_time
     def _ajust_audio(self, queue_tts):
-        # 遍历所有字幕条， 计算应该的配音加速倍数和延长的时间
-        length=len(queue_tts)
-        video_time = tools.get_video_duration(self.init['novoice_mp4'])
-        for i, it in enumerate(queue_tts):
-            # 是否需要音频加速
-            it['speed'] = False
-            # 存在配音时进行处理 没有配音
-            if it['dubb_time'] <= 0 or it['end_time'] == it['start_time']:
-                queue_tts[i] = it
-                continue
-
-            # 可用时长，从本片段开始到下一个片段开始
-            able_time=queue_tts[i+1]['start_time']-it['start_time'] if i<length-1 else video_time-it['start_time']
-            # 配音时长小于等于可用时长，无需加速
-            if it['dubb_time']<=able_time:
-                queue_tts[i]=it
-                continue
-
-            it['speed'] = True
-            queue_tts[i] = it
+        video_time = tools.get_video_duration(self.init['video_source'])
+        # 可用时长，从本片段开始到下一个片段开始
+        able_time = queue_tts.able_time(video_time)
+        dubb_time = queue_tts.dubb_time
+        # 存在配音，并且配音时长大于可用时长，需要音频加速
+        queue_tts.speed[:] = (dubb_time > 0) & (queue_tts.end_time != queue_tts.start_time) & (able_time > 0) & (dubb_time > able_time)
+        if not queue_tts.speed.any():
+            return queue_tts
 
         # 允许最大音频加速倍数
         max_speed=float(config.settings['audio_rate'])
-        for i, it in enumerate(queue_tts):
-            jindu = (length* 10) / (i + 1)
-            if self.precent + jindu < 95:
-                self.precent += jindu
-            # 不需要或不存在配音文件 跳过
-            if not it['speed'] or not tools.vail_file(it['filename']):
-                continue
-
-            tools.set_process(f"{config.transobj['dubbing speed up']} [{i}]",btnkey=self.init['btnkey'])
-
-            # 可用时长
-            able_time = queue_tts[i + 1]['start_time'] - it['start_time'] if i < length - 1 else video_time - it['start_time']
-            if it['dubb_time']<=able_time:
+        able_time = np.maximum(able_time, 1)
+        # 配音大于可用时长毫秒数
+        diff = dubb_time - able_time
+        # 如果加速到恰好等于 able_time 时长，需要加速的倍数
+        shound_speed = np.round(dubb_time / able_time, 2)
+        # 按最大倍数加速后的时长
+        max_extend = (dubb_time / max_speed).astype(np.int64)
+        # 仅处理音频加速，倍数不超过限制时加速到可用时长，否则按最大倍数加速
+        audio_extend = np.where(shound_speed <= max_speed, able_time, max_extend)
+        # 仅当开启视频慢速，shound_speed大于1.5，diff大于1s，才考虑视频慢速
+        if self.config_params['video_autorate'] and config.settings['video_rate']>1:
+            # 开启了视频慢速，音频加速一半，如果加速一半后仍然大于设定，则按最大倍数加速
+            half = dubb_time - diff // 2
+            half = np.where(np.round(dubb_time / np.maximum(half, 1), 2) > max_speed, max_extend, half)
+            audio_extend = np.where((diff > 1000) & (shound_speed > 1.5), half, audio_extend)
+
+        # 先计算所有需要加速片段的目标时长，再批量加速
+        speed_jobs=[]
+        for i in np.flatnonzero(queue_tts.speed):
+            # 不存在配音文件 跳过
+            if not tools.vail_file(queue_tts.filename[i]):
                 continue
-
-            # 配音大于可用时长毫秒数
-            diff=it['dubb_time']-able_time
-
-            # 如果加速到恰好等于 able_time 时长，需要加速的倍数
-            shound_speed=round(it['dubb_time']/able_time,2)
-
-            # 仅当开启视频慢速，shound_speed大于1.5，diff大于1s，才考虑视频慢速
-            if self.config_params['video_autorate'] and config.settings['video_rate']>1 and diff>1000 and shound_speed>1.5:
-                # 开启了视频慢速，音频加速一半
-                # 音频加速一半后实际时长应该变为
-                audio_extend=it['dubb_time']-int(diff/2)
-                print(f'[音频加速 视频慢速]音频处理，{audio_extend=}')
-                # 如果音频加速一半后仍然大于设定，则重新设定加速后音频时长
-                if round(it['dubb_time']/audio_extend,2)>max_speed:
-                    audio_extend=int(it['dubb_time']/max_speed)
-                    print(f'[音频加速 视频慢速]音频2次处理，{audio_extend=}')
-            else:
-                #仅处理音频加速
-                if shound_speed<=max_speed:
-                    audio_extend=able_time
-                else:
-                    audio_extend=int(it['dubb_time']/max_speed)
-                print(f'仅音频加速，{shound_speed=},{audio_extend=},{it["dubb_time"]=}')
-
-
-            # # 调整音频
-            tmp_mp3 = f'{it["filename"]}-speed.mp3'
-            tools.precise_speed_up_audio(file_path=it['filename'],
-                                         out=tmp_mp3,
-                                         target_duration_ms=audio_extend,
-                                         max_rate=100)
-
-            # 获取实际加速完毕后的真实配音时长，因为精确度原因，未必和上述计算出的一致
-            #如果视频需要变化，更新视频时长需要变化的长度
-            if tools.vail_file(tmp_mp3):
-                mp3_len = len(AudioSegment.from_file(tmp_mp3, format="mp3"))
-                it['filename'] = tmp_mp3
-                it['dubb_time'] = mp3_len
-            queue_tts[i] = it
+            speed_jobs.append((i, {
+                "file_path": queue_tts.filename[i],
+                "out": f'{queue_tts.filename[i]}-speed.{queue_tts.filename[i].split(".")[-1]}',
+                "trim": queue_tts.trim[i],
+                "duration_ms": int(dubb_time[i]),
+                "target_duration_ms": int(audio_extend[i]),
+                "max_rate": 100
+            }))
+
+        if len(speed_jobs) < 1:
+            return queue_tts
+        tools.set_process(f"{config.transobj['dubbing speed up']} [{len(speed_jobs)}]",btnkey=self.init['btnkey'])
+        results = tools.speed_up_audio_many([job for _, job in speed_jobs])
+        if self.precent < 90:
+            self.precent += 5
+        # 获取实际加速完毕后的真实配音时长，因为精确度原因，未必和上述计算出的一致
+        for (i, job), ok in zip(speed_jobs, results):
+            tmp_file = job['out']
+            if ok and tools.vail_file(tmp_file):
+                queue_tts.filename[i] = tmp_file
+                # 加速后的文件已去掉首尾静音
+                queue_tts.trim[i] = None
+                queue_tts.dubb_time[i] = duration.get_duration(tmp_file)
         return queue_tts
 
-
-
-
     # 视频慢速 在配音加速调整后，根据字幕实际开始结束时间，裁剪视频，慢速播放实现对齐
     def _ajust_video(self, queue_tts):
         if not self.config_params['video_autorate'] or config.settings['video_rate'] <= 1:
             return queue_tts
-        concat_txt_arr = []
         if not tools.is_novoice_mp4(self.init['novoice_mp4'], self.init['noextname']):
             raise Exception("not novoice mp4")
         # 获取视频时长
@@ -586,126 +503,73 @@ class Runstep():
 
         length=len(queue_tts)
         max_pts=config.settings['video_rate']
-        # 按照原始字幕截取
-        for i, it in enumerate(queue_tts):
-            jindu = (length * 10) / (i + 1)
+        start_source = queue_tts.start_time_source
+        end_source = queue_tts.end_time_source
+        # 视频需要和配音对齐，video_extend是需要增加的时长，可用时长为原字幕区间
+        queue_tts.video_extend[:] = queue_tts.dubb_time - (end_source - start_source)
+        # 按照原始字幕截取，先计算出全部片段的起止时间和慢速倍数，再并行编码
+        segments = []
+        for i in range(length):
+            # 和前一个片段之间有间隔需截取，第一个片段从视频开始处算起
+            prev_end = 0 if i == 0 else int(end_source[i - 1])
+            if start_source[i] > prev_end:
+                segments.append({"i": i, "ss": prev_end, "to": int(start_source[i]), "pts": "",
+                                 "out": self.init['cache_folder'] + f'/{i}-before.mp4'})
+                # 当前片段起始时间
+                st_time = int(start_source[i])
+            else:
+                st_time = prev_end
+
+            # 当前视频实际时长
+            cur_duration = int(end_source[i]) - st_time
+            # 是否需要延长视频
+            pts = ""
+            if queue_tts.video_extend[i] > 0:
+                pts = round((int(queue_tts.video_extend[i]) + cur_duration) / cur_duration, 2)
+                if pts > max_pts:
+                    print(f'{i=},{pts=} > {max_pts=}')
+                    pts = max_pts
+                    queue_tts.video_extend[i] = round(cur_duration * max_pts - cur_duration)
+                print(f'{i}/{length},{queue_tts.dubb_time[i]=},视频应延长{queue_tts.video_extend[i]}ms,pts={pts}')
+            segments.append({"i": i, "ss": st_time, "to": int(end_source[i]), "pts": pts, "duration": cur_duration,
+                             "out": self.init['cache_folder'] + f'/{i}-current.mp4'})
+            # 是最后一个，并且未到视频末尾
+            if i > 0 and i == length - 1 and end_source[i] < last_time:
+                segments.append({"i": i, "ss": int(end_source[i]), "to": None, "pts": "",
+                                 "out": self.init['cache_folder'] + f'/{i}-after.mp4'})
+
+        done = [0]
+
+        def _on_done(seg):
+            done[0] += 1
+            jindu = (len(segments) * 10) / done[0]
             if self.precent + jindu < 95:
                 self.precent += jindu
-
-            # 可用的时长
-            able_time=it['end_time_source']-it['start_time_source']
-            # 视频需要和配音对齐，video_extend是需要增加的时长
-            it['video_extend']=it['dubb_time']-able_time
-            queue_tts[i]=it
-
-            # 如果i==0即第一个视频，前面若是还有片段，需要截取
-            if i == 0:
-                #如果前面有大于 0 的片段，需截取
-                if it['start_time_source'] > 0:
-                    before_dst = self.init['cache_folder'] + f'/{i}-before.mp4'
-                    # 下一片段起始时间
-                    st_time=it['start_time_source']
-                    try:
-                        tools.cut_from_video(ss='00:00:00.000',
-                                             to=tools.ms_to_time_string(ms=it['start_time_source']),
-                                             source=self.init['novoice_mp4'],
-                                             out=before_dst)
-                        concat_txt_arr.append(before_dst)
-                    except Exception:
-                        pass
-                else:
-                    # 下一片段起始时间,从视频开始处
-                    st_time=0
-
-                # 当前视频实际时长
-                duration=it['end_time_source']- st_time
-                # 是否需要延长视频
-                pts=""
-                if it['video_extend']>0:
-                    pts=round((it['video_extend']+duration)/duration,2)
-                    if pts>max_pts:
-                        print(f'{i=},{pts=} > {max_pts=}')
-                        pts=max_pts
-                        it['video_extend']=duration*max_pts-duration
-                    print(f'{i}/{length},{it["dubb_time"]=},{able_time=},视频应延长{it["video_extend"]}ms,pts={pts}')
-                tools.set_process(f"{config.transobj['videodown..']} {pts=}",btnkey=self.init['btnkey'])
-                before_dst = self.init['cache_folder'] + f'/{i}-current.mp4'
-                try:
-                    tools.cut_from_video(
-                        ss= '00:00:00.000' if st_time==0 else tools.ms_to_time_string(ms=st_time),
-                         to=tools.ms_to_time_string(ms=it['end_time_source']),
-                         source=self.init['novoice_mp4'],
-                         pts=pts,
-                         out=before_dst
-                    )
-                    concat_txt_arr.append(before_dst)
-                    it['video_extend']=tools.get_video_duration(before_dst)-duration
-                except Exception:
-                    pass
-            else:
-                # 距离前面一个的时长
-                diff=it['start_time_source']-queue_tts[i - 1]['end_time_source']
-                if diff>0:
-                    before_dst = self.init['cache_folder'] + f'/{i}-before.mp4'
-                    st_time=it['start_time_source']
-                    try:
-                        tools.cut_from_video(
-                            ss=tools.ms_to_time_string(ms=queue_tts[i - 1]['end_time_source']),
-                             to=tools.ms_to_time_string(ms=it['start_time_source']),
-                             source=self.init['novoice_mp4'],
-                             out=before_dst
-                        )
-                        concat_txt_arr.append(before_dst)
-                    except Exception:
-                        pass
-                else:
-                    st_time=queue_tts[i - 1]['end_time_source']
-
-                # 是否需要延长视频
-                pts = ""
-                duration = it['end_time_source'] - st_time
-                if it['video_extend'] > 0:
-                    pts = round((it['video_extend']+duration) / duration, 2)
-                    if pts>max_pts:
-                        print(f'{i=},{pts=} > {max_pts=}')
-                        pts=max_pts
-                        it['video_extend']=duration*max_pts-duration
-                    print(f'{i}/{length},{it["dubb_time"]=},{able_time=},视频应延长{it["video_extend"]}ms,pts={pts}')
-                tools.set_process(f"{config.transobj['videodown..']} {pts=}",btnkey=self.init['btnkey'])
-                before_dst = self.init['cache_folder'] + f'/{i}-current.mp4'
-
-                try:
-                    tools.cut_from_video(ss=tools.ms_to_time_string(ms=st_time),
-                                         to=tools.ms_to_time_string(ms=it['end_time_source']),
-                                         source=self.init['novoice_mp4'],
-                                         pts=pts,
-                                         out=before_dst)
-                    concat_txt_arr.append(before_dst)
-                    it['video_extend']=tools.get_video_duration(before_dst)-duration
-
-                except Exception:
-                    pass
-                # 是最后一个，并且未到视频末尾
-                if i==length-1 and it['end_time_source']<last_time:
-                    # 最后一个
-                    before_dst = self.init['cache_folder'] + f'/{i}-after.mp4'
-                    try:
-                        tools.cut_from_video(ss=tools.ms_to_time_string(ms=it['end_time_source']),
-                                             source=self.init['novoice_mp4'],
-                                             out=before_dst)
-                        concat_txt_arr.append(before_dst)
-                    except Exception:
-                        pass
+            tools.set_process(f"{config.transobj['videodown..']} {done[0]}/{len(pieces or segments)} pts={seg['pts']}",
+                              btnkey=self.init['btnkey'])
+
+        # 未慢速的部分按关键帧直接复制，只编码慢速片段和衔接处
+        pieces = segment_render.plan_copy(segments, self.init['novoice_mp4']) if config.settings['video_stream_copy'] else None
+        if pieces:
+            for seg in segments:
+                if not seg['pts'] and 'duration' in seg:
+                    queue_tts.video_extend[seg['i']] = 0
+        concat_txt_arr = segment_render.render(
+            pieces or segments,
+            self.init['novoice_mp4'],
+            is_cancelled=lambda: config.exit_soft or config.current_status != 'ing',
+            on_done=_on_done,
+            btnkey=self.init['btnkey'])
+        if config.exit_soft or config.current_status != 'ing':
+            raise Exception('cancelled')
+        # 批量读取慢速后片段的实际时长
+        currents = [seg for seg in pieces or segments if seg['ok'] and 'duration' in seg]
+        for seg, ms in zip(currents, duration.get_durations([seg['out'] for seg in currents])):
+            if ms > 0:
+                queue_tts.video_extend[seg['i']] = ms - seg['duration']
 
         # 需要调整 原字幕时长，延长视频相当于延长了原字幕时长
-        offset=0
-        for i,it in enumerate(queue_tts):
-            it['start_time_source']+=offset
-            it['end_time_source']+=offset
-            if it['video_extend']>0:
-                it['end_time_source']+=it['video_extend']
-                offset+=it['video_extend']
-            queue_tts[i]=it
+        queue_tts.apply_video_extend()
 
         # 将所有视频片段连接起来
         new_arr = []
@@ -714,7 +578,8 @@ class Runstep():
                 new_arr.append(it)
         if len(new_arr) > 0:
             tools.set_process(f"连接视频片段..." if config.defaulelang == 'zh' else 'concat multi mp4 ...', btnkey=self.init['btnkey'])
-            tools.concat_multi_mp4(filelist=concat_txt_arr, out=self.init['novoice_mp4'])
+            if not pieces or not segment_render.concat_copy(concat_txt_arr, self.init['novoice_mp4']):
+                tools.concat_multi_mp4(filelist=concat_txt_arr, out=self.init['novoice_mp4'])
         return queue_tts
 
     def _exec_tts(self, queue_tts):
@@ -722,7 +587,7 @@ class Runstep():
             raise Exception(f'Queue tts length is 0')
         # 具体配音操作
         try:
-            run_tts(queue_tts=copy.deepcopy(queue_tts), language=self.init['target_language_code'], set_p=True,inst=self)
+            run_tts(queue_tts=list(queue_tts), language=self.init['target_language_code'], set_p=True,inst=self)
         except Exception as e:
             raise Exception(e)
 
@@ -744,21 +609,11 @@ class Runstep():
 
         # 如果仅需配音
         if self.config_params['app_mode'] == 'peiyin':
-            segments = []
-            start_times = []
-            for i, it in enumerate(queue_tts):
-                if it['dubb_time'] > 0 and tools.vail_file(it['filename']):
-                    the_ext = it['filename'].split('.')[-1]
-                    segments.append(
-                        AudioSegment.from_file(it['filename'], format="mp4" if the_ext == 'm4a' else the_ext))
-                    start_times.append(it['start_time'])
-                else:
-                    segments.append(AudioSegment.silent(duration=it['end_time'] - it['start_time']))
             self._merge_audio_segments(queue_tts=queue_tts)
             return True
 
         # 6.处理视频慢速
-        video_time = tools.get_video_duration(self.init['novoice_mp4'])
+        video_time = tools.get_video_duration(self.init['video_source'])
         print(f'视频慢速前时长{video_time=}')
         if self.config_params['video_autorate'] and config.settings['video_rate'] > 1:
             queue_tts = self._ajust_video(queue_tts)
@@ -766,17 +621,17 @@ class Runstep():
         # 获取 novoice_mp4的长度
         if not tools.is_novoice_mp4(self.init['novoice_mp4'], self.init['noextname']):
             raise Exception("not novoice mp4")
-        video_time = tools.get_video_duration(self.init['novoice_mp4'])
+        video_time = tools.get_video_duration(self.init['video_source'])
         print(f'视频慢速后时长{video_time=}')
         audio_length, queue_tts = self._merge_audio_segments(
             video_time=video_time,
-            queue_tts=copy.deepcopy(queue_tts))
+            queue_tts=queue_tts.copy())
 
 
 
         # 更新字幕
         srt = ""
-        for (idx, it) in enumerate(queue_tts):
+        for (idx, it) in enumerate(queue_tts.to_dicts()):
             if not config.settings['force_edit_srt']:
                 it['startraw'] = tools.ms_to_time_string(ms=it['start_time_source'])
                 it['endraw'] = tools.ms_to_time_string(ms=it['end_time_source'])
@@ -794,6 +649,7 @@ class Runstep():
         tools.set_process(f'{config.transobj["shipinmoweiyanchang"]} {duration_ms}ms', btnkey=self.init['btnkey'])
         if not tools.is_novoice_mp4(self.init['novoice_mp4'], self.init['noextname']):
             raise Exception("not novoice mp4")
+        self._create_novoice()
 
         video_time = tools.get_video_duration(self.init['novoice_mp4'])
         shutil.copy2(self.init['novoice_mp4'],self.init['novoice_mp4']+".raw.mp4")
@@ -834,42 +690,47 @@ class Runstep():
         Path(f"{self.init['novoice_mp4']}.raw.mp4").unlink(missing_ok=True)
         return True
 
+    # 需要修改画面但此前直接使用原视频、未生成 novoice.mp4 时，先分离出来
+    def _create_novoice(self):
+        if self.init['video_source'] == self.init['novoice_mp4']:
+            return
+        tools.split_novoice_byraw(self.init['video_source'], self.init['novoice_mp4'], self.init['noextname'],
+                                  "copy" if self.init['h264'] else f"libx{self.video_codec}")
+        self.init['video_source'] = self.init['novoice_mp4']
+
     # 添加背景音乐
     def _back_music(self):
         if self.config_params['app_mode'] not in ["hebing", "tiqu", "peiyin"] and self.config_params[
             'voice_role'] != 'No' and tools.vail_file(self.init['target_wav']) and tools.vail_file(
             self.init['background_music']):
             try:
+                # 同时读取视频和背景音乐信息
+                probe_cache.probe_many([self.init['video_source'], self.init['background_music']])
                 # 获取视频长度
-                vtime = tools.get_video_info(self.init['novoice_mp4'], video_time=True)
+                vtime = tools.get_video_info(self.init['video_source'], video_time=True)
                 vtime /= 1000
                 # 获取音频长度
                 atime = tools.get_audio_time(self.init['background_music'])
-                # 转为m4a
-                if not self.init['background_music'].lower().endswith('.m4a'):
-                    tmpm4a = self.init['cache_folder'] + f"/background_music-1.m4a"
-                    tools.wav2m4a(self.init['background_music'], tmpm4a)
-                    self.init['background_music'] = tmpm4a
                 beishu = vtime / atime
+                # 循环播放由 -stream_loop 完成，降低音量时一次编码，无需先转 m4a 再连接
+                loop_args = []
                 if config.settings['loop_backaudio'] and beishu > 1 and vtime - 1 > atime:
-                    beishu = int(beishu)
-                    # 获取延长片段
-                    # 背景音频连接延长片段
-                    tools.concat_multi_audio(filelist=[self.init['background_music'] for n in range(beishu + 1)],
-                                             out=self.init['cache_folder'] + "/background_music-2.m4a")
-                    self.init['background_music'] = self.init['cache_folder'] + "/background_music-2.m4a"
+                    loop_args = ['-stream_loop', f'{int(beishu)}']
+                plan = media_plan.Plan(f"{self.init['noextname']}-background", duration=vtime)
                 # 背景音频降低音量
-                tools.runffmpeg(
-                    ['-y', '-i', self.init['background_music'], "-filter:a",
-                     f"volume={config.settings['backaudio_volume']}",
-                     '-c:a', 'aac',
-                     self.init['cache_folder'] + f"/background_music-3.m4a"])
+                plan.ffmpeg('background', source=self.init['background_music'], input_args=loop_args,
+                            output=self.init['cache_folder'] + f"/background_music-3.m4a",
+                            args=["-filter:a", f"volume={config.settings['backaudio_volume']}", '-c:a', 'aac'])
                 # 背景音频和配音合并
-                cmd = ['-y', '-i', self.init['target_wav'], '-i',
-                       self.init['cache_folder'] + f"/background_music-3.m4a",
-                       '-filter_complex', "[0:a][1:a]amix=inputs=2:duration=first:dropout_transition=2", '-ac', '2',
-                       self.init['cache_folder'] + f"/lastend.m4a"]
-                tools.runffmpeg(cmd)
+                plan.ffmpeg('lastend', inputs=[(self.init['target_wav'], []), ('background', [])],
+                            output=self.init['cache_folder'] + f"/lastend.m4a",
+                            args=['-filter_complex', "[0:a][1:a]amix=inputs=2:duration=first:dropout_transition=2",
+                                  '-ac', '2'])
+                if config.settings['media_plan_dry_run']:
+                    # 只显示执行计划和预估耗时，不添加背景音乐
+                    tools.set_process(plan.run(['lastend'], dry_run=True), btnkey=self.init['btnkey'])
+                    return
+                plan.run(['lastend'])
                 self.init['target_wav'] = self.init['cache_folder'] + f"/lastend.m4a"
             except Exception as e:
                 config.logger.error(f'添加背景音乐失败:{str(e)}')
@@ -878,8 +739,9 @@ class Runstep():
         if self.config_params['is_separate'] and tools.vail_file(self.init['target_wav']):
             try:
                 # 原始背景音乐 wav,和配音后的文件m4a合并
+                probe_cache.probe_many([self.init['video_source'], self.init['instrument']])
                 # 获取视频长度
-                vtime = tools.get_video_info(self.init['novoice_mp4'], video_time=True)
+                vtime = tools.get_video_info(self.init['video_source'], video_time=True)
                 vtime /= 1000
                 # 获取音频长度
                 atime = tools.get_audio_time(self.init['instrument'])
@@ -899,6 +761,32 @@ class Runstep():
             except Exception as e:
                 config.logger.error('合并原始背景失败' + config.transobj['Error merging background and dubbing'] + str(e))
 
+    # 分段并行烧录硬字幕，hard_srt 为当前目录下的 ass 字幕，成功返回不含音频的视频，否则返回 None
+    def _burn_hard_srt(self, video_source, hard_srt):
+        # 和 novoice.mp4 同在临时目录，视频来源可能是用户的原视频
+        mp4_dirpath = Path(self.init['novoice_mp4']).parent.resolve().as_posix()
+        # 字幕时间用于只重新编码含字幕的部分
+        try:
+            cues = tools.get_subtitle_from_srt(mp4_dirpath + "/tmp.srt")
+        except Exception:
+            cues = None
+        return burn_render.burn(
+            video_source,
+            hard_srt,
+            mp4_dirpath + "/hard_srt.mp4",
+            cues=cues,
+            is_cancelled=lambda: config.exit_soft or config.current_status != 'ing',
+            on_done=lambda i, total: tools.set_process(
+                f"{config.transobj['peiyin-yingzimu']} {i + 1}/{total}", btnkey=self.init['btnkey']))
+
+    # 硬字幕时的视频输入和视频编码参数，分段烧录成功时直接复制，否则整体编码时嵌入字幕
+    def _hard_srt_video(self, video_source, hard_srt):
+        burned = self._burn_hard_srt(video_source, hard_srt)
+        if burned:
+            return burned, ["-c:v", "copy"]
+        return video_source, ["-c:v", f"libx{self.video_codec}", "-vf", f"subtitles={hard_srt}",
+                              '-crf', f'{config.settings["crf"]}', '-preset', config.settings['preset']]
+
     # 最终合成视频 source_mp4=原始mp4视频文件，noextname=无扩展名的视频文件名字
     def _compos_video(self):
         if self.config_params['app_mode'] in ['tiqu', 'peiyin']:
@@ -907,9 +795,9 @@ class Runstep():
         # 判断novoice_mp4是否完成
         if not tools.is_novoice_mp4(self.init['novoice_mp4'], self.init['noextname']):
             raise Exception(config.transobj['fenlinoviceerror'])
-        # 无声音视频 或 合并模式时原视频
+        # 无声音视频 或 无需修改画面、合并模式时原视频
         novoice_mp4_path = Path(self.init['novoice_mp4'])
-        novoice_mp4 = Path(self.init['novoice_mp4']).as_posix()
+        video_source = Path(self.init['video_source']).as_posix()
         # 视频目录，用于硬字幕时进入工作目录
         mp4_dirpath = novoice_mp4_path.parent.resolve()
 
@@ -983,26 +871,44 @@ class Runstep():
         # 如果是合并字幕模式 双字幕强制为单
         if self.config_params['app_mode'] == 'hebing':
             if self.config_params['subtitle_type'] in [1, 3]:
-                tools.runffmpeg([
-                    "-y",
-                    "-i",
-                    novoice_mp4,
-                    "-c:v",
-                    f"libx{self.video_codec}",
-                    "-vf",
-                    f"subtitles={hard_srt}",
-                    '-crf',
-                    f'{config.settings["crf"]}',
-                    '-preset',
-                    config.settings['preset'],
-                    Path(self.init['targetdir_mp4']).as_posix(),
-                ])
+                burned = self._burn_hard_srt(video_source, hard_srt)
+                if burned:
+                    # 分段烧录的视频不含音频，音频取自原视频
+                    tools.runffmpeg([
+                        "-y",
+                        "-i",
+                        burned,
+                        "-i",
+                        video_source,
+                        "-map",
+                        "0:v:0",
+                        "-map",
+                        "1:a:0?",
+                        "-c:v",
+                        "copy",
+                        Path(self.init['targetdir_mp4']).as_posix(),
+                    ])
+                else:
+                    tools.runffmpeg([
+                        "-y",
+                        "-i",
+                        video_source,
+                        "-c:v",
+                        f"libx{self.video_codec}",
+                        "-vf",
+                        f"subtitles={hard_srt}",
+                        '-crf',
+                        f'{config.settings["crf"]}',
+                        '-preset',
+                        config.settings['preset'],
+                        Path(self.init['targetdir_mp4']).as_posix(),
+                    ])
             else:
                 # 软字幕
                 tools.runffmpeg([
                     "-y",
                     "-i",
-                    novoice_mp4,
+                    video_source,
                     "-i",
                     soft_srt,
                     "-c:v",
@@ -1018,6 +924,7 @@ class Runstep():
                 novoice_mp4_path.unlink(missing_ok=True)
                 hard_srt_path.unlink(missing_ok=True)
                 Path(mp4_dirpath.as_posix() + "/tmp.srt.ass").unlink(missing_ok=True)
+                Path(mp4_dirpath.as_posix() + "/hard_srt.mp4").unlink(missing_ok=True)
             except Exception:
                 pass
             return True
@@ -1063,7 +970,7 @@ class Runstep():
         self._separate()
         # 有配音 延长视频或音频对齐
         if self.config_params['voice_role'] != 'No' and self.config_params['append_video']:
-            video_time = tools.get_video_duration(novoice_mp4)
+            video_time = tools.get_video_duration(video_source)
             try:
                 audio_length = int(tools.get_audio_time(self.init['target_wav']) * 1000)
             except Exception:
@@ -1084,12 +991,26 @@ class Runstep():
                     print(f'{config.transobj["moweiyanchangshibai"]}:{str(e)}')
                     config.logger.error(f'视频末尾延长失败:{str(e)}')
             elif audio_length > 0 and video_time > audio_length:
-                ext = self.init['target_wav'].split('.')[-1]
-                m = AudioSegment.from_file(
-                    self.init['target_wav'],
-                    format="mp4" if ext == 'm4a' else ext) + AudioSegment.silent(
-                    duration=video_time - audio_length)
-                m.export(self.init['target_wav'], format="mp4" if ext == 'm4a' else ext)
+                # 解码后连同末尾静音流式写入编码器，先输出到临时文件，成功后替换
+                pcm, frame_rate = silence.read_pcm(self.init['target_wav'])
+                tmp_wav = self.init['target_wav'] + '.pad.' + self.init['target_wav'].split('.')[-1]
+                with PcmEncoder(tmp_wav,
+                                frame_rate=frame_rate,
+                                channels=pcm.shape[1],
+                                args=['-c:a', 'aac'] if not tmp_wav.endswith('.wav') else ['-c:a', 'pcm_s16le'],
+                                is_cancelled=lambda: config.exit_soft or config.current_status != 'ing') as sink:
+                    sink.write(pcm)
+                    sink.write_silence(video_time - audio_length)
+                os.replace(tmp_wav, self.init['target_wav'])
+        # 末尾延长后改为读取 novoice.mp4
+        video_source = Path(self.init['video_source']).as_posix()
+        # 原视频可能含有音频和字幕流，只使用其中的第一个视频流
+        # 原视频不是 h264 mp4 时不能直接复制视频流，以当前的编码参数编码一次
+        if video_source == Path(self.init['novoice_mp4']).as_posix() or self.init['h264']:
+            copy_video = ["-c:v", "copy"]
+        else:
+            copy_video = ["-c:v", f"libx{self.video_codec}", '-crf', f'{config.settings["crf"]}', '-preset',
+                          config.settings['preset']]
         try:
             subtitle_language = translator.get_subtitle_code(show_target=self.config_params['target_language'])
             # 有配音有字幕
@@ -1097,22 +1018,20 @@ class Runstep():
                 if self.config_params['subtitle_type'] in [1, 3]:
                     tools.set_process(config.transobj['peiyin-yingzimu'], btnkey=self.init['btnkey'])
                     # 需要配音+硬字幕
+                    video_input, video_args = self._hard_srt_video(video_source, hard_srt)
                     tools.runffmpeg([
                         "-y",
                         "-i",
-                        novoice_mp4,
+                        video_input,
                         "-i",
                         Path(self.init['target_wav']).as_posix(),
-                        "-c:v",
-                        f"libx{self.video_codec}",
+                        "-map",
+                        "0:v:0",
+                        "-map",
+                        "1:a:0",
+                        *video_args,
                         "-c:a",
                         "aac",
-                        "-vf",
-                        f"subtitles={hard_srt}",
-                        '-crf',
-                        f'{config.settings["crf"]}',
-                        '-preset',
-                        config.settings['preset'],
                         Path(self.init['targetdir_mp4']).as_posix()
                     ])
                 else:
@@ -1121,13 +1040,18 @@ class Runstep():
                     tools.runffmpeg([
                         "-y",
                         "-i",
-                        novoice_mp4,
+                        video_source,
                         "-i",
                         Path(self.init['target_wav']).as_posix(),
                         "-i",
                         soft_srt,
-                        "-c:v",
-                        "copy",
+                        "-map",
+                        "0:v:0",
+                        "-map",
+                        "1:a:0",
+                        "-map",
+                        "2:s:0",
+                        *copy_video,
                         "-c:a",
                         "aac",
                         "-c:s",
@@ -1142,11 +1066,14 @@ class Runstep():
                 tools.runffmpeg([
                     "-y",
                     "-i",
-                    novoice_mp4,
+                    video_source,
                     "-i",
                     Path(self.init['target_wav']).as_posix(),
-                    "-c:v",
-                    "copy",
+                    "-map",
+                    "0:v:0",
+                    "-map",
+                    "1:a:0",
+                    *copy_video,
                     "-c:a",
                     "aac",
                     Path(self.init['targetdir_mp4']).as_posix()
@@ -1154,29 +1081,24 @@ class Runstep():
             # 硬字幕无配音  原始 wav合并
             elif self.config_params['subtitle_type'] in [1, 3]:
                 tools.set_process(config.transobj['onlyyingzimu'], btnkey=self.init['btnkey'])
+                video_input, video_args = self._hard_srt_video(video_source, hard_srt)
                 cmd = [
                     "-y",
                     "-i",
-                    novoice_mp4
+                    video_input
                 ]
                 if tools.vail_file(self.init['source_wav']):
                     cmd.append('-i')
                     cmd.append(Path(self.init['source_wav']).as_posix())
+                cmd += ['-map', '0:v:0']
+                if tools.vail_file(self.init['source_wav']):
+                    cmd += ['-map', '1:a:0']
 
-                cmd.append('-c:v')
-                cmd.append(f'libx{self.video_codec}')
+                cmd += video_args
                 if tools.vail_file(self.init['source_wav']):
                     cmd.append('-c:a')
                     cmd.append('aac')
-                cmd += [
-                    "-vf",
-                    f"subtitles={hard_srt}",
-                    '-crf',
-                    f'{config.settings["crf"]}',
-                    '-preset',
-                    config.settings['preset'],
-                    Path(self.init['targetdir_mp4']).as_posix(),
-                ]
+                cmd.append(Path(self.init['targetdir_mp4']).as_posix())
                 tools.runffmpeg(cmd)
             elif self.config_params['subtitle_type'] in [2, 4]:
                 # 软字幕无配音
@@ -1185,7 +1107,7 @@ class Runstep():
                 cmd = [
                     "-y",
                     "-i",
-                    novoice_mp4
+                    video_source
                 ]
                 # 原配音流
                 if tools.vail_file(self.init['source_wav']):
@@ -1195,9 +1117,14 @@ class Runstep():
                 cmd += [
                     "-i",
                     soft_srt,
-                    "-c:v",
-                    "copy"
+                    "-map",
+                    "0:v:0"
                 ]
+                if tools.vail_file(self.init['source_wav']):
+                    cmd += ["-map", "1:a:0", "-map", "2:s:0"]
+                else:
+                    cmd += ["-map", "1:s:0"]
+                cmd += copy_video
                 if tools.vail_file(self.init['source_wav']):
                     cmd.append('-c:a')
                     cmd.append('aac')
@@ -1265,6 +1192,7 @@ Docs: https://pyvideotrans.com
             novoice_mp4_path.unlink(missing_ok=True)
             hard_srt_path.unlink(missing_ok=True)
             Path(mp4_dirpath.as_posix() + "/tmp.srt.ass").unlink(missing_ok=True)
+            Path(mp4_dirpath.as_posix() + "/hard_srt.mp4").unlink(missing_ok=True)
         except:
             pass
         self.precent = 100
@@ -5,7 +5,7 @@ import time
 from videotrans.configure import config
 from videotrans.task.step import Runstep
 from videotrans.translator import get_audio_code
-from videotrans.util import tools
+from videotrans.util import media_plan, tools, pcmstore
 from pathlib import Path
 
 
@@ -76,6 +76,8 @@ class TransCreate():
 
         # 拆分后的无声mp4
         self.init['novoice_mp4'] = None
+        # 读取视频画面的文件，不需要修改画面时为原视频，否则为 novoice_mp4
+        self.init['video_source'] = None
         # 原语言字幕
         self.init['source_sub'] = None
         # 目标语言字幕
@@ -168,6 +170,7 @@ class TransCreate():
             self.init['detect_language'] = get_audio_code(show_source=self.config_params['source_language'])
 
         self.init['novoice_mp4'] = f"{self.init['target_dir']}/novoice.mp4"
+        self.init['video_source'] = self.init['novoice_mp4']
         self.init['source_sub'] = f"{self.init['target_dir']}/{self.init['source_language_code']}.srt"
         self.init['target_sub'] = f"{self.init['target_dir']}/{self.init['target_language_code']}.srt"
         # 原wav
@@ -277,55 +280,128 @@ class TransCreate():
         if self.config_params['app_mode'] == 'peiyin':
             return True
 
-        # 合并字幕时不分离，直接复制
+        # 合并字幕时不分离，直接读取原视频
         if self.config_params['app_mode'] == 'hebing':
-            shutil.copy2(self.obj['source_mp4'], self.init['novoice_mp4'])
+            self.init['video_source'] = self.obj['source_mp4']
             config.queue_novice[self.init['noextname']] = 'end'
             return True
 
+        # 源视频的各项读取写入同一执行计划，读取同一文件的合并为一次 ffmpeg，
+        # 无声视频、原音轨、识别用的 16k PCM、分离用的 44.1k 音频只需读取解码一次
+        video_time = (self.init.get('video_info') or {}).get('time', 0)
+        plan = media_plan.Plan(self.init['noextname'], duration=video_time / 1000)
+        dry_run = config.settings['media_plan_dry_run']
+        targets = []
         # 不是 提取字幕时，需要分离出视频
-        if self.config_params['app_mode'] not in ['tiqu']:
+        # 不慢速视频时画面不会被修改，合成时直接读取原视频的视频流，无需生成 novoice.mp4
+        if self.config_params['app_mode'] not in ['tiqu'] and not (
+                self.config_params['video_autorate'] and config.settings['video_rate'] > 1):
+            self.init['video_source'] = self.obj['source_mp4']
+            config.queue_novice[self.init['noextname']] = 'end'
+        elif self.config_params['app_mode'] not in ['tiqu']:
             config.queue_novice[self.init['noextname']] = 'ing'
-            threading.Thread(target=tools.split_novoice_byraw,
-                             args=(self.obj['source_mp4'],
-                                   self.init['novoice_mp4'],
-                                   self.init['noextname'],
-                                   "copy" if self.init['h264'] else f"libx{self.video_codec}")) \
-                .start()
+            if self.init['h264']:
+                # 直接复制视频流，耗时很短，和提取音频一起进行
+                targets.append(plan.ffmpeg('novoice', source=self.obj['source_mp4'], output=self.init['novoice_mp4'],
+                                           args=["-an", "-c:v", "copy"], weight=media_plan.COPY))
+            elif not dry_run:
+                # 需要重新编码，耗时较长，后台单独进行，识别无需等待
+                threading.Thread(target=tools.split_novoice_byraw,
+                                 args=(self.obj['source_mp4'],
+                                       self.init['novoice_mp4'],
+                                       self.init['noextname'],
+                                       f"libx{self.video_codec}",
+                                       video_time)) \
+                    .start()
         else:
             config.queue_novice[self.init['noextname']] = 'end'
 
-        # 添加是否保留背景选项
-        if self.config_params['is_separate'] and not tools.vail_file(self.init['vocal']):
-            # 背景分离音
-            try:
-                tools.set_process(config.transobj['Separating background music'], btnkey=self.init['btnkey'])
-                self.status_text = config.transobj['Separating background music']
-                tools.split_audio_byraw(self.obj['source_mp4'], self.init['source_wav'], True,
-                                        btnkey=self.init['btnkey'])
-            except Exception as e:
-                pass
-            finally:
-                if not tools.vail_file(self.init['vocal']):
-                    self.init['instrument'] = None
-                    self.init['vocal'] = None
-                    self.config_params['is_separate'] = False
-                else:
-                    # 分离成功后转为8k待识别音频
-                    tools.conver_to_8k(self.init['vocal'], self.init['shibie_audio'])
-        # 不分离，或分离失败
+        targets.append(plan.ffmpeg('source_wav', source=self.obj['source_mp4'], output=self.init['source_wav'],
+                                   args=["-vn", "-ac", "1", "-c:a", "aac"]))
+        # 添加是否保留背景选项，已分离过的 vocal.wav 直接使用，此时不再提取分离用的音频
+        if self.config_params['is_separate']:
+            tools.set_process(config.transobj['Separating background music'], btnkey=self.init['btnkey'])
+            self.status_text = config.transobj['Separating background music']
+            raw = plan.ffmpeg('separate_wav', source=self.obj['source_mp4'],
+                              output=config.TEMP_DIR + f"/{time.time()}/raw.wav",
+                              args=["-vn", "-ac", "2", "-ar", "44100", "-c:a", "pcm_s16le"], weight=media_plan.PCM)
+            Path(plan.nodes[raw].output).parent.mkdir(parents=True, exist_ok=True)
+            targets.append(plan.call('vocal', fn=self._separate_vocal, inputs=[raw], output=self.init['vocal'],
+                                     weight=media_plan.SEPARATE, reuse=True))
+        else:
+            self.status_text = config.transobj['kaishitiquyinpin']
+            # 不分离时识别音频直接来自源视频，同时写出 shibie.wav 和内存映射用的 PCM
+            targets.append(plan.ffmpeg('shibie', source=self.obj['source_mp4'], output=self.init['shibie_audio'],
+                                       args=["-vn", "-ac", "1", "-ar", "16000", "-c:a", "pcm_s16le"],
+                                       weight=media_plan.PCM))
+            pcm_files = {16000: pcmstore.temp_file(self.obj['source_mp4'], 16000)}
+            if self.config_params['tts_type'] == 'clone-voice' and self.config_params['app_mode'] != 'tiqu':
+                pcm_files[44100] = pcmstore.temp_file(self.obj['source_mp4'], 44100)
+            for rate, file in pcm_files.items():
+                targets.append(plan.ffmpeg(f'pcm{rate}', source=self.obj['source_mp4'], output=file,
+                                           args=pcmstore.output_args(rate), weight=media_plan.PCM))
+        status_text = self.status_text
+
+        def _progress(names, sec):
+            if video_time <= 0:
+                return
+            percent = min(99, int(sec * 100000 / video_time))
+            self.status_text = f'{status_text} {percent}%'
+            if 'novoice' in names:
+                config.queue_novice_progress[self.init['noextname']] = percent
+
+        if dry_run:
+            # 只显示执行计划和预估耗时，不执行，任务停止
+            tools.set_process(plan.run(targets, dry_run=True), btnkey=self.init['btnkey'])
+            if config.queue_novice.get(self.init['noextname']) == 'ing':
+                config.queue_novice[self.init['noextname']] = 'error'
+            raise Exception('media_plan_dry_run=true')
+        try:
+            plan.run(targets, on_progress=_progress)
+            if 'novoice' in targets:
+                config.queue_novice[self.init['noextname']] = 'end'
+        except Exception as e:
+            if 'novoice' in targets:
+                config.queue_novice[self.init['noextname']] = 'error'
+            config.logger.error(f'提取音频失败:{str(e)}')
+            raise Exception(
+                '从视频中提取声音失败，请检查视频中是否含有音轨，或该视频是否存在编码问题' if config.defaulelang == 'zh' else 'Failed to extract sound from video, please check if the video contains an audio track or if there is an encoding problem with that video')
+        self.status_text = status_text
         if not self.config_params['is_separate']:
-            try:
-                self.status_text = config.transobj['kaishitiquyinpin']
-                tools.split_audio_byraw(self.obj['source_mp4'], self.init['source_wav'])
-                tools.conver_to_8k(self.init['source_wav'], self.init['shibie_audio'])
-            except Exception as e:
-                raise Exception(
-                    '从视频中提取声音失败，请检查视频中是否含有音轨，或该视频是否存在编码问题' if config.defaulelang == 'zh' else 'Failed to extract sound from video, please check if the video contains an audio track or if there is an encoding problem with that video')
+            pcmstore.adopt(pcm_files[16000], 16000, self.init['shibie_audio'])
+            if 44100 in pcm_files:
+                pcmstore.adopt(pcm_files[44100], 44100, self.init['source_wav'])
+        elif tools.vail_file(self.init['vocal']):
+            # 解码人声，同时得到16k待识别音频
+            self._create_pcm_store(self.init['vocal'])
+        else:
+            # 分离失败时不保留背景
+            self.init['instrument'] = None
+            self.init['vocal'] = None
+            self.config_params['is_separate'] = False
+            self._create_pcm_store(self.init['source_wav'])
         if self.obj and self.obj['output'] != self.obj['linshi_output'] and tools.vail_file(self.init['source_wav']):
             shutil.copy2(self.init['source_wav'], f"{self.obj['output']}/{Path(self.init['source_wav']).name}")
         return True
 
+    # 分离人声和背景音，失败时不保留背景，继续处理
+    def _separate_vocal(self, raw):
+        from videotrans.separate import st
+        try:
+            tools.set_process(config.transobj['Separating vocals and background music, which may take a longer time'],
+                              btnkey=self.init['btnkey'])
+            st.start(audio=raw, path=self.init['target_dir'], btnkey=self.init['btnkey'])
+        except Exception as e:
+            tools.set_process(f"separate vocal and background music:{str(e)}", btnkey=self.init['btnkey'])
+        return tools.vail_file(self.init['vocal'])
+
+    # 音频只解码一次，16k 供识别并写出 shibie.wav，clone-voice 时另存 44.1k 供截取音色片段
+    # 之后各环节以内存映射方式读取切片
+    def _create_pcm_store(self, audio):
+        pcmstore.create(audio, 16000, wav=self.init['shibie_audio'])
+        if self.config_params['tts_type'] == 'clone-voice' and self.config_params['app_mode'] != 'tiqu':
+            pcmstore.create(audio, 44100)
+
     def _unlink(self, file):
         try:
             Path(file).unlink(missing_ok=True)
@@ -1,4 +1,3 @@
-import copy
 import os
 import threading
 from videotrans.configure import config
@@ -83,7 +82,7 @@ def _azuretts(queue_tts,language=None,set_p=False,inst=None):
         tools.set_process(f"AzureTTS...", btnkey=inst.init['btnkey'] if inst else "")
 
 def run(*, queue_tts=None, language=None, set_p=True, inst=None):
-    queue_tts_copy=copy.deepcopy(queue_tts)
+    queue_tts_copy=list(queue_tts)
     # 需要并行的数量3
     n_total = len(queue_tts)
     if n_total<1:
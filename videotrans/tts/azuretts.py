@@ -2,7 +2,7 @@ import json
 import time
 
 from videotrans.configure import config
-from videotrans.util import tools
+from videotrans.util import tools, silence, audio_io
 import os
 import azure.cognitiveservices.speech as speechsdk
 
@@ -78,32 +78,22 @@ def get_voice(*,text=None, role=None, volume="+0%",pitch="+0Hz",rate=None, langu
 
         if speech_synthesis_result.reason == speechsdk.ResultReason.SynthesizingAudioCompleted:
             if not is_list:
-                tools.wav2mp3(filename + ".wav", filename)
-                if tools.vail_file(filename) and config.settings['remove_silence']:
-                    tools.remove_silence_from_end(filename)
+                tools.save_tts_audio(filename + ".wav", filename)
                 if set_p and inst and inst.precent < 80:
                     inst.precent += 0.1
                     tools.set_process(f'{config.transobj["kaishipeiyin"]} ', btnkey=inst.init['btnkey'] if inst else "")
                 return True
 
+            # 整段音频只读取一次，按书签位置切片写出每条配音
+            samples, frame_rate = silence.read_pcm(filename+".wav")
             length=len(bookmarks)
             for i,it in enumerate(bookmarks):
                 if i >= len(text):
                     continue
-                cmd=[
-                        "-y",
-                        "-i",
-                        filename+".wav",
-                        "-ss",
-                        str(it['time'] / 1000)
-                ]
-                if i < length-1:
-                    cmd+=[
-                        "-t",
-                        str( (bookmarks[i+1]['time']-it['time']) / 1000)
-                    ]
-                cmd+=[text[i]['filename']]
-                tools.runffmpeg(cmd)
+                start=int(it['time'] * frame_rate / 1000)
+                end=int(bookmarks[i+1]['time'] * frame_rate / 1000) if i < length-1 else len(samples)
+                audio_io.write_pcm(samples[start:end], frame_rate, text[i]['filename'],
+                                   out_rate=int(config.settings['tts_sample_rate']) if text[i]['filename'].endswith('.wav') else None)
         elif speech_synthesis_result.reason == speechsdk.ResultReason.Canceled:
             cancellation_details = speech_synthesis_result.cancellation_details
             if cancellation_details.reason == speechsdk.CancellationReason.Error:
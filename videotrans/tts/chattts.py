@@ -1,4 +1,3 @@
-import os
 import re
 import shutil
 import time
@@ -33,7 +32,7 @@ def get_voice(*,text=None, role="2222",rate=None, volume="+0%",pitch="+0Hz", lan
                 return True
             raise Exception(f'{res}')
         if api_url.find('127.0.0.1')>-1 or api_url.find('localhost')>-1:
-            tools.wav2mp3(re.sub(r'\\{1,}','/',res['filename']),filename)
+            tools.save_tts_audio(re.sub(r'\\{1,}','/',res['filename']),filename,remove_src=False)
         else:
             resb=requests.get(res['url'])
             if resb.status_code!=200:
@@ -42,11 +41,7 @@ def get_voice(*,text=None, role="2222",rate=None, volume="+0%",pitch="+0Hz", lan
             with open(filename+".wav",'wb') as f:
                 f.write(resb.content)
             time.sleep(1)
-            tools.wav2mp3(filename+".wav",filename)
-            if os.path.exists(filename+".wav"):
-                os.unlink(filename+".wav")
-            if tools.vail_file(filename) and config.settings['remove_silence']:
-                tools.remove_silence_from_end(filename)
+            tools.save_tts_audio(filename+".wav",filename)
             if set_p and inst and inst.precent < 80:
                 inst.precent += 0.1
                 tools.set_process(f'{config.transobj["kaishipeiyin"]} ', btnkey=inst.init['btnkey'] if inst else "")
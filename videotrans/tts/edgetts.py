@@ -34,12 +34,14 @@ def get_voice(*,
         pitch='+0Hz'
     communicate = edge_tts.Communicate(text, role, rate=rate,volume=volume,pitch=pitch)
     try:
-        asyncio.run(communicate.save(filename))
+        # 引擎输出为 mp3，配音文件为 wav 格式时先保存为临时 mp3 再转换
+        raw=filename if filename.endswith('.mp3') else filename+'.mp3'
+        asyncio.run(communicate.save(raw))
+        if tools.vail_file(raw):
+            tools.save_tts_audio(raw,filename)
         if not tools.vail_file(filename):
             config.logger.error( f'edgeTTS配音失败:{text=},{filename=}')
             return True
-        if tools.vail_file(filename) and config.settings['remove_silence']:
-            tools.remove_silence_from_end(filename)
         if set_p and inst and inst.precent<80:
             inst.precent+=0.1
             tools.set_process(f'{config.transobj["kaishipeiyin"]} ',btnkey=inst.init['btnkey'] if inst else "")
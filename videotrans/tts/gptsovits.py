@@ -45,11 +45,7 @@ def get_voice(*,text=None, role=None,rate=None, volume="+0%",pitch="+0Hz", langu
             time.sleep(1)
             if not os.path.exists(filename+".wav"):
                 raise Exception(f'GPT-SoVITS合成声音失败-2:{text=}')
-            tools.wav2mp3(filename+".wav",filename)
-            if os.path.exists(filename+".wav"):
-                os.unlink(filename+".wav")
-            if tools.vail_file(filename) and config.settings['remove_silence']:
-                tools.remove_silence_from_end(filename)
+            tools.save_tts_audio(filename+".wav",filename)
             if set_p and inst and inst.precent < 80:
                 inst.precent += 0.1
                 tools.set_process(f'{config.transobj["kaishipeiyin"]} ', btnkey=inst.init['btnkey'] if inst else "")
@@ -31,9 +31,11 @@ def get_voice(*,text=None, role=None, volume="+0%",pitch="+0Hz", rate=None, lang
             language=f'{lans[0]}-{lans[1].upper()}'
 
         response = gTTS(text,lang=language,lang_check=False)
-        response.save(filename)
-        if tools.vail_file(filename) and config.settings['remove_silence']:
-            tools.remove_silence_from_end(filename)
+        # 引擎输出为 mp3，配音文件为 wav 格式时先保存为临时 mp3 再转换
+        raw=filename if filename.endswith('.mp3') else filename+'.mp3'
+        response.save(raw)
+        if tools.vail_file(raw):
+            tools.save_tts_audio(raw,filename)
         if set_p and inst and inst.precent<80:
             inst.precent+=0.1
             tools.set_process(f'{config.transobj["kaishipeiyin"]} ',btnkey=inst.init['btnkey'] if inst else "")
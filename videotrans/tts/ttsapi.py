@@ -47,10 +47,12 @@ def get_voice(*,text=None, role=None, volume="+0%",pitch="+0Hz",rate=None, langu
         res=requests.get(url)
         if res.status_code!=200:
             raise Exception(f'TTS-API:{url}')
-        with open(filename,'wb') as f:
+        # 接口通常输出 mp3，配音文件为 wav 格式时先保存为临时文件再转换
+        raw=filename if filename.endswith('.mp3') else filename+'.mp3'
+        with open(raw,'wb') as f:
             f.write(res.content)
-        if tools.vail_file(filename) and config.settings['remove_silence']:
-            tools.remove_silence_from_end(filename)
+        if tools.vail_file(raw):
+            tools.save_tts_audio(raw,filename)
         if set_p and inst and inst.precent < 80:
             inst.precent += 0.1
             tools.set_process(f'{config.transobj["kaishipeiyin"]} ', btnkey=inst.init['btnkey'] if inst else "")
@@ -0,0 +1,212 @@
+# 音频格式转换、截取
+# pyav 后端在当前进程内用 PyAV 解码、重采样、编码，无需为每个小文件启动一次 ffmpeg 进程
+# ffmpeg 后端即原有的 runffmpeg 子进程方式
+# 后端由 config.settings['audio_io_backend'] 选择，未安装 av、格式不在支持范围内或 PyAV 处理出错时自动使用 ffmpeg
+import importlib.util
+import os
+from fractions import Fraction
+from pathlib import Path
+
+import numpy as np
+
+from videotrans.configure import config
+
+# pyav 后端支持的输出格式及编码器
+# mp3 编码耗时主要在 lame 本身，PyAV 自带的 lame 比 ffmpeg 命令慢，仍交给 ffmpeg
+PYAV_CODECS = {"wav": "pcm_s16le", "m4a": "aac", "aac": "aac"}
+# pyav 后端支持的输入格式，其他格式交给 ffmpeg
+PYAV_INPUTS = ("wav", "mp3", "m4a", "aac", "flac", "ogg", "opus", "mp4", "webm", "pcm")
+
+
+# 当前使用的后端 pyav 或 ffmpeg
+def backend():
+    if config.settings['audio_io_backend'] != 'pyav':
+        return 'ffmpeg'
+    if importlib.util.find_spec('av') is None:
+        return 'ffmpeg'
+    return 'pyav'
+
+
+def _ext(file):
+    return Path(file).suffix.lower()[1:]
+
+
+# src 转为 dst，格式由 dst 扩展名决定
+# rate 采样率、channels 声道数，为 None 时保持不变，ss/to 截取的起止秒数
+def convert(src, dst, *, rate=None, channels=None, ss=None, to=None):
+    src = Path(src).as_posix()
+    dst = Path(dst).as_posix()
+    if backend() == 'pyav' and _ext(dst) in PYAV_CODECS and _ext(src) in PYAV_INPUTS and (channels or 1) <= 2:
+        try:
+            return _pyav_convert(src, dst, rate=rate, channels=channels, ss=ss, to=to)
+        except Exception as e:
+            config.logger.error(f'pyav 处理失败，改用 ffmpeg:{src=},{dst=},{e}')
+            Path(dst).unlink(missing_ok=True)
+    return _ffmpeg_convert(src, dst, rate=rate, channels=channels, ss=ss, to=to)
+
+
+# int16 数组 shape=(帧数, 声道数) 写入 dst，out_rate 不为 None 时重采样
+def write_pcm(samples, frame_rate, dst, *, out_rate=None):
+    dst = Path(dst).as_posix()
+    samples = np.asarray(samples, dtype=np.int16)
+    if samples.ndim == 1:
+        samples = samples.reshape(-1, 1)
+    out_rate = int(out_rate or frame_rate)
+    ext = _ext(dst)
+    if ext == 'wav' and out_rate == frame_rate:
+        import wave
+        with wave.open(dst, 'wb') as f:
+            f.setnchannels(samples.shape[1])
+            f.setsampwidth(2)
+            f.setframerate(frame_rate)
+            f.writeframes(np.ascontiguousarray(samples).tobytes())
+        return dst
+    if backend() == 'pyav' and ext in PYAV_CODECS and samples.shape[1] <= 2:
+        try:
+            return _pyav_write(samples, frame_rate, dst, out_rate)
+        except Exception as e:
+            config.logger.error(f'pyav 写入失败，改用 ffmpeg:{dst=},{e}')
+            Path(dst).unlink(missing_ok=True)
+    # 先写出 wav 再由 ffmpeg 转换
+    tmp = f'{dst}-{os.getpid()}.wav'
+    write_pcm(samples, frame_rate, tmp)
+    try:
+        return _ffmpeg_convert(tmp, dst, rate=out_rate if out_rate != frame_rate else None)
+    finally:
+        Path(tmp).unlink(missing_ok=True)
+
+
+def _ffmpeg_convert(src, dst, *, rate=None, channels=None, ss=None, to=None):
+    from videotrans.util import tools
+    cmd = ["-y", "-i", src]
+    if ss is not None:
+        cmd += ["-ss", f"{ss:.3f}"]
+    if to is not None:
+        cmd += ["-to", f"{to:.3f}"]
+    if channels:
+        cmd += ["-ac", f"{channels}"]
+    if rate:
+        cmd += ["-ar", f"{rate}"]
+    if _ext(dst) == 'wav':
+        cmd += ["-c:a", "pcm_s16le"]
+    elif _ext(dst) in ('m4a', 'aac'):
+        cmd += ["-c:a", "aac"]
+    tools.runffmpeg(cmd + [dst])
+    return dst
+
+
+def _layout(channels):
+    return 'mono' if channels == 1 else 'stereo'
+
+
+def _open_output(dst, rate, channels):
+    import av
+    out = av.open(dst, 'w')
+    stream = out.add_stream(PYAV_CODECS[_ext(dst)], rate=rate)
+    stream.codec_context.layout = _layout(channels)
+    return out, stream
+
+
+# 将 s16 交错数组编码写入，pts 以采样数计
+def _encode(out, stream, samples, rate, pts):
+    import av
+    frame = av.AudioFrame.from_ndarray(np.ascontiguousarray(samples).reshape(1, -1), format='s16',
+                                       layout=_layout(samples.shape[1]))
+    frame.sample_rate = rate
+    frame.pts = pts
+    frame.time_base = Fraction(1, rate)
+    for packet in stream.encode(frame):
+        out.mux(packet)
+
+
+def _flush(out, stream):
+    for packet in stream.encode(None):
+        out.mux(packet)
+    out.close()
+
+
+def _pyav_convert(src, dst, *, rate=None, channels=None, ss=None, to=None):
+    import av
+    # 16bit wav 直接读取，av.open 探测输入格式的耗时比转换本身还长
+    if _ext(src) == 'wav':
+        pcm = _read_wav(src)
+        if pcm is not None:
+            samples, frame_rate = pcm
+            rate = int(rate or frame_rate)
+            start = int(round(ss * rate)) if ss else 0
+            end = int(round(to * rate)) if to is not None else None
+            return _pyav_write(samples, frame_rate, dst, rate, channels=channels, start=start, end=end)
+    with av.open(src) as inp:
+        if not inp.streams.audio:
+            raise Exception(f'no audio stream {src}')
+        in_stream = inp.streams.audio[0]
+        rate = int(rate or in_stream.codec_context.sample_rate)
+        channels = int(channels or min(in_stream.codec_context.channels, 2))
+        resampler = av.AudioResampler(format='s16', layout=_layout(channels), rate=rate)
+        # 和 ffmpeg 输出端 -ss/-to 相同，从头解码，按输出采样位置截取
+        start = int(round(ss * rate)) if ss else 0
+        end = int(round(to * rate)) if to is not None else None
+        out, stream = _open_output(dst, rate, channels)
+        try:
+            pos = 0
+            written = 0
+            frames = (f for frame in inp.decode(in_stream) for f in resampler.resample(frame))
+            for frame in _chain(frames, lambda: resampler.resample(None)):
+                samples = frame.to_ndarray().reshape(-1, channels)
+                a = max(start - pos, 0)
+                b = len(samples) if end is None else min(end - pos, len(samples))
+                pos += len(samples)
+                if b > a:
+                    _encode(out, stream, samples[a:b], rate, written)
+                    written += b - a
+                if end is not None and pos >= end:
+                    break
+            _flush(out, stream)
+        except Exception:
+            out.close()
+            raise
+    return dst
+
+
+# 依次产出 frames 及 tail() 返回的剩余帧
+def _chain(frames, tail):
+    yield from frames
+    yield from tail()
+
+
+def _pyav_write(samples, frame_rate, dst, out_rate, channels=None, start=0, end=None):
+    import av
+    channels = int(channels or min(samples.shape[1], 2))
+    out, stream = _open_output(dst, out_rate, channels)
+    try:
+        if out_rate != frame_rate or channels != samples.shape[1]:
+            resampler = av.AudioResampler(format='s16', layout=_layout(channels), rate=out_rate)
+            frame = av.AudioFrame.from_ndarray(np.ascontiguousarray(samples).reshape(1, -1), format='s16',
+                                               layout=_layout(samples.shape[1]))
+            frame.sample_rate = frame_rate
+            frame.pts = 0
+            frame.time_base = Fraction(1, frame_rate)
+            samples = np.concatenate(
+                [f.to_ndarray().reshape(-1, channels) for f in resampler.resample(frame) + resampler.resample(None)]
+                or [np.zeros((0, channels), dtype=np.int16)])
+        samples = samples[start:end]
+        if len(samples) > 0:
+            _encode(out, stream, samples, out_rate, 0)
+        _flush(out, stream)
+    except Exception:
+        out.close()
+        raise
+    return dst
+
+
+# 读取 16bit wav 为 int16 数组 shape=(帧数, 声道数)，其他 wav 返回 None
+def _read_wav(file):
+    import wave
+    try:
+        with wave.open(file, 'rb') as f:
+            if f.getsampwidth() != 2 or f.getcomptype() != 'NONE' or f.getnchannels() > 2:
+                return None
+            data = np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16)
+            return data.reshape(-1, f.getnchannels()), f.getframerate()
+    except Exception:
+        return None
@@ -0,0 +1,180 @@
+# 分段并行烧录硬字幕
+# 整个视频只用一个 ffmpeg 进程编码时，多核机器上大部分 CPU 空闲
+# 在关键帧处将时间轴分为 N 段，每段一个 ffmpeg 进程同时烧录字幕并编码，编码参数和整体编码时相同，
+# 各段先将时间戳恢复为原视频的时间再经 subtitles 滤镜，字幕时间无需修改，最后以 -c copy 连接
+# 分段数由 burn_workers 设置，0=根据CPU核数自动设置，1=不分段
+# 启用 smart_render 且提供字幕列表时，只重新编码和字幕重叠的 GOP，其余 GOP 直接复制，
+# 连接后核对帧数和每帧时间戳与原视频一致，不一致时改为全部重新编码
+import bisect
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from videotrans.configure import config
+from videotrans.util import segment_render, tools
+
+# 每段的最短时长秒，过短时进程启动和连接的开销大于收益
+MIN_CHUNK = 20
+# 字幕前后扩展的毫秒数，ass 时间精度为 10ms，避免边缘帧的字幕落在复制的 GOP 中
+CUE_MARGIN = 100
+
+
+# 分段数和每个进程的线程数
+def pool_size(duration):
+    cores = os.cpu_count() or 1
+    workers = int(config.settings['burn_workers']) or max(1, cores // 2)
+    workers = max(1, min(workers, int(duration // MIN_CHUNK), 32))
+    return workers, max(1, cores // workers)
+
+
+# 在关键帧中选出 n-1 个分段点，使各段时长接近，返回各段起止秒数，最后一段 to=None
+def chunk_ranges(keys, duration, n):
+    bounds = [0.0]
+    for i in range(1, n):
+        target = duration * i / n
+        k = min(keys, key=lambda x: abs(x - target))
+        if bounds[-1] < k < duration:
+            bounds.append(k)
+    return [(bounds[i], bounds[i + 1] if i + 1 < len(bounds) else None) for i in range(len(bounds))]
+
+
+# 以 GOP 为单位划分复制和重新编码的片段，keys/frames 为相对首帧的 ms，cues 为字幕列表
+# 与字幕重叠的 GOP 重新编码，相邻的同类 GOP 合并，返回 [{"ss","to","copy","frames"}]，ss/to 为秒，最后一段 to=None
+def smart_ranges(keys, frames, cues):
+    spans = sorted((it['start_time'] - CUE_MARGIN, it['end_time'] + CUE_MARGIN) for it in cues)
+    starts = [s for s, _ in spans]
+    ranges = []
+    for i, k in enumerate(keys):
+        end = keys[i + 1] if i + 1 < len(keys) else None
+        # 开始早于 GOP 结束的字幕中，有结束晚于 GOP 开始的即为重叠
+        n = len(spans) if end is None else bisect.bisect_left(starts, end)
+        copy = not any(e > k for _, e in spans[:n])
+        if ranges and ranges[-1]['copy'] == copy:
+            ranges[-1]['to'] = end
+        else:
+            ranges.append({"ss": k, "to": end, "copy": copy})
+    for it in ranges:
+        it['frames'] = None if it['to'] is None else bisect.bisect_left(frames, it['to']) - bisect.bisect_left(
+            frames, it['ss'])
+        it['ss'] /= 1000
+        it['to'] = None if it['to'] is None else it['to'] / 1000
+    return ranges
+
+
+# 将 ass 字幕烧录到 source 的视频流，输出无音频的 out，cues 为 get_subtitle_from_srt 得到的字幕列表
+# 无法分段(单核、视频过短、无法读取关键帧)或任一段失败时返回 None，由调用方整体编码
+def burn(source, ass, out, *, cues=None, is_cancelled=None, on_done=None):
+    try:
+        keys, frames = segment_render.keyframes(source)
+    except Exception as e:
+        config.logger.error(f'burn_render:读取关键帧失败，整体编码:{str(e)}')
+        return None
+    if not frames:
+        return None
+    # ffmpeg 处理时时间戳从首帧开始计算，-ss 和字幕时间均相对于首帧
+    keys = [k - frames[0] for k in keys]
+    frames = [f - frames[0] for f in frames]
+    if cues is not None and config.settings['smart_render'] and smart(
+            source, ass, out, keys=keys, frames=frames, cues=cues, is_cancelled=is_cancelled, on_done=on_done):
+        return out
+    duration = frames[-1] / 1000
+    workers, threads = pool_size(duration)
+    ranges = chunk_ranges([k / 1000 for k in keys], duration, workers)
+    if len(ranges) < 2:
+        return None
+    config.logger.info(f'burn_render:{duration=},{workers=},{threads=},{ranges=}')
+    pieces = [{"ss": ss, "to": to, "copy": False} for ss, to in ranges]
+    if not _render(source, ass, out, pieces, workers=workers, threads=threads, is_cancelled=is_cancelled,
+                   on_done=on_done):
+        return None
+    return out
+
+
+# 只重新编码和字幕重叠的 GOP，成功返回 True
+# 第一帧不是关键帧、源视频编码格式和当前编码器不一致、或没有可复制的 GOP 时返回 False
+def smart(source, ass, out, *, keys, frames, cues, is_cancelled=None, on_done=None):
+    if len(keys) < 2 or keys[0] > 0:
+        return False
+    try:
+        args = segment_render.match_args(source)
+    except Exception as e:
+        config.logger.error(f'burn_render:读取视频参数失败:{str(e)}')
+        return False
+    if args is None:
+        return False
+    pieces = smart_ranges(keys, frames, cues)
+    if not any(it['copy'] for it in pieces):
+        return False
+    workers, threads = pool_size(frames[-1] / 1000)
+    encode = sum((frames[-1] / 1000 if it['to'] is None else it['to']) - it['ss'] for it in pieces if not it['copy'])
+    config.logger.info(f'burn_render:smart {len(pieces)=},encode={encode:.1f}s/{frames[-1] / 1000:.1f}s,{workers=}')
+    if not _render(source, ass, out, pieces, workers=workers, threads=threads, args=args, is_cancelled=is_cancelled,
+                   on_done=on_done):
+        return False
+    try:
+        verify(out, frames)
+    except Exception as e:
+        config.logger.error(f'burn_render:smart 校验失败，改为全部重新编码:{str(e)}')
+        Path(out).unlink(missing_ok=True)
+        return False
+    return True
+
+
+# 连接后的帧数和每帧时间戳应与原视频一致，允许误差为半帧
+def verify(out, frames):
+    _, real = segment_render.keyframes(out)
+    if len(real) != len(frames):
+        raise Exception(f'frames {len(real)} != {len(frames)}')
+    tolerance = min((b - a for a, b in zip(frames, frames[1:]) if b > a), default=40) / 2
+    for n, (a, b) in enumerate(zip(frames, real)):
+        if abs(b - real[0] - a) > tolerance:
+            raise Exception(f'frame {n} at {b - real[0]:.1f}ms, source {a:.1f}ms')
+
+
+# 重新编码 source 中 ss 到 to 秒的视频并烧录字幕，args 为额外的编码参数
+def _encode(source, ass, out, *, ss, to, threads, args=None):
+    cmd = ["-y", "-ss", f"{ss:.6f}"]
+    if to is not None:
+        cmd += ["-to", f"{to:.6f}"]
+    cmd += ["-i", Path(source).as_posix(), "-map", "0:v:0", "-an",
+            # -ss 后时间戳从 0 开始，先加回起始时间，字幕按原时间显示，再从 0 开始输出
+            "-vf", f"setpts=PTS+{ss:.6f}/TB,subtitles={ass},setpts=PTS-STARTPTS",
+            "-c:v", f"libx{config.settings['video_codec']}",
+            '-crf', f'{config.settings["crf"]}',
+            '-preset', config.settings['preset'],
+            '-threads', f'{threads}']
+    tools.runffmpeg(cmd + list(args or []) + [out])
+
+
+# 复制或重新编码各片段，全部成功后直接复制连接到 out
+def _render(source, ass, out, pieces, *, workers, threads, args=None, is_cancelled=None, on_done=None):
+    name = out[:-4]
+    for i, it in enumerate(pieces):
+        it['out'] = f'{name}-{i}.mp4'
+
+    def _run(i):
+        it = pieces[i]
+        if is_cancelled and is_cancelled():
+            return False
+        try:
+            if it['copy']:
+                # 起点稍后于关键帧，避免时间戳舍入误差导致从上一个关键帧开始复制
+                tools.copy_from_video(ss=it['ss'] + 0.001, frames=it['frames'], source=Path(source).as_posix(),
+                                      out=it['out'])
+            else:
+                _encode(source, ass, it['out'], ss=it['ss'], to=it['to'], threads=threads, args=args)
+            ok = tools.vail_file(it['out'])
+        except Exception as e:
+            config.logger.error(f'burn_render:第{i}段处理失败:{str(e)}')
+            ok = False
+        if on_done:
+            on_done(i, len(pieces))
+        return ok
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_run, range(len(pieces))))
+        return all(results) and segment_render.concat_copy([it['out'] for it in pieces], out)
+    finally:
+        for it in pieces:
+            Path(it['out']).unlink(missing_ok=True)
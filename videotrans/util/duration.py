@@ -0,0 +1,206 @@
+# 音频时长探测
+# 仅读取 mp3 帧头、wav/m4a 容器元数据获取时长，不解码音频
+# 结果按路径缓存，以 mtime 和 size 判断文件是否变化，同一任务的各个阶段共享
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from videotrans.configure import config
+
+# path: ((mtime_ns, size), 时长ms)
+_cache = {}
+_lock = threading.Lock()
+
+# mp3 比特率表 kbps，key=(是否 MPEG1, layer)
+_MP3_BITRATE = {
+    (True, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (True, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (True, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (False, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (False, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (False, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+# 采样率表，key=版本位 3=MPEG1 2=MPEG2 0=MPEG2.5
+_MP3_SAMPLERATE = {
+    3: [44100, 48000, 32000],
+    2: [22050, 24000, 16000],
+    0: [11025, 12000, 8000],
+}
+
+
+# 解析 mp3 帧头，返回 (帧长度字节, 每帧采样数, 采样率, 是否MPEG1, 是否单声道)，无效返回 None
+def _mp3_frame(h):
+    if h[0] != 0xFF or (h[1] & 0xE0) != 0xE0:
+        return None
+    version = (h[1] >> 3) & 3
+    layer = 4 - ((h[1] >> 1) & 3)
+    bitrate_idx = h[2] >> 4
+    sr_idx = (h[2] >> 2) & 3
+    if version == 1 or layer == 4 or bitrate_idx in (0, 15) or sr_idx == 3:
+        return None
+    mpeg1 = version == 3
+    bitrate = _MP3_BITRATE[(mpeg1, layer)][bitrate_idx] * 1000
+    sr = _MP3_SAMPLERATE[version][sr_idx]
+    padding = (h[2] >> 1) & 1
+    if layer == 1:
+        spf = 384
+        size = (12 * bitrate // sr + padding) * 4
+    else:
+        spf = 1152 if (layer == 2 or mpeg1) else 576
+        size = spf // 8 * bitrate // sr + padding
+    return size, spf, sr, mpeg1, (h[3] >> 6) == 3
+
+
+def _mp3_duration(file):
+    data = Path(file).read_bytes()
+    pos = 0
+    # 跳过 ID3v2 标签
+    if data[:3] == b'ID3' and len(data) > 10:
+        pos = 10 + ((data[6] & 0x7F) << 21 | (data[7] & 0x7F) << 14 | (data[8] & 0x7F) << 7 | (data[9] & 0x7F))
+    end = len(data) - 128 if data[-128:-125] == b'TAG' else len(data)
+    # 查找第一个有效帧
+    first = None
+    while pos + 4 <= end:
+        first = _mp3_frame(data[pos:pos + 4])
+        if first:
+            break
+        pos += 1
+    if not first:
+        return None
+    size, spf, sr, mpeg1, mono = first
+    # 存在 Xing/Info 头时直接读取总帧数和编码器延迟
+    xing = pos + 4 + ((17 if mono else 32) if mpeg1 else (9 if mono else 17))
+    if data[xing:xing + 4] in (b'Xing', b'Info'):
+        flags = struct.unpack('>I', data[xing + 4:xing + 8])[0]
+        if flags & 1:
+            frames = struct.unpack('>I', data[xing + 8:xing + 12])[0]
+            lame = xing + 8 + sum(n for bit, n in ((1, 4), (2, 4), (4, 100), (8, 4)) if flags & bit)
+            skip = 0
+            if data[lame:lame + 4] in (b'LAME', b'Lavf', b'Lavc'):
+                d = data[lame + 21:lame + 24]
+                skip = (d[0] << 4 | d[1] >> 4) + ((d[1] & 0xF) << 8 | d[2])
+            return round(max(frames * spf - skip, 0) * 1000 / sr)
+        # 跳过 Info 帧本身，它不含音频
+        pos += size
+    # 逐帧遍历帧头累加采样数，兼容 CBR 和 VBR
+    samples = 0
+    while pos + 4 <= end:
+        frame = _mp3_frame(data[pos:pos + 4])
+        if not frame or frame[0] < 4:
+            pos += 1
+            continue
+        samples += frame[1]
+        pos += frame[0]
+    return round(samples * 1000 / sr)
+
+
+def _wav_duration(file):
+    with open(file, 'rb') as f:
+        head = f.read(12)
+        if head[:4] != b'RIFF' or head[8:12] != b'WAVE':
+            return None
+        filesize = Path(file).stat().st_size
+        byte_rate = 0
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                return None
+            name, size = chunk[:4], struct.unpack('<I', chunk[4:])[0]
+            if name == b'fmt ':
+                fmt = f.read(size)
+                byte_rate = struct.unpack('<I', fmt[8:12])[0]
+                if size % 2:
+                    f.read(1)
+            elif name == b'data':
+                if not byte_rate:
+                    return None
+                # 流式写入的 wav 可能未回填 data 大小
+                size = min(size, filesize - f.tell())
+                return round(size * 1000 / byte_rate)
+            else:
+                f.seek(size + size % 2, 1)
+
+
+# 读取 mp4/m4a 的 moov/mvhd 中的 timescale 和 duration，无需读取 mdat
+def _m4a_duration(file):
+    with open(file, 'rb') as f:
+        filesize = Path(file).stat().st_size
+
+        def boxes(start, stop):
+            pos = start
+            while pos + 8 <= stop:
+                f.seek(pos)
+                size, name = struct.unpack('>I4s', f.read(8))
+                header = 8
+                if size == 1:
+                    size = struct.unpack('>Q', f.read(8))[0]
+                    header = 16
+                elif size == 0:
+                    size = stop - pos
+                if size < header:
+                    return
+                yield name, pos + header, pos + size
+                pos += size
+
+        for name, start, stop in boxes(0, filesize):
+            if name != b'moov':
+                continue
+            for sub, sub_start, _ in boxes(start, stop):
+                if sub != b'mvhd':
+                    continue
+                f.seek(sub_start)
+                version = f.read(4)[0]
+                if version == 1:
+                    f.seek(16, 1)
+                    timescale, duration = struct.unpack('>IQ', f.read(12))
+                else:
+                    f.seek(8, 1)
+                    timescale, duration = struct.unpack('>II', f.read(8))
+                return round(duration * 1000 / timescale) if timescale else None
+    return None
+
+
+def _probe(file):
+    ext = file.split('.')[-1].lower()
+    ms = None
+    try:
+        if ext == 'mp3':
+            ms = _mp3_duration(file)
+        elif ext == 'wav':
+            ms = _wav_duration(file)
+        elif ext in ['m4a', 'mp4', 'aac', 'mov']:
+            ms = _m4a_duration(file)
+    except Exception as e:
+        config.logger.error(f'读取音频头信息失败，将解码获取时长:{file=},{str(e)}')
+    if ms is None:
+        # 无法从头信息获取，退回到解码
+        from pydub import AudioSegment
+        ms = len(AudioSegment.from_file(file, format="mp4" if ext == 'm4a' else ext))
+    return ms
+
+
+# 获取音频时长 ms
+def get_duration(file):
+    file = Path(file).as_posix()
+    stat = Path(file).stat()
+    sign = (stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        cache = _cache.get(file)
+    if cache and cache[0] == sign:
+        return cache[1]
+    ms = _probe(file)
+    with _lock:
+        _cache[file] = (sign, ms)
+    return ms
+
+
+# 并发获取多个音频时长，不存在或无效的文件返回 0
+def get_durations(files, max_workers=None):
+    from videotrans.util import tools
+
+    def _get(file):
+        return get_duration(file) if tools.vail_file(file) else 0
+
+    with ThreadPoolExecutor(max_workers=max_workers or min(16, len(files) or 1)) as pool:
+        return list(pool.map(_get, files))
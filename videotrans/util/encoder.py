@@ -0,0 +1,150 @@
+# 流式 PCM 编码
+# 启动一个以 stdin 为 16bit PCM 输入的 ffmpeg 进程，边生成音频边写入 NumPy 数据块，边编码输出，
+# 无需先导出完整的 wav 临时文件再读取编码
+# 写入线程和 ffmpeg 之间经有限长度队列传递，编码跟不上时 write() 阻塞，内存占用有上限；
+# 取消或出错时结束 ffmpeg 进程并删除未完成的输出文件
+import queue
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from videotrans.configure import config
+from videotrans.util import ffmpeg_pool
+
+
+class PcmEncoder():
+
+    def __init__(self, out, *, frame_rate=44100, channels=1, args=None, max_blocks=16, is_cancelled=None):
+        # out 输出文件，args 为 pipe 输入之后、输出文件之前的 ffmpeg 参数，例如 ['-c:a', 'aac']
+        # 可包含额外输入，pipe 输入序号为 0
+        self.out = Path(out).as_posix()
+        self.frame_rate = frame_rate
+        self.channels = channels
+        # 返回 True 时中止编码
+        self.is_cancelled = is_cancelled
+        # 每次放入队列的最大帧数，约 1s，大数组分块写入以便及时阻塞和响应取消
+        self.block_frames = max(int(frame_rate), 1)
+        self.error = None
+        self._queue = queue.Queue(maxsize=max_blocks)
+        self._stderr = []
+        cmd = ["ffmpeg", "-hide_banner", "-ignore_unknown", "-y",
+               "-f", "s16le", "-ar", f"{frame_rate}", "-ac", f"{channels}", "-i", "pipe:0"]
+        cmd += list(args or [])
+        # 插入自定义 ffmpeg 参数
+        if config.settings['ffmpeg_cmd']:
+            cmd += [str(it) for it in config.settings['ffmpeg_cmd'].split(' ')]
+        cmd.append(self.out)
+        config.logger.info(f'PcmEncoder:{cmd=}')
+        # 占用 ffmpeg_pool 的一个名额，进程结束后释放
+        self._release = ffmpeg_pool.acquire()
+        try:
+            self._proc = subprocess.Popen(cmd,
+                                          stdin=subprocess.PIPE,
+                                          stdout=subprocess.DEVNULL,
+                                          stderr=subprocess.PIPE,
+                                          creationflags=0 if sys.platform != 'win32' else subprocess.CREATE_NO_WINDOW)
+        except Exception:
+            self._release()
+            raise
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+        # 持续读取 stderr，避免管道写满导致 ffmpeg 阻塞
+        self._reader = threading.Thread(target=self._read_stderr, daemon=True)
+        self._reader.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.cancel()
+        return False
+
+    def _write_loop(self):
+        while True:
+            data = self._queue.get()
+            if data is None:
+                break
+            try:
+                self._proc.stdin.write(data)
+            except Exception as e:
+                # ffmpeg 已退出，丢弃剩余数据，具体原因在 close() 时从 stderr 获取
+                self.error = e
+                break
+        # 出错后继续取出队列中的数据，防止 write() 永久阻塞
+        while data is not None:
+            data = self._queue.get()
+        try:
+            self._proc.stdin.close()
+        except Exception:
+            pass
+
+    def _read_stderr(self):
+        for line in self._proc.stderr:
+            self._stderr.append(line)
+            if len(self._stderr) > 50:
+                self._stderr.pop(0)
+
+    # 写入一块音频，int16 或 [-1,1] 的 float 数组，shape=(帧数,) 或 (帧数, 声道数)
+    def write(self, block):
+        block = np.asarray(block)
+        if block.dtype != np.int16:
+            block = np.clip(np.round(block * 32768 if block.dtype.kind == 'f' else block), -32768, 32767).astype(np.int16)
+        if block.ndim == 1:
+            block = block.reshape(-1, 1)
+        if block.shape[1] != self.channels:
+            block = np.repeat(block[:, :1], self.channels, axis=1) if block.shape[1] == 1 else block[:, :self.channels]
+        for start in range(0, len(block), self.block_frames):
+            if self.is_cancelled and self.is_cancelled():
+                self.cancel()
+                raise Exception('cancelled')
+            if self.error is not None or self._proc.poll() is not None:
+                # ffmpeg 已提前退出，close() 抛出其错误信息
+                self.close()
+                raise Exception('PcmEncoder:ffmpeg exited')
+            # 队列已满时阻塞，等待 ffmpeg 消费
+            self._queue.put(np.ascontiguousarray(block[start:start + self.block_frames]).tobytes())
+
+    # 写入 duration_ms 毫秒静音
+    def write_silence(self, duration_ms):
+        frames = int(round(duration_ms * self.frame_rate / 1000))
+        block = np.zeros((min(frames, self.block_frames), self.channels), dtype=np.int16)
+        while frames > 0:
+            self.write(block[:frames])
+            frames -= len(block)
+
+    # 结束输入，等待编码完成，失败时抛出异常
+    def close(self):
+        if self._proc is None:
+            return self.out
+        self._queue.put(None)
+        self._writer.join()
+        code = self._proc.wait()
+        self._reader.join()
+        self._proc = None
+        self._release()
+        if code != 0:
+            Path(self.out).unlink(missing_ok=True)
+            raise Exception(f'PcmEncoder:{"".join(it.decode("utf-8", errors="ignore") for it in self._stderr[-5:])}')
+        return self.out
+
+    # 中止编码，删除未完成的输出文件
+    def cancel(self):
+        if self._proc is None:
+            return
+        try:
+            self._proc.kill()
+        except Exception:
+            pass
+        self._queue.put(None)
+        self._writer.join()
+        self._proc.wait()
+        self._reader.join()
+        self._proc = None
+        self._release()
+        Path(self.out).unlink(missing_ok=True)
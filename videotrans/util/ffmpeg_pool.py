@@ -0,0 +1,205 @@
+# ffmpeg 进程池
+# 任何线程都可能调用 runffmpeg，批量处理时多个任务的编码同时启动，互相争抢 CPU
+# 所有 ffmpeg 命令经此排队执行，同时运行的进程数不超过 ffmpeg_workers，
+# 等待中的命令按优先级出队：HIGH 试听/工具箱等交互操作，NORMAL 普通任务，LOW 后台分离视频
+# 每次执行记录耗时、CPU 时间、返回码和输出文件大小，指定 on_progress 时回报已处理到的秒数
+# 需要自行通过管道读写的长时间 ffmpeg 进程(PcmEncoder、pcmstore.create)以 slot() 占用一个名额后再启动
+import heapq
+import itertools
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+from pathlib import Path
+
+from videotrans.configure import config
+
+HIGH = 0
+NORMAL = 1
+LOW = 2
+PRIORITY_NAMES = {HIGH: 'high', NORMAL: 'normal', LOW: 'low'}
+
+_cond = threading.Condition()
+_pending = []
+_seq = itertools.count()
+_threads = []
+_running = [0]
+_local = threading.local()
+# 最近的执行记录及累计
+_recent = deque(maxlen=200)
+_totals = {name: {"calls": 0, "failed": 0, "wall": 0.0, "cpu": 0.0, "bytes": 0} for name in PRIORITY_NAMES.values()}
+
+
+# 同时运行的 ffmpeg 进程数，ffmpeg_workers=0 时等于 CPU 核数，至少 2 个，
+# 避免耗时较长的后台分离视频独占唯一的名额
+def workers():
+    return int(config.settings['ffmpeg_workers']) or max(2, os.cpu_count() or 1)
+
+
+# 当前线程未指定优先级时使用的默认值
+def current_priority():
+    return getattr(_local, 'priority', NORMAL)
+
+
+# 在 with 范围内，当前线程提交的命令使用 level 优先级，例如试听配音
+@contextmanager
+def priority(level):
+    old = current_priority()
+    _local.priority = level
+    try:
+        yield
+    finally:
+        _local.priority = old
+
+
+# 提交完整的 ffmpeg 命令，返回 Future，结果为 subprocess.CompletedProcess，stderr 为文本
+# 返回码不为 0 时不抛出异常，由调用方判断
+# on_progress(秒数) 在执行线程中调用，由 ffmpeg -progress 输出得到
+def submit(cmd, *, level=None, on_progress=None):
+    return _push(list(cmd), level, on_progress)
+
+
+# 和其他命令一样按优先级排队，取得名额后返回释放函数，释放前该名额不执行其他命令
+# 持有名额期间不能再调用 run/submit 等待其他命令，否则名额用尽时互相等待
+def acquire(level=None):
+    release = threading.Event()
+    try:
+        _push(None, level, release).result()
+    except BaseException:
+        release.set()
+        raise
+    return release.set
+
+
+# 在 with 范围内占用一个名额
+@contextmanager
+def slot(level=None):
+    release = acquire(level)
+    try:
+        yield
+    finally:
+        release()
+
+
+# cmd 为 None 时为 acquire 的占位，on_progress 为其释放事件
+def _push(cmd, level, on_progress):
+    future = Future()
+    level = current_priority() if level is None else level
+    with _cond:
+        heapq.heappush(_pending, (level, next(_seq), cmd, on_progress, future))
+        # 按需启动工作线程，ffmpeg_workers 调大后也会补足
+        if len(_threads) < workers():
+            t = threading.Thread(target=_worker, daemon=True)
+            _threads.append(t)
+            t.start()
+        _cond.notify()
+    return future
+
+
+# 同步执行，相当于 submit(...).result()
+def run(cmd, *, level=None, on_progress=None):
+    return submit(cmd, level=level, on_progress=on_progress).result()
+
+
+def _worker():
+    while True:
+        with _cond:
+            while not _pending:
+                _cond.wait()
+            level, _, cmd, on_progress, future = heapq.heappop(_pending)
+        # 已被取消的跳过
+        if not future.set_running_or_notify_cancel():
+            continue
+        with _cond:
+            _running[0] += 1
+        try:
+            if cmd is None:
+                future.set_result(None)
+                on_progress.wait()
+            else:
+                future.set_result(_execute(cmd, level, on_progress))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with _cond:
+                _running[0] -= 1
+
+
+def _execute(cmd, level, on_progress=None):
+    start = time.time()
+    if on_progress:
+        cmd = cmd[:1] + ['-progress', 'pipe:1', '-nostats'] + cmd[1:]
+    p = subprocess.Popen(cmd,
+                         stdout=subprocess.PIPE if on_progress else subprocess.DEVNULL,
+                         stderr=subprocess.PIPE,
+                         encoding="utf-8",
+                         errors="ignore",
+                         text=True,
+                         creationflags=0 if sys.platform != 'win32' else subprocess.CREATE_NO_WINDOW)
+    if on_progress:
+        # stderr 在另一线程读取，避免两个管道互相阻塞
+        err = []
+        reader = threading.Thread(target=lambda: err.append(p.stderr.read()), daemon=True)
+        reader.start()
+        _read_progress(p.stdout, on_progress)
+        p.stdout.close()
+        reader.join()
+        stderr = err[0] if err else ''
+    else:
+        stderr = p.stderr.read()
+    p.stderr.close()
+    cpu = None
+    if hasattr(os, 'wait4'):
+        # wait4 同时取得该子进程的 CPU 时间
+        _, status, usage = os.wait4(p.pid, 0)
+        p.returncode = os.waitstatus_to_exitcode(status)
+        cpu = usage.ru_utime + usage.ru_stime
+    else:
+        p.wait()
+    wall = time.time() - start
+    try:
+        size = os.path.getsize(cmd[-1]) if p.returncode == 0 and Path(cmd[-1]).is_file() else 0
+    except Exception:
+        size = 0
+    _record({"cmd": cmd, "priority": PRIORITY_NAMES.get(level, level), "wall": round(wall, 3),
+             "cpu": None if cpu is None else round(cpu, 3), "code": p.returncode, "size": size})
+    return subprocess.CompletedProcess(cmd, p.returncode, stdout=None, stderr=stderr)
+
+
+# 读取 -progress 输出的 key=value 行，out_time_us 为已输出的时长
+def _read_progress(stdout, on_progress):
+    for line in stdout:
+        key, _, value = line.strip().partition('=')
+        if key != 'out_time_us' or not value.isdigit():
+            continue
+        try:
+            on_progress(int(value) / 1000000)
+        except Exception as e:
+            config.logger.error(f'ffmpeg_pool:on_progress {str(e)}')
+
+
+def _record(item):
+    with _cond:
+        _recent.append(item)
+        total = _totals.setdefault(item['priority'], {"calls": 0, "failed": 0, "wall": 0.0, "cpu": 0.0, "bytes": 0})
+        total['calls'] += 1
+        total['failed'] += item['code'] != 0
+        total['wall'] += item['wall']
+        total['cpu'] += item['cpu'] or 0
+        total['bytes'] += item['size']
+    config.logger.info(f'ffmpeg_pool:priority={item["priority"]},wall={item["wall"]}s,cpu={item["cpu"]}s,'
+                       f'code={item["code"]},size={item["size"]},out={item["cmd"][-1]}')
+
+
+# 当前状态和累计数据，running 运行中的进程数，pending 等待中的命令数
+def stats():
+    with _cond:
+        return {"workers": workers(),
+                "running": _running[0],
+                "pending": len(_pending),
+                "totals": {k: dict(v) for k, v in _totals.items()},
+                "recent": list(_recent)}
@@ -0,0 +1,183 @@
+# 任务中音视频处理的执行计划
+# 先把各项处理描述为节点，节点的输入可以是文件或其他节点，全部描述完后再统一执行：
+# 1. 只保留生成目标所需的节点，输出已存在且允许复用的节点及其上游不再执行
+# 2. 读取同一输入文件、输入参数相同的 ffmpeg 节点合并为一次多输出的 ffmpeg，源文件只读取一次
+# 3. 互不依赖的节点同时执行，进程数由 ffmpeg_pool 控制
+# dry_run 时只输出计划及预估耗时，不执行；on_progress(节点名列表, 秒数) 回报各次 ffmpeg 的进度
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+from videotrans.configure import config
+
+# 每秒源媒体的预估处理耗时(秒)，用于 dry_run 时估算
+READ = 0.01
+COPY = 0.005
+AUDIO = 0.02
+PCM = 0.005
+ENCODE = 0.5
+SEPARATE = 1.0
+
+
+class Node():
+
+    def __init__(self, name, *, output, inputs=None, args=None, fn=None, weight=AUDIO, merge=True, reuse=False):
+        self.name = name
+        self.output = output
+        # [(文件或节点名, 输入参数列表)]
+        self.inputs = inputs or []
+        self.args = args or []
+        # fn 不为空时是 Python 处理节点，调用 fn(*输入文件)
+        self.fn = fn
+        self.weight = weight
+        self.merge = merge
+        # 输出文件已存在时直接使用
+        self.reuse = reuse
+
+
+class Plan():
+
+    def __init__(self, name, *, duration=0, level=None):
+        self.name = name
+        # 源媒体时长秒，用于估算耗时
+        self.duration = duration
+        # ffmpeg 优先级，None 时取当前线程的设置
+        self.level = level
+        self.nodes = {}
+
+    # ffmpeg 节点，source 为唯一输入时可与读取同一输入的节点合并，inputs 为多个输入时不合并
+    def ffmpeg(self, name, *, output, args, source=None, input_args=None, inputs=None, weight=AUDIO, merge=True,
+               reuse=False):
+        if source is not None:
+            inputs = [(source, list(input_args or []))]
+        self.nodes[name] = Node(name, output=output, inputs=[(src, list(a)) for src, a in inputs], args=args,
+                                weight=weight, merge=merge, reuse=reuse)
+        return name
+
+    # Python 处理节点，例如人声分离，inputs 为文件或节点名列表
+    def call(self, name, *, fn, output, inputs=None, weight=AUDIO, reuse=False):
+        self.nodes[name] = Node(name, output=output, inputs=[(src, []) for src in inputs or []], fn=fn,
+                                weight=weight, merge=False, reuse=reuse)
+        return name
+
+    def _path(self, src):
+        return self.nodes[src].output if src in self.nodes else src
+
+    # 生成 targets 所需的节点，按依赖顺序
+    def _needed(self, targets):
+        from videotrans.util import tools
+        order = []
+        seen = set()
+
+        def visit(name):
+            if name in seen or name not in self.nodes:
+                return
+            seen.add(name)
+            node = self.nodes[name]
+            if node.reuse and tools.vail_file(node.output):
+                return
+            for src, _ in node.inputs:
+                visit(src)
+            order.append(node)
+
+        for name in targets:
+            visit(name)
+        return order
+
+    # 合并后的执行单元，每组为节点列表
+    def _groups(self, nodes):
+        groups = []
+        index = {}
+        for node in nodes:
+            key = None
+            if node.fn is None and node.merge and len(node.inputs) == 1:
+                src, input_args = node.inputs[0]
+                key = (self._path(src), tuple(input_args))
+            if key is not None and key in index:
+                index[key].append(node)
+                continue
+            groups.append([node])
+            if key is not None:
+                index[key] = groups[-1]
+        return groups
+
+    def _command(self, group):
+        cmd = ['-y']
+        for src, input_args in group[0].inputs:
+            cmd += input_args + ['-i', Path(self._path(src)).as_posix()]
+        for node in group:
+            cmd += node.args + [Path(node.output).as_posix()]
+        return cmd
+
+    def _cost(self, group):
+        if group[0].fn is not None:
+            return self.duration * group[0].weight
+        return self.duration * (READ * len(group[0].inputs) + sum(node.weight for node in group))
+
+    # 计划说明，包含每个执行单元的命令和预估耗时，以及不合并时的预估耗时
+    def describe(self, groups):
+        lines = [f'media_plan {self.name}: {len(groups)} runs']
+        total = 0
+        unmerged = 0
+        for n, group in enumerate(groups):
+            cost = self._cost(group)
+            total += cost
+            unmerged += sum(self._cost([node]) for node in group)
+            what = f'call {group[0].fn.__name__}' if group[0].fn is not None else 'ffmpeg ' + ' '.join(self._command(group))
+            lines.append(f'  [{n}] {",".join(node.name for node in group)} ~{cost:.1f}s: {what}')
+        lines.append(f'  estimated {total:.1f}s, {unmerged:.1f}s without merging')
+        return '\n'.join(lines)
+
+    # 执行生成 targets 所需的节点，dry_run 时只返回计划说明
+    def run(self, targets, *, dry_run=False, on_progress=None):
+        groups = self._groups(self._needed(targets))
+        text = self.describe(groups)
+        config.logger.info(text)
+        if dry_run:
+            print(text)
+            return text
+        if not groups:
+            return text
+        owner = {node.name: group_id for group_id, group in enumerate(groups) for node in group}
+        # 每组依赖的其他组
+        deps = []
+        for group_id, group in enumerate(groups):
+            deps.append({owner[src] for node in group for src, _ in node.inputs if src in owner} - {group_id})
+        done = set()
+        running = {}
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=len(groups)) as pool:
+            pending = list(range(len(groups)))
+            while pending or running:
+                for group_id in [it for it in pending if deps[it] <= done]:
+                    pending.remove(group_id)
+                    running[pool.submit(self._execute, groups[group_id], on_progress)] = group_id
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    group_id = running.pop(future)
+                    # 出错时等待其他已开始的执行结束后抛出
+                    if future.exception() is not None:
+                        for it in running:
+                            it.cancel()
+                        wait(running)
+                        raise future.exception()
+                    done.add(group_id)
+        config.logger.info(f'media_plan {self.name}: done in {time.time() - start:.1f}s')
+        return text
+
+    def _execute(self, group, on_progress=None):
+        from videotrans.util import tools
+        if group[0].fn is not None:
+            return group[0].fn(*[self._path(src) for src, _ in group[0].inputs])
+        names = [node.name for node in group]
+        progress = (lambda sec: on_progress(names, sec)) if on_progress else None
+        try:
+            return tools.runffmpeg(self._command(group), level=self.level, on_progress=progress)
+        except Exception as e:
+            if len(group) == 1:
+                raise
+            # 合并执行失败时逐个执行，各自使用 runffmpeg 的出错回退
+            config.logger.error(f'media_plan {self.name}: 合并执行失败，改为逐个执行:{str(e)}')
+            for node in group:
+                tools.runffmpeg(self._command([node]), level=self.level)
+            return True
@@ -0,0 +1,185 @@
+# 解码后的音频缓存
+# 每个音频按采样率解码一次为单声道 float32 原始数据文件 .f32，之后以内存映射方式只读打开，
+# 识别、克隆等各环节直接对数组切片，无需再次解码，也无需把整个波形读入内存
+# 文件无头部，可由其他 ffmpeg 命令作为一路输出直接写出，见 output_args/adopt
+# 缓存文件名由音频路径、大小、修改时间得到，源文件变化后自动重新解码
+import hashlib
+import os
+import queue
+import subprocess
+import sys
+import threading
+import wave
+from pathlib import Path
+
+import numpy as np
+
+from videotrans.configure import config
+from videotrans.util import ffmpeg_pool
+
+# 每次从 ffmpeg 读取的字节数
+READ_SIZE = 1 << 20
+
+
+# audio_file 在 rate 采样率下对应的缓存文件
+def store_file(audio_file, rate, folder=None):
+    audio_file = Path(audio_file).resolve()
+    stat = audio_file.stat()
+    key = hashlib.md5(f'{audio_file.as_posix()}-{stat.st_size}-{stat.st_mtime_ns}'.encode('utf-8')).hexdigest()
+    return f'{folder or config.TEMP_DIR + "/pcm"}/{key}-{rate}.f32'
+
+
+# 作为其他 ffmpeg 命令的一路输出时的参数，输出到临时文件，完成后调用 adopt
+def output_args(rate):
+    return ["-vn", "-ac", "1", "-ar", f"{rate}", "-f", "f32le"]
+
+
+# 临时文件，和 output_args 一起使用
+def temp_file(source, rate, folder=None):
+    folder = folder or config.TEMP_DIR + "/pcm"
+    Path(folder).mkdir(parents=True, exist_ok=True)
+    return f'{folder}/{os.getpid()}-{hashlib.md5(Path(source).as_posix().encode("utf-8")).hexdigest()}-{rate}.f32.tmp'
+
+
+# 将 ffmpeg 写出的临时文件作为 owner 在 rate 采样率下的缓存，owner 须已写入完成
+def adopt(tmp, rate, owner, folder=None):
+    size = os.path.getsize(tmp)
+    # 末尾不完整的采样丢弃
+    if size % 4:
+        os.truncate(tmp, size // 4 * 4)
+    target = store_file(owner, rate, folder)
+    os.replace(tmp, target)
+    return target
+
+
+# 用 ffmpeg 将 source 解码为 rate 采样率单声道 float32，边读边写入，返回缓存文件
+# wav 不为空时同时写出 16bit wav 文件，缓存归属该 wav，例如识别用的 shibie.wav
+def create(source, rate, wav=None, folder=None):
+    tmp = temp_file(source, rate, folder)
+    cmd = ["ffmpeg", "-hide_banner", "-nostats", "-loglevel", "error", "-ignore_unknown", "-y",
+           "-i", Path(source).as_posix()]
+    cmd += output_args(rate) + ["pipe:1"]
+    config.logger.info(f'pcmstore:{cmd=}')
+    # 占用 ffmpeg_pool 的一个名额，解码结束后释放
+    with ffmpeg_pool.slot():
+        return _decode(cmd, tmp, rate, source, wav, folder)
+
+
+def _decode(cmd, tmp, rate, source, wav, folder):
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                         creationflags=0 if sys.platform != 'win32' else subprocess.CREATE_NO_WINDOW)
+    # stderr 在另一线程读取，避免管道写满导致 ffmpeg 阻塞
+    err = []
+    reader = threading.Thread(target=lambda: err.append(p.stderr.read()), daemon=True)
+    reader.start()
+    try:
+        with open(tmp, 'wb') as f:
+            # stdout 边解码边写盘
+            while True:
+                data = p.stdout.read(READ_SIZE)
+                if not data:
+                    break
+                f.write(data)
+        code = p.wait()
+        reader.join()
+        if code != 0:
+            raise Exception(f'pcmstore:{(err[0] if err else b"").decode("utf-8", errors="ignore")[-500:]}')
+        if wav:
+            write_wav(_open(tmp), rate, wav)
+        target = adopt(tmp, rate, wav or source, folder)
+    except Exception:
+        p.kill()
+        p.wait()
+        reader.join()
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    finally:
+        p.stdout.close()
+        p.stderr.close()
+    return target
+
+
+# 以只读内存映射方式打开 audio_file 在 rate 采样率下的 PCM，不存在时先解码
+def load(audio_file, rate=16000, folder=None):
+    file = store_file(audio_file, rate, folder)
+    if not os.path.exists(file):
+        file = create(audio_file, rate, folder=folder)
+    return _open(file)
+
+
+def _open(file):
+    # 空文件无法内存映射
+    if os.path.getsize(file) < 4:
+        return np.zeros(0, dtype=np.float32)
+    return np.memmap(file, dtype='<f4', mode='r', shape=(os.path.getsize(file) // 4,))
+
+
+# 删除 audio_file 的全部缓存
+def remove(audio_file, folder=None):
+    try:
+        for rate in (16000, 44100):
+            Path(store_file(audio_file, rate, folder)).unlink(missing_ok=True)
+    except Exception:
+        pass
+
+
+# start_ms 到 end_ms 的切片，与原数组共享内存
+def slice_ms(samples, rate, start_ms, end_ms=None):
+    start = max(int(start_ms * rate // 1000), 0)
+    end = len(samples) if end_ms is None else min(int(end_ms * rate // 1000), len(samples))
+    return np.asarray(samples[start:max(start, end)])
+
+
+# 按顺序生成 ranges 中每段 (start_ms, end_ms, ...) 的数组，已复制到内存中
+# 后台线程提前读取之后的 depth 段，识别当前段时下一段已读入，不再等待磁盘
+def prefetch(samples, rate, ranges, depth=1):
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def _read():
+        try:
+            for it in ranges:
+                data = np.array(slice_ms(samples, rate, it[0], it[1]))
+                while not stop.is_set():
+                    try:
+                        items.put(data, timeout=0.5)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+        except Exception as e:
+            items.put(e)
+
+    threading.Thread(target=_read, daemon=True).start()
+    try:
+        for _ in ranges:
+            data = items.get()
+            if isinstance(data, Exception):
+                raise data
+            yield data
+    finally:
+        # 提前结束时通知读取线程退出
+        stop.set()
+
+
+# float32 转为 int16，供 pydub/speech_recognition 使用
+def to_int16(samples):
+    return np.clip(np.round(np.asarray(samples) * 32768), -32768, 32767).astype(np.int16)
+
+
+# 将 float32 数组写为单声道 16bit wav，分块转换避免一次占用大量内存
+def write_wav(samples, rate, out):
+    with wave.open(Path(out).as_posix(), 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        for i in range(0, len(samples), rate * 60):
+            f.writeframes(to_int16(samples[i:i + rate * 60]).tobytes())
+    return out
+
+
+# 转为 pydub AudioSegment，仅在需要 pydub 处理时使用，会复制一份数据
+def to_segment(samples, rate):
+    from pydub import AudioSegment
+    return AudioSegment(data=to_int16(samples).tobytes(), sample_width=2, frame_rate=rate, channels=1)
@@ -0,0 +1,91 @@
+# ffprobe 结果缓存
+# 同一任务中 novoice.mp4、背景音等文件会被多次读取信息，每次都启动一个 ffprobe 进程
+# 结果保存在 tmp/probe_cache.db，以绝对路径为键，大小和 mtime_ns 不一致时重新读取，重启软件后仍可用
+# 刚修改的文件可能在同一时间精度内再次被修改而 mtime 不变，这类文件只缓存在内存中
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from videotrans.configure import config
+
+# 修改时间在此秒数内的文件不写入数据库
+RECENT = 2
+
+# path: ((size, mtime_ns), 结果)
+_cache = {}
+_lock = threading.Lock()
+
+
+def _db():
+    Path(config.TEMP_DIR).mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(config.TEMP_DIR + '/probe_cache.db', timeout=10)
+    conn.execute('CREATE TABLE IF NOT EXISTS probe (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, data TEXT)')
+    return conn
+
+
+def _load(path, sign):
+    try:
+        conn = _db()
+        row = conn.execute('SELECT size, mtime_ns, data FROM probe WHERE path=?', (path,)).fetchone()
+        conn.close()
+    except Exception as e:
+        config.logger.error(f'probe_cache:读取失败:{str(e)}')
+        return None
+    if row and (row[0], row[1]) == sign:
+        return json.loads(row[2])
+    return None
+
+
+def _save(path, sign, data):
+    try:
+        conn = _db()
+        with conn:
+            conn.execute('REPLACE INTO probe (path, size, mtime_ns, data) VALUES (?, ?, ?, ?)',
+                         (path, sign[0], sign[1], json.dumps(data)))
+        conn.close()
+    except Exception as e:
+        config.logger.error(f'probe_cache:写入失败:{str(e)}')
+
+
+# 返回 ffprobe -show_format -show_streams 的 json 结果，refresh=True 时不使用缓存
+def get(file, *, refresh=False):
+    from videotrans.util import tools
+    path = Path(file).resolve().as_posix()
+    stat = Path(path).stat()
+    sign = (stat.st_size, stat.st_mtime_ns)
+    if not refresh:
+        with _lock:
+            cache = _cache.get(path)
+        if cache and cache[0] == sign:
+            return cache[1]
+        data = _load(path, sign)
+        if data is not None:
+            with _lock:
+                _cache[path] = (sign, data)
+            return data
+    out = tools.runffprobe(['-v', 'quiet', '-print_format', 'json', '-show_format', '-show_streams', path])
+    if out is False:
+        raise Exception(f'ffprobe error:dont get video information')
+    data = json.loads(out)
+    with _lock:
+        _cache[path] = (sign, data)
+    if time.time_ns() - stat.st_mtime_ns > RECENT * 1000000000:
+        _save(path, sign, data)
+    return data
+
+
+# 并发读取多个文件，顺序不变，不存在或读取失败的为 None
+def probe_many(files, max_workers=None):
+    def _get(file):
+        try:
+            return get(file)
+        except Exception as e:
+            config.logger.error(f'probe_cache:{file},{str(e)}')
+            return None
+
+    files = list(files)
+    with ThreadPoolExecutor(max_workers=max_workers or min(16, len(files) or 1)) as pool:
+        return list(pool.map(_get, files))
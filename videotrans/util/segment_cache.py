@@ -0,0 +1,102 @@
+# 视频慢速片段缓存
+# 片段文件名按序号命名，每次执行都会覆盖，修改少量字幕后重新执行时全部片段需再次编码
+# 缓存以源视频内容摘要、起止时间、慢速倍数及编码参数为键，与序号和任务无关，
+# 重新执行或批量处理同一视频时，未改动的片段直接取用
+# 总大小超过 segment_cache_size MB 时，按最近使用时间删除最久未用的片段
+import hashlib
+import os
+import shutil
+import threading
+from pathlib import Path
+
+from videotrans.configure import config
+
+# 内容摘要时每次读取的字节数和读取次数，大文件只均匀抽取部分数据
+SAMPLE_SIZE = 1 << 20
+SAMPLES = 16
+
+
+# 缓存目录，不在 tmp 下，任务结束清理临时文件时保留
+def folder():
+    return config.homedir + "/cache/segments"
+
+
+def enabled():
+    return int(config.settings['segment_cache_size']) > 0
+
+
+# 源视频内容摘要，同一视频每次分离出的 novoice.mp4 内容相同，路径和修改时间不同
+def source_key(file):
+    size = os.path.getsize(file)
+    md5 = hashlib.md5(f'{size}'.encode('utf-8'))
+    with open(file, 'rb') as f:
+        if size <= SAMPLE_SIZE * SAMPLES:
+            md5.update(f.read())
+        else:
+            step = (size - SAMPLE_SIZE) // (SAMPLES - 1)
+            for n in range(SAMPLES):
+                f.seek(n * step)
+                md5.update(f.read(SAMPLE_SIZE))
+    return md5.hexdigest()
+
+
+# 片段的缓存键，seg 字段同 segment_render.render
+def key(source, seg):
+    parts = [source, seg['ss'], seg['to'], seg['pts'],
+             config.video_codec or config.settings['video_codec'], config.settings['crf'],
+             config.settings['cuda_qp'], config.settings['preset'], config.settings['ffmpeg_cmd'],
+             ' '.join(str(it) for it in seg.get('args') or [])]
+    return hashlib.md5('|'.join(str(it) for it in parts).encode('utf-8')).hexdigest()
+
+
+# 命中时将缓存文件放到 out 并返回 True
+def get(k, out):
+    file = f'{folder()}/{k}.mp4'
+    if not os.path.exists(file):
+        return False
+    try:
+        _place(file, out)
+        # 更新修改时间，作为最近使用时间
+        os.utime(file)
+        return True
+    except Exception as e:
+        config.logger.error(f'读取片段缓存失败:{file},{str(e)}')
+        return False
+
+
+# 编码完成的 out 存入缓存
+def put(k, out):
+    Path(folder()).mkdir(parents=True, exist_ok=True)
+    file = f'{folder()}/{k}.mp4'
+    tmp = f'{file}.{os.getpid()}-{threading.get_ident()}.tmp'
+    try:
+        _place(out, tmp)
+        os.replace(tmp, file)
+    except Exception as e:
+        Path(tmp).unlink(missing_ok=True)
+        config.logger.error(f'写入片段缓存失败:{file},{str(e)}')
+
+
+# 优先使用硬链接，不支持时复制
+# 目标先删除，之后 ffmpeg -y 写入同名文件时不会覆盖另一方的内容
+def _place(src, dst):
+    Path(dst).unlink(missing_ok=True)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+# 超过大小上限时删除最久未使用的片段
+def evict():
+    limit = int(config.settings['segment_cache_size']) * 1024 * 1024
+    try:
+        files = [(it.stat(), it) for it in Path(folder()).glob('*.mp4')]
+    except Exception:
+        return
+    total = sum(st.st_size for st, _ in files)
+    for st, it in sorted(files, key=lambda x: x[0].st_mtime):
+        if total <= limit:
+            break
+        it.unlink(missing_ok=True)
+        total -= st.st_size
@@ -0,0 +1,253 @@
+# 视频片段并行渲染
+# 视频慢速时先生成全部片段列表，再由有限数量的 ffmpeg 进程同时编码，每个进程分得一部分 CPU 线程，
+# 编码完成后批量读取片段时长，最后按原顺序连接，重新编码的片段经 segment_cache 缓存
+# 启用 video_stream_copy 时，未慢速的连续区间按关键帧切分，完整的 GOP 直接复制，
+# 只重新编码慢速片段和区间首尾不足一个 GOP 的部分，最后以 -c copy 连接并校验
+import bisect
+import json
+import os
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from videotrans.configure import config
+from videotrans.util import segment_cache, tools
+
+
+# 同时运行的编码进程数和每个进程的线程数
+# video_segment_workers=0 时按 CPU 核数自动计算，单个 libx264 进程约可用满 2 个核
+def pool_size(total):
+    cores = os.cpu_count() or 1
+    workers = int(config.settings['video_segment_workers']) or max(1, cores // 2)
+    workers = max(1, min(workers, total, 16))
+    return workers, max(1, cores // workers)
+
+
+# segments 为字典列表，ss/to 起止 ms，to=None 到视频末尾，pts 慢速倍数或空，out 输出文件
+# 编码成功的片段设置 ok=True，失败的跳过，与逐个处理时一致，返回成功的输出文件，顺序不变
+# 缓存命中和未命中数写入 btnkey 对应任务的日志
+def render(segments, source, *, is_cancelled=None, on_done=None, btnkey=""):
+    if not segments:
+        return []
+    workers, threads = pool_size(len(segments))
+    config.logger.info(f'segment_render:{len(segments)=},{workers=},{threads=}')
+    # 重新编码的片段先查缓存，直接复制的片段无需缓存
+    source_key = None
+    if segment_cache.enabled() and any(not seg.get('copy') for seg in segments):
+        try:
+            source_key = segment_cache.source_key(source)
+        except Exception as e:
+            config.logger.error(f'读取源视频摘要失败，不使用片段缓存:{str(e)}')
+
+    def _run(seg):
+        seg['ok'] = False
+        if is_cancelled and is_cancelled():
+            return seg
+        k = segment_cache.key(source_key, seg) if source_key and not seg.get('copy') else None
+        if k and segment_cache.get(k, seg['out']):
+            seg['cache'] = 'hit'
+            seg['ok'] = tools.vail_file(seg['out'])
+            return seg
+        # out 可能是上次执行时链接到缓存的同一文件，先删除，ffmpeg -y 截断写入时不会改动缓存
+        Path(seg['out']).unlink(missing_ok=True)
+        try:
+            if seg.get('copy'):
+                tools.copy_from_video(
+                    ss=seg['ss'] / 1000,
+                    frames=seg['frames'],
+                    source=source,
+                    out=seg['out'])
+            else:
+                tools.cut_from_video(
+                    ss='00:00:00.000' if seg['ss'] == 0 else tools.ms_to_time_string(ms=seg['ss']),
+                    to='' if seg['to'] is None else tools.ms_to_time_string(ms=seg['to']),
+                    source=source,
+                    pts=seg['pts'],
+                    out=seg['out'],
+                    threads=threads,
+                    args=seg.get('args'))
+            seg['ok'] = tools.vail_file(seg['out'])
+        except Exception as e:
+            config.logger.error(f'视频片段编码失败:{seg["out"]},{str(e)}')
+        if k:
+            seg['cache'] = 'miss'
+            if seg['ok']:
+                segment_cache.put(k, seg['out'])
+        return seg
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for seg in pool.map(_run, segments):
+            if on_done:
+                on_done(seg)
+    if source_key:
+        hit = sum(1 for seg in segments if seg.get('cache') == 'hit')
+        miss = sum(1 for seg in segments if seg.get('cache') == 'miss')
+        if btnkey:
+            # 同时写入日志文件
+            tools.set_process(f'segment_cache:{hit=},{miss=}', btnkey=btnkey)
+        else:
+            config.logger.info(f'segment_cache:{hit=},{miss=}')
+        segment_cache.evict()
+    return [seg['out'] for seg in segments if seg['ok']]
+
+
+# 视频流的关键帧时间和全部帧的时间 ms，只读取数据包标记，无需解码
+def keyframes(source):
+    out = tools.runffprobe(['-v', 'error', '-select_streams', 'v:0', '-show_entries', 'packet=pts_time,flags',
+                            '-of', 'csv=p=0', Path(source).as_posix()])
+    keys = set()
+    frames = []
+    for line in out.splitlines():
+        pts, _, flags = line.strip().partition(',')
+        if pts in ('', 'N/A'):
+            continue
+        frames.append(float(pts) * 1000)
+        if 'K' in flags:
+            keys.add(frames[-1])
+    return sorted(keys), sorted(frames)
+
+
+# 重新编码的片段使用和源视频相同的像素格式、profile、时间基，以便和复制的片段直接连接
+def match_args(source):
+    out = json.loads(tools.runffprobe(['-v', 'error', '-select_streams', 'v:0', '-show_entries',
+                                       'stream=codec_name,pix_fmt,profile,time_base', '-of', 'json',
+                                       Path(source).as_posix()]))
+    params = out['streams'][0]
+    if params.get('codec_name') != {'264': 'h264', '265': 'hevc'}.get(str(config.settings['video_codec'])):
+        return None
+    args = []
+    if params.get('pix_fmt'):
+        args += ['-pix_fmt', params['pix_fmt']]
+    profile = {'constrained baseline': 'baseline', 'baseline': 'baseline', 'main': 'main', 'high': 'high',
+               'high 10': 'high10', 'high 4:2:2': 'high422',
+               'high 4:4:4 predictive': 'high444'}.get(str(params.get('profile', '')).lower())
+    if params['codec_name'] == 'h264' and profile:
+        args += ['-profile:v', profile]
+    time_base = str(params.get('time_base', '')).split('/')
+    if len(time_base) == 2 and time_base[1].isdigit():
+        args += ['-video_track_timescale', time_base[1]]
+    return args
+
+
+# 将 segments 转为复制和编码混合的片段列表，相邻的未慢速片段合并为一个区间
+# 区间内第一个到最后一个关键帧之间直接复制，首尾剩余部分重新编码，慢速片段原样保留
+# 源视频编码格式和当前编码器不一致、或无法读取关键帧时返回 None
+def plan_copy(segments, source):
+    try:
+        args = match_args(source)
+        keys, frames = keyframes(source) if args is not None else ([], [])
+    except Exception as e:
+        config.logger.error(f'读取关键帧失败，全部片段将重新编码:{str(e)}')
+        return None
+    if len(keys) < 2:
+        return None
+    pieces = []
+    span = None
+    for seg in segments:
+        if seg['pts']:
+            if span:
+                pieces += _split_span(span, keys, frames, args)
+                span = None
+            pieces.append(dict(seg, args=args))
+        elif span and span['to'] == seg['ss']:
+            span['to'] = seg['to']
+        else:
+            if span:
+                pieces += _split_span(span, keys, frames, args)
+            span = {"ss": seg['ss'], "to": seg['to'], "out": seg['out']}
+    if span:
+        pieces += _split_span(span, keys, frames, args)
+    return pieces
+
+
+def _split_span(span, keys, frames, args):
+    start, end = span['ss'], span['to']
+    inner = [k for k in keys if k >= start and (end is None or k < end)]
+    # 到视频末尾时最后一个关键帧之后也可直接复制
+    first = inner[0] if inner else None
+    last = inner[-1] if end is not None and inner else None
+    name = span['out'][:-4]
+    if first is None or (end is not None and last <= first):
+        return [{"ss": start, "to": end, "pts": "", "args": args, "out": f'{name}-enc.mp4'}]
+    pieces = []
+    if first - start >= 1:
+        pieces.append({"ss": start, "to": first, "pts": "", "args": args, "out": f'{name}-head.mp4'})
+    # 起点稍后于关键帧，避免时间戳舍入误差导致从上一个关键帧开始复制
+    pieces.append({"ss": first + 1, "to": None if end is None else last, "pts": "", "copy": True,
+                   "frames": None if end is None else bisect.bisect_left(frames, last) - bisect.bisect_left(frames, first),
+                   "out": f'{name}-copy.mp4'})
+    if end is not None and end - last >= 1:
+        pieces.append({"ss": last, "to": end, "pts": "", "args": args, "out": f'{name}-tail.mp4'})
+    return pieces
+
+
+# 以 concat 分离器直接复制连接 files 到 out，校验帧数和解码无错误，失败返回 False
+def concat_copy(files, out):
+    tmp = f'{out[:-4]}-concat.mp4'
+    txt = config.TEMP_DIR + f"/{time.time()}.txt"
+    try:
+        tools.create_concat_txt(files, txt)
+        tools.runffmpeg(['-y', '-f', 'concat', '-safe', '0', '-i', txt, '-c:v', 'copy', '-an', tmp])
+        # 含 B 帧的片段起始时间不为 0，容器时长不能直接相加，改为核对总帧数
+        expect = sum(sample_count(it) for it in files)
+        real = sample_count(tmp)
+        if real != expect:
+            raise Exception(f'frames {real} != {expect}')
+        # -xerror 解码出错时返回非0，衔接处参数不一致等问题在此发现
+        tools.runffmpeg(['-v', 'error', '-xerror', '-i', tmp, '-f', 'null', '-'])
+        os.replace(tmp, out)
+        return True
+    except Exception as e:
+        config.logger.error(f'直接复制连接失败，将重新编码连接:{str(e)}')
+        Path(tmp).unlink(missing_ok=True)
+        return False
+
+
+# 读取 mp4 第一个视频轨道 stsz 中的帧数，只读取 moov，无需解析数据
+def sample_count(file):
+    with open(file, 'rb') as f:
+        def boxes(start, stop):
+            pos = start
+            while pos + 8 <= stop:
+                f.seek(pos)
+                size, name = struct.unpack('>I4s', f.read(8))
+                header = 8
+                if size == 1:
+                    size = struct.unpack('>Q', f.read(8))[0]
+                    header = 16
+                elif size == 0:
+                    size = stop - pos
+                if size < header:
+                    return
+                yield name, pos + header, pos + size
+                pos += size
+
+        def find(start, stop, path):
+            for name, sub_start, sub_stop in boxes(start, stop):
+                if name == path[0]:
+                    if len(path) == 1:
+                        return sub_start
+                    res = find(sub_start, sub_stop, path[1:])
+                    if res is not None:
+                        return res
+            return None
+
+        for name, start, stop in boxes(0, os.path.getsize(file)):
+            if name != b'moov':
+                continue
+            for trak, trak_start, trak_stop in boxes(start, stop):
+                if trak != b'trak':
+                    continue
+                hdlr = find(trak_start, trak_stop, [b'mdia', b'hdlr'])
+                if hdlr is None:
+                    continue
+                f.seek(hdlr + 8)
+                if f.read(4) != b'vide':
+                    continue
+                stsz = find(trak_start, trak_stop, [b'mdia', b'minf', b'stbl', b'stsz'])
+                if stsz is None:
+                    return 0
+                f.seek(stsz + 8)
+                return struct.unpack('>I', f.read(4))[0]
+    return 0
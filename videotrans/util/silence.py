@@ -0,0 +1,145 @@
+# 配音片段首尾静音检测
+# 在内存中用 NumPy 一次计算所有窗口的 RMS，得到首尾静音的采样偏移，不改写配音文件
+# 检测规则和 pydub detect_nonsilent 一致，配音片段使用 min_silence_len=10, silence_thresh=-50，
+# 合并、加速阶段按返回的偏移截取，配音文件只由 TTS 引擎写入一次
+# voice_chunks 用同样的检测得到识别前整段音频中的语音区间
+import os
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# 每次处理的毫秒数，限制长音频的临时内存占用
+BLOCK_MS = 60000
+
+
+# 读取音频为 int16 数组 shape=(帧数, 声道数)，返回 (数组, 采样率)
+# 16bit wav 直接读取，其他格式通过 pydub 解码
+def read_pcm(file):
+    if file.lower().endswith('.wav'):
+        try:
+            with wave.open(file, 'rb') as f:
+                if f.getsampwidth() == 2 and f.getcomptype() == 'NONE':
+                    data = np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16)
+                    return data.reshape(-1, f.getnchannels()), f.getframerate()
+        except Exception:
+            pass
+    from pydub import AudioSegment
+    ext = file.split('.')[-1].lower()
+    audio = AudioSegment.from_file(file, format="mp4" if ext == 'm4a' else ext).set_sample_width(2)
+    return np.frombuffer(audio.raw_data, dtype=np.int16).reshape(-1, audio.channels), audio.frame_rate
+
+
+def _int16(samples):
+    if samples.dtype == np.int16:
+        return samples
+    return np.clip(np.round(np.asarray(samples, dtype=np.float32) * 32768), -32768, 32767).astype(np.int16)
+
+
+# 返回 [0, 1, ..., length_ms] 各毫秒位置之前全部采样的平方和，int64 精确累加
+# gain 不为 None 时先和 pydub apply_gain(audioop.mul) 一样乘以倍数并向下取整
+def _energy(samples, frame_rate, length_ms, gain=None):
+    total = len(samples)
+    bounds = np.minimum(np.arange(length_ms + 1, dtype=np.int64) * frame_rate // 1000, total)
+    energy = np.zeros(length_ms + 1, dtype=np.int64)
+    for m0 in range(0, length_ms, BLOCK_MS):
+        m1 = min(m0 + BLOCK_MS, length_ms)
+        s0 = bounds[m0]
+        block = _int16(samples[s0:bounds[m1]])
+        if gain is not None:
+            block = np.floor(np.clip(block * gain, -32768, 32767))
+        block = np.square(block.astype(np.int64))
+        if block.ndim > 1:
+            block = block.sum(axis=1)
+        cum = np.concatenate(([0], np.cumsum(block)))
+        energy[m0:m1 + 1] = energy[m0] + cum[bounds[m0:m1 + 1] - s0]
+    return energy
+
+
+# 返回和 pydub.silence.detect_nonsilent 相同的非静音区间 [[开始ms, 结束ms], ...]
+# samples 为 int16 或 float32(-1~1) 数组，shape=(帧数,) 或 (帧数, 声道数)，可以是内存映射
+# target_dbfs 不为 None 时先和 tools.match_target_amplitude 一样将整体音量调整到该值，silence_thresh 为调整后的 dBFS
+def detect_nonsilent(samples, frame_rate, min_silence_len=1000, silence_thresh=-16.0, target_dbfs=None):
+    total = len(samples)
+    channels = 1 if samples.ndim == 1 else samples.shape[1]
+    length_ms = int(round(total * 1000 / frame_rate))
+    if length_ms < min_silence_len:
+        return [[0, length_ms]]
+    gain = None
+    if target_dbfs is not None:
+        # pydub 的整体 rms 为向下取整后的整数
+        square = 0
+        for s0 in range(0, total, BLOCK_MS * frame_rate // 1000):
+            square += int(np.square(_int16(samples[s0:s0 + BLOCK_MS * frame_rate // 1000]).astype(np.int64)).sum())
+        rms = int(np.sqrt(square / (total * channels)))
+        if rms == 0:
+            return []
+        gain = 10 ** ((target_dbfs - 20 * np.log10(rms / 32768)) / 20)
+    energy = _energy(samples, frame_rate, length_ms, gain)
+    # 以 1ms 为步长、min_silence_len 为窗口，超出末尾的部分按静音计入，分块计算减少临时数组
+    thresh = 10 ** (silence_thresh / 20) * 32768
+    windows = length_ms - min_silence_len + 1
+    silent = []
+    for w0 in range(0, windows, BLOCK_MS * 10):
+        starts = np.arange(w0, min(w0 + BLOCK_MS * 10, windows), dtype=np.int64)
+        count = np.maximum(((starts + min_silence_len) * frame_rate // 1000 - starts * frame_rate // 1000) * channels, 1)
+        rms = np.floor(np.sqrt((energy[starts + min_silence_len] - energy[starts]) / count))
+        silent.append(starts[rms <= thresh])
+    silent = np.concatenate(silent)
+    if len(silent) < 1:
+        return [[0, length_ms]]
+    # 相邻静音窗口间隔不超过 min_silence_len 时视为同一段静音
+    breaks = np.flatnonzero(np.diff(silent) > min_silence_len)
+    silent_start = silent[np.concatenate(([0], breaks + 1))]
+    silent_end = silent[np.concatenate((breaks, [len(silent) - 1]))] + min_silence_len
+    if silent_start[0] == 0 and silent_end[0] == length_ms:
+        return []
+    result = []
+    prev_end = 0
+    for start, end in zip(silent_start.tolist(), silent_end.tolist()):
+        result.append([prev_end, start])
+        prev_end = end
+    if prev_end != length_ms:
+        result.append([prev_end, length_ms])
+    # 和 pydub 相同，去掉开头的 [0, 0]
+    if result[0] == [0, 0]:
+        result.pop(0)
+    return result
+
+
+# 识别前分割音频，返回语音区间 [(开始ms, 结束ms, 是否因超过max_interval而强制分割)]
+# 音量先调整到 -20dBFS，低于 -45dBFS 且持续 min_silence_len ms 为静音，强制分割的区间结束时间延后 buffer ms
+def voice_chunks(samples, frame_rate, max_interval, min_silence_len, buffer=0):
+    nonsilent_data = []
+    for start_time, end_time in detect_nonsilent(samples, frame_rate, min_silence_len=min_silence_len,
+                                                  silence_thresh=-20 - 25, target_dbfs=-20.0):
+        while end_time - start_time >= max_interval:
+            nonsilent_data.append((start_time, start_time + max_interval + buffer, True))
+            start_time += max_interval
+        nonsilent_data.append((start_time, end_time, False))
+    return nonsilent_data
+
+
+# 返回配音文件去掉首尾静音后的 (起始采样, 结束采样, 采样率)，全部静音或读取失败返回 None
+def trim_offsets(file, silence_thresh=-50.0, min_silence_len=10):
+    try:
+        samples, frame_rate = read_pcm(file)
+    except Exception:
+        return None
+    res = detect_nonsilent(samples, frame_rate, min_silence_len=min_silence_len, silence_thresh=silence_thresh)
+    if not res:
+        return None
+    # 没有静音时保留全部采样
+    if res == [[0, int(round(len(samples) * 1000 / frame_rate))]]:
+        return 0, len(samples), frame_rate
+    return (int(round(res[0][0] * frame_rate / 1000)),
+            min(int(round(res[-1][1] * frame_rate / 1000)), len(samples)), frame_rate)
+
+
+# 并发检测多个配音文件，不存在的文件返回 None
+def trim_offsets_many(files, max_workers=None):
+    def _get(file):
+        return trim_offsets(file) if file and os.path.exists(file) and os.path.getsize(file) > 0 else None
+
+    with ThreadPoolExecutor(max_workers=max_workers or min(8, len(files) or 1)) as pool:
+        return list(pool.map(_get, files))
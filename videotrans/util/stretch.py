@@ -0,0 +1,98 @@
+# 音频变速不变调
+# 对解码后的 PCM 做 WSOLA 时间伸缩，输出长度精确等于目标时长，无需再裁剪
+# 本模块不导入 config，以便在子进程中快速加载
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+# 线性插值重采样，仅用于短于一个窗口的片段
+def _resample(x, target_frames):
+    pos = np.linspace(0, len(x) - 1, target_frames)
+    return np.stack([np.interp(pos, np.arange(len(x)), x[:, c]) for c in range(x.shape[1])], axis=1)
+
+
+# x 为 float 数组 shape=(帧数, 声道数)，返回长度恰好为 target_frames 的数组
+def wsola(x, target_frames, frame_rate):
+    n = len(x)
+    # 30ms 窗口，50% 重叠，±10ms 内搜索最相似位置
+    win = max(int(frame_rate * 0.03) // 2 * 2, 64)
+    tol = int(frame_rate * 0.01)
+    if n <= win + 2 * tol or target_frames <= win:
+        return _resample(x, target_frames)
+    hop = win // 2
+    count = max(int(np.ceil((target_frames - win) / hop)) + 1, 2)
+    # 输出帧位置均匀分布，保证最后一帧恰好结束在 target_frames
+    out_pos = np.round(np.linspace(0, target_frames - win, count)).astype(np.int64)
+    # 输入帧理想位置，保证最后一帧恰好结束在原音频末尾
+    in_pos = np.round(np.linspace(0, n - win, count)).astype(np.int64)
+    mono = x.mean(axis=1)
+    sel = np.zeros(count, dtype=np.int64)
+    for k in range(1, count):
+        # 上一帧在原音频中的自然延续，作为相似度参考
+        natural = min(sel[k - 1] + out_pos[k] - out_pos[k - 1], n - win)
+        lo = max(in_pos[k] - tol, 0)
+        hi = min(in_pos[k] + tol, n - win)
+        # 在容差范围内做互相关，取最相似的位置
+        score = np.correlate(mono[lo:hi + win], mono[natural:natural + win], 'valid')
+        sel[k] = lo + int(np.argmax(score))
+    sel[-1] = n - win
+
+    window = np.hanning(win)
+    offsets = np.arange(win)
+    frames = x[sel[:, None] + offsets] * window[None, :, None]
+    idx = (out_pos[:, None] + offsets).ravel()
+    norm = np.bincount(idx, weights=np.tile(window, count), minlength=target_frames)
+    out = np.stack(
+        [np.bincount(idx, weights=frames[:, :, c].ravel(), minlength=target_frames) for c in range(x.shape[1])],
+        axis=1)
+    return out / np.maximum(norm, 1e-3)[:, None]
+
+
+# 将 file_path 加速到 target_duration_ms，保存到 out，未指定 out 时覆盖原文件
+# trim=(起始采样, 结束采样) 时先截去首尾静音，无需加速时返回 False
+def speed_up_file(*, file_path=None, out=None, target_duration_ms=None, max_rate=100, trim=None, duration_ms=None):
+    from pydub import AudioSegment
+    ext = file_path.split('.')[-1].lower()
+    audio = AudioSegment.from_file(file_path, format="mp4" if ext == 'm4a' else ext).set_sample_width(2)
+    if trim:
+        audio = audio.get_sample_slice(trim[0], trim[1])
+    current_duration_ms = len(audio)
+    if not target_duration_ms or target_duration_ms <= 0 or current_duration_ms <= target_duration_ms:
+        return False
+    rate = min(max_rate, current_duration_ms / target_duration_ms)
+    target_frames = int(round(current_duration_ms / rate * audio.frame_rate / 1000))
+    samples = np.frombuffer(audio.raw_data, dtype=np.int16).reshape(-1, audio.channels).astype(np.float32)
+    fast = wsola(samples, target_frames, audio.frame_rate)
+    fast_audio = AudioSegment(
+        np.clip(np.round(fast), -32768, 32767).astype(np.int16).tobytes(),
+        frame_rate=audio.frame_rate,
+        sample_width=2,
+        channels=audio.channels)
+    out = out or file_path
+    ext = out.split('.')[-1].lower()
+    fast_audio.export(out, format="mp4" if ext == 'm4a' else ext)
+    return True
+
+
+def _speed_up_job(job):
+    try:
+        return speed_up_file(**job)
+    except Exception:
+        return False
+
+
+# 多进程批量加速，jobs 为 speed_up_file 参数字典列表，返回每项是否成功生成了加速文件
+def speed_up_many(jobs, max_workers=None):
+    if len(jobs) < 1:
+        return []
+    max_workers = max_workers or min(len(jobs), os.cpu_count() or 1)
+    if max_workers < 2 or len(jobs) < 2:
+        return [_speed_up_job(job) for job in jobs]
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            return list(pool.map(_speed_up_job, jobs))
+    except Exception:
+        # 进程池不可用时，退回当前进程逐个处理
+        return [_speed_up_job(job) for job in jobs]
@@ -0,0 +1,96 @@
+# 配音音轨时间线
+# 预先按视频时长分配一整块 int16 PCM 缓冲区，每个配音片段只解码一次并直接写入其所在偏移位置，
+# 最后一次性导出 wav，避免 pydub 反复 `merged_audio += segment` 时对整个已合并音频的重复复制
+import wave
+
+import numpy as np
+
+
+class AudioTimeline():
+
+    def __init__(self, duration_ms=0, *, frame_rate=None, channels=None):
+        # 预计总时长，用于首次分配缓冲区，写入超出时自动扩容
+        self.duration_ms = max(int(duration_ms), 0)
+        # 采样率和声道数，未指定时以第一个写入片段为准，后续遇到更高采样率或更多声道时整体升级，和 pydub 合并规则一致
+        self.frame_rate = frame_rate
+        self.channels = channels
+        # shape=(帧数, 声道数)
+        self.buffer = None
+
+    def _frames(self, ms):
+        return int(round(ms * self.frame_rate / 1000))
+
+    # 确保缓冲区至少可容纳 frames 帧
+    def _reserve(self, frames):
+        if self.buffer is None:
+            size = max(frames, self._frames(self.duration_ms))
+            self.buffer = np.zeros((size, self.channels), dtype=np.int16)
+            return
+        if frames <= len(self.buffer):
+            return
+        # 按 1.5 倍扩容，避免末尾多次写入时频繁复制
+        size = max(frames, int(len(self.buffer) * 1.5))
+        buffer = np.zeros((size, self.channels), dtype=np.int16)
+        buffer[:len(self.buffer)] = self.buffer
+        self.buffer = buffer
+
+    # 已写入片段的采样率或声道数更高时，将现有缓冲区重采样并升级
+    def _upgrade(self, frame_rate, channels):
+        frame_rate = max(frame_rate, self.frame_rate or 0)
+        channels = max(channels, self.channels or 0)
+        if self.buffer is None:
+            self.frame_rate, self.channels = frame_rate, channels
+            return
+        if frame_rate == self.frame_rate and channels == self.channels:
+            return
+        old = self.buffer
+        if frame_rate != self.frame_rate:
+            size = int(round(len(old) * frame_rate / self.frame_rate))
+            x = np.arange(size) * (self.frame_rate / frame_rate)
+            xp = np.arange(len(old))
+            old = np.stack([np.interp(x, xp, old[:, c]) for c in range(old.shape[1])], axis=1).astype(np.int16)
+        if channels != old.shape[1]:
+            old = np.repeat(old[:, :1], channels, axis=1)
+        self.buffer = old
+        self.frame_rate, self.channels = frame_rate, channels
+
+    # 将 pydub AudioSegment 转为当前时间线格式的 int16 数组
+    def _samples(self, segment):
+        if segment.frame_rate > (self.frame_rate or 0) or segment.channels > (self.channels or 0):
+            self._upgrade(segment.frame_rate, segment.channels)
+        segment = segment.set_sample_width(2).set_frame_rate(self.frame_rate).set_channels(self.channels)
+        return np.frombuffer(segment.raw_data, dtype=np.int16).reshape(-1, self.channels)
+
+    # 解码一个配音文件
+    @staticmethod
+    def load(filename):
+        from pydub import AudioSegment
+        ext = filename.split('.')[-1].lower()
+        return AudioSegment.from_file(filename, format="mp4" if ext == 'm4a' else ext)
+
+    # 在 position_ms 处写入片段，返回片段时长 ms
+    def write(self, segment, position_ms):
+        samples = self._samples(segment)
+        start = self._frames(position_ms)
+        self._reserve(start + len(samples))
+        self.buffer[start:start + len(samples)] = samples
+        return len(segment)
+
+    # 返回最终的 int16 数组，duration_ms 为最终音频时长，不足补静音，多余截断
+    def finish(self, duration_ms):
+        if self.frame_rate is None:
+            # 没有任何配音片段，输出纯静音
+            self.frame_rate, self.channels = 44100, 1
+        frames = self._frames(duration_ms)
+        self._reserve(frames)
+        return self.buffer[:frames]
+
+    # 导出为 16bit wav
+    def export(self, wavfile, duration_ms):
+        pcm = self.finish(duration_ms)
+        with wave.open(wavfile, 'wb') as f:
+            f.setnchannels(self.channels)
+            f.setsampwidth(2)
+            f.setframerate(self.frame_rate)
+            f.writeframes(pcm.tobytes())
+        return wavfile
@@ -10,6 +10,7 @@ import shutil
 import subprocess
 import sys
 import os
+import wave
 from datetime import timedelta
 import json
 from pathlib import Path
@@ -18,6 +19,7 @@ import requests
 
 
 from videotrans.configure import config
+from videotrans.util import audio_io, ffmpeg_pool, probe_cache
 import time
 
 
@@ -183,9 +185,13 @@ def get_azure_rolelist():
 
 
 # 执行 ffmpeg
+# 命令交给 ffmpeg_pool 排队执行，level 为优先级，默认工具箱 HIGH，其他取当前线程的设置
+# on_progress(秒数) 回报处理进度
 def runffmpeg(arg, *, noextname=None,
               is_box=False,
-              fps=None):
+              fps=None,
+              level=None,
+              on_progress=None):
     config.logger.info(f'runffmpeg-arg={arg}')
     arg_copy = copy.deepcopy(arg)
 
@@ -228,14 +234,12 @@ def runffmpeg(arg, *, noextname=None,
     config.logger.info(f'runffmpeg-tihuan:{cmd=}')
     if noextname:
         config.queue_novice[noextname] = 'ing'
+    if level is None and is_box:
+        level = ffmpeg_pool.HIGH
     try:
-        subprocess.run(cmd,
-                       stdout=subprocess.PIPE,
-                       stderr=subprocess.PIPE,
-                       encoding="utf-8",
-                       check=True,
-                       text=True,
-                       creationflags=0 if sys.platform != 'win32' else subprocess.CREATE_NO_WINDOW)
+        p = ffmpeg_pool.run(cmd, level=level, on_progress=on_progress)
+        if p.returncode != 0:
+            raise subprocess.CalledProcessError(p.returncode, cmd, stderr=p.stderr)
         if noextname:
             config.queue_novice[noextname] = "end"
         return True
@@ -264,12 +268,14 @@ def runffmpeg(arg, *, noextname=None,
                         retry=True
             config.logger.error(f'after:{retry=},{arg_copy=}')
             if retry:
-                return runffmpeg(arg_copy, noextname=noextname, is_box=is_box)
+                return runffmpeg(arg_copy, noextname=noextname, is_box=is_box, level=level, on_progress=on_progress)
         if noextname:
             config.queue_novice[noextname] = "error"
         config.logger.error(f'cmd执行出错抛出异常:{cmd=},{str(e.stderr)}')
         raise Exception(str(e.stderr))
     except Exception as e:
+        if noextname:
+            config.queue_novice[noextname] = "error"
         config.logger.error(f'执行出错 Exception:{cmd=},{str(e)}')
         raise Exception(str(e))
 
@@ -300,55 +306,46 @@ def runffprobe(cmd):
 
 # 获取视频信息
 def get_video_info(mp4_file, *, video_fps=False, video_scale=False, video_time=False, nocache=False):
-    # 如果存在缓存并且没有禁用缓存
-    mp4_file=Path(mp4_file).as_posix()
-    if not nocache and mp4_file in config.video_cache:
-        result = config.video_cache[mp4_file]
-    else:
-        out = runffprobe(['-v', 'quiet', '-print_format', 'json', '-show_format', '-show_streams', mp4_file])
-        if out is False:
-            raise Exception(f'ffprobe error:dont get video information')
-        out = json.loads(out)
-        result = {
-            "video_fps": 30,
-            "video_codec_name": "",
-            "audio_codec_name": "aac",
-            "width": 0,
-            "height": 0,
-            "time": 0,
-            "streams_len": 0,
-            "streams_audio": 0
-        }
-        if "streams" not in out or len(out["streams"]) < 1:
-            raise Exception(f'ffprobe error:streams is 0')
-
-        if "format" in out and out['format']['duration']:
-            result['time'] = int(float(out['format']['duration']) * 1000)
-        for it in out['streams']:
-            result['streams_len'] += 1
-            if it['codec_type'] == 'video':
-                result['video_codec_name'] = it['codec_name']
-                result['width'] = int(it['width'])
-                result['height'] = int(it['height'])
-
-                fps_split = it['r_frame_rate'].split('/')
-                if len(fps_split) != 2 or fps_split[1] == '0':
-                    fps1 = 30
-                else:
-                    fps1 = round(int(fps_split[0]) / int(fps_split[1]), 2)
+    # ffprobe 结果经 probe_cache 缓存，文件大小或修改时间变化时自动重新读取，nocache=True 时强制重新读取
+    out = probe_cache.get(mp4_file, refresh=nocache)
+    result = {
+        "video_fps": 30,
+        "video_codec_name": "",
+        "audio_codec_name": "aac",
+        "width": 0,
+        "height": 0,
+        "time": 0,
+        "streams_len": 0,
+        "streams_audio": 0
+    }
+    if "streams" not in out or len(out["streams"]) < 1:
+        raise Exception(f'ffprobe error:streams is 0')
+
+    if "format" in out and out['format']['duration']:
+        result['time'] = int(float(out['format']['duration']) * 1000)
+    for it in out['streams']:
+        result['streams_len'] += 1
+        if it['codec_type'] == 'video':
+            result['video_codec_name'] = it['codec_name']
+            result['width'] = int(it['width'])
+            result['height'] = int(it['height'])
+
+            fps_split = it['r_frame_rate'].split('/')
+            if len(fps_split) != 2 or fps_split[1] == '0':
+                fps1 = 30
+            else:
+                fps1 = round(int(fps_split[0]) / int(fps_split[1]), 2)
 
-                fps_split = it['avg_frame_rate'].split('/')
-                if len(fps_split) != 2 or fps_split[1] == '0':
-                    fps = fps1
-                else:
-                    fps = round(int(fps_split[0]) / int(fps_split[1]), 2)
+            fps_split = it['avg_frame_rate'].split('/')
+            if len(fps_split) != 2 or fps_split[1] == '0':
+                fps = fps1
+            else:
+                fps = round(int(fps_split[0]) / int(fps_split[1]), 2)
 
-                result['video_fps'] = fps if fps >= 16 and fps <= 60 else 30
-            elif it['codec_type'] == 'audio':
-                result['streams_audio'] += 1
-                result['audio_codec_name'] = it['codec_name']
-        if not nocache:
-            config.video_cache[mp4_file] = result
+            result['video_fps'] = fps if fps >= 16 and fps <= 60 else 30
+        elif it['codec_type'] == 'audio':
+            result['streams_audio'] += 1
+            result['audio_codec_name'] = it['codec_name']
 
     if video_time:
         return result['time']
@@ -361,7 +358,7 @@ def get_video_info(mp4_file, *, video_fps=False, video_scale=False, video_time=F
 
 # 获取某个视频的时长 s
 def get_video_duration(file_path):
-    return get_video_info(file_path, video_time=True, nocache=True)
+    return get_video_info(file_path, video_time=True)
 
 
 # 获取某个视频的fps
@@ -392,7 +389,8 @@ def conver_mp4(source_file, out_mp4, *, is_box=False):
 
 
 # 从原始视频分离出 无声视频 cuda + h264_cuvid
-def split_novoice_byraw(source_mp4, novoice_mp4, noextname, lib="copy"):
+# duration_ms 视频时长，用于计算进度百分比，记录在 config.queue_novice_progress
+def split_novoice_byraw(source_mp4, novoice_mp4, noextname, lib="copy", duration_ms=0):
     cmd = [
         "-y",
         "-i",
@@ -404,7 +402,18 @@ def split_novoice_byraw(source_mp4, novoice_mp4, noextname, lib="copy"):
         "0",
         f'{novoice_mp4}'
     ]
-    return runffmpeg(cmd, noextname=noextname)
+    # 在后台与识别、翻译同时进行，让出名额给其他编码
+    return runffmpeg(cmd, noextname=noextname, level=ffmpeg_pool.LOW,
+                     on_progress=novice_progress(noextname, duration_ms))
+
+
+# 返回记录分离视频进度的 on_progress
+def novice_progress(noextname, duration_ms):
+    def _progress(sec):
+        if duration_ms > 0:
+            config.queue_novice_progress[noextname] = min(99, int(sec * 100000 / duration_ms))
+
+    return _progress
 
 
 # 从原始视频中分离出音频 cuda + h264_cuvid
@@ -462,19 +471,6 @@ def split_audio_byraw(source_mp4, targe_audio, is_separate=False,btnkey=None):
         raise Exception(msg)
 
 
-def conver_to_8k(audio, target_audio):
-    return runffmpeg([
-        "-y",
-        "-i",
-        Path(audio).as_posix(),
-        "-ac",
-        "1",
-        "-ar",
-        "16000",
-        Path(target_audio).as_posix(),
-    ])
-
-
 #  背景音乐是wav,配音人声是m4a，都在目标文件夹下，合并后最后文件仍为 人声文件，时长需要等于人声
 def backandvocal(backwav, peiyinm4a):
     backwav=Path(backwav).as_posix()
@@ -491,6 +487,9 @@ def backandvocal(backwav, peiyinm4a):
 
 # wav转为 m4a cuda + h264_cuvid
 def wav2m4a(wavfile, m4afile, extra=None):
+    # 有额外滤镜参数时仍由 ffmpeg 处理
+    if not extra:
+        return audio_io.convert(wavfile, m4afile)
     cmd = [
         "-y",
         "-i",
@@ -506,6 +505,8 @@ def wav2m4a(wavfile, m4afile, extra=None):
 
 # wav转为 mp3 cuda + h264_cuvid
 def wav2mp3(wavfile, mp3file, extra=None):
+    if not extra:
+        return audio_io.convert(wavfile, mp3file)
     cmd = [
         "-y",
         "-i",
@@ -517,23 +518,39 @@ def wav2mp3(wavfile, mp3file, extra=None):
     return runffmpeg(cmd)
 
 
-# m4a 转为 wav cuda + h264_cuvid
-def m4a2wav(m4afile, wavfile):
-    cmd = [
-        "-y",
-        "-i",
-        Path(m4afile).as_posix(),
-        "-ac",
-        "1",
-        "-ar",
-        "16000",
-        "-b:a",
-        "128k",
-        "-c:a",
-        "pcm_s16le",
-        Path(wavfile).as_posix()
-    ]
-    return runffmpeg(cmd)
+# 配音片段中间格式扩展名，wav=16bit PCM 无损，mp3=有损压缩
+def tts_ext():
+    return 'wav' if config.settings['tts_format'] == 'wav' else 'mp3'
+
+
+# 将 TTS 引擎输出的音频 src 保存为配音片段 filename，格式由 filename 扩展名决定
+# wav 时统一转为 16bit PCM、tts_sample_rate 采样率，src 已符合要求时直接移动，无需启动 ffmpeg
+# remove_src=False 时保留 src，用于 src 属于外部服务的情况
+def save_tts_audio(src, filename, remove_src=True):
+    src = Path(src).as_posix()
+    filename = Path(filename).as_posix()
+    if src == filename:
+        return filename
+    if filename.lower().endswith('.wav'):
+        rate = int(config.settings['tts_sample_rate'])
+        same = False
+        try:
+            with wave.open(src, 'rb') as f:
+                same = f.getsampwidth() == 2 and f.getframerate() == rate and f.getcomptype() == 'NONE'
+        except Exception:
+            pass
+        if same:
+            if remove_src:
+                shutil.move(src, filename)
+            else:
+                shutil.copy2(src, filename)
+            return filename
+        audio_io.convert(src, filename, rate=rate)
+    else:
+        wav2mp3(src, filename)
+    if remove_src and os.path.exists(src):
+        os.unlink(src)
+    return filename
 
 
 # 创建 多个视频的连接文件
@@ -585,36 +602,85 @@ def speed_up_mp3(*, filename=None, speed=1, out=None):
     ])
 
 
+# 音频变速不变调，精确加速到 target_duration_ms，不再裁剪末尾
 def precise_speed_up_audio(*, file_path=None, out=None, target_duration_ms=None, max_rate=100):
-    from pydub import AudioSegment
-    audio = AudioSegment.from_file(file_path)
+    from videotrans.util import stretch
+    try:
+        stretch.speed_up_file(file_path=file_path, out=out, target_duration_ms=target_duration_ms, max_rate=max_rate)
+    except Exception as e:
+        config.logger.error(f'音频加速失败:{file_path=},{str(e)}')
+    return True
 
-    # 首先确保原时长和目标时长单位一致（毫秒）
-    current_duration_ms = len(audio)
-    # 计算音频变速比例
-    # current_duration_ms = len(audio)
-    # speedup_ratio = current_duration_ms / target_duration_ms
-    # 计算速度变化率
-    speedup_ratio = current_duration_ms / target_duration_ms
 
-    if target_duration_ms <= 0 or speedup_ratio <= 1:
-        return True
-    rate = min(max_rate, speedup_ratio)
-    # 变速处理
-    try:
-        fast_audio = audio.speedup(playback_speed=rate)
-        # 如果处理后的音频时长稍长于目标时长，进行剪裁
-        if len(fast_audio) > target_duration_ms:
-            fast_audio = fast_audio[:target_duration_ms]
-    except Exception:
-        fast_audio = audio[:target_duration_ms]
+# atempo 链，单个 atempo 限制在 0.5-2.0 之间以兼容旧版 ffmpeg
+def _atempo_chain(rate):
+    filters = []
+    while rate > 2.0:
+        filters.append("atempo=2.0")
+        rate /= 2.0
+    filters.append(f"atempo={round(rate, 4)}")
+    return ",".join(filters)
+
+
+# 单个片段的滤镜，存在 trim 采样偏移时先截去首尾静音再加速
+def _speed_filter(job, rate):
+    chain = _atempo_chain(rate)
+    if job.get('trim'):
+        chain = f"atrim=start_sample={job['trim'][0]}:end_sample={job['trim'][1]},asetpts=PTS-STARTPTS,{chain}"
+    return chain
+
+
+# 批量加速，所有片段通过少量 ffmpeg 多输入多输出 filter_complex 一次完成，每次最多 batch 个
+# jobs 为 precise_speed_up_audio 参数字典列表，可选 trim=(起始采样, 结束采样) 和截取后的时长 duration_ms
+# 返回每项是否成功生成了加速文件
+def speed_up_audio_batch(jobs, batch=50):
+    from videotrans.util import duration
+    results = [False] * len(jobs)
+    todo = []
+    for i, job in enumerate(jobs):
+        try:
+            current = job.get('duration_ms') or duration.get_duration(job['file_path'])
+        except Exception:
+            continue
+        target = job['target_duration_ms']
+        if not target or target <= 0 or current <= target:
+            continue
+        todo.append((i, job, min(job.get('max_rate', 100), current / target)))
+
+    for n in range(0, len(todo), batch):
+        group = todo[n:n + batch]
+        cmd = ['-y']
+        filters = []
+        outputs = []
+        for k, (i, job, rate) in enumerate(group):
+            cmd += ['-i', Path(job['file_path']).as_posix()]
+            filters.append(f"[{k}:a]{_speed_filter(job, rate)}[a{k}]")
+            outputs += ['-map', f'[a{k}]', Path(job['out'] or job['file_path']).as_posix()]
+        try:
+            runffmpeg(cmd + ['-filter_complex', ";".join(filters)] + outputs)
+            for i, job, rate in group:
+                results[i] = True
+        except Exception as e:
+            # 批量出错时逐个处理，避免一个异常文件导致整组失败
+            config.logger.error(f'批量加速音频出错，改为逐个处理:{str(e)}')
+            for i, job, rate in group:
+                try:
+                    runffmpeg(['-y', '-i', Path(job['file_path']).as_posix(), '-filter:a', _speed_filter(job, rate),
+                               Path(job['out'] or job['file_path']).as_posix()])
+                    results[i] = True
+                except Exception:
+                    pass
+    return results
 
-    if out:
-        fast_audio.export(out, format=out.split('.')[-1])
-        return True
-    fast_audio.export(file_path, format=file_path.split('.')[-1])
-    # 返回速度调整后的音频
-    return True
+
+# 根据 set.ini 中 audio_speed_engine 选择批量加速方式
+def speed_up_audio_many(jobs):
+    if len(jobs) < 1:
+        return []
+    if config.settings['audio_speed_engine'] == 'wsola':
+        from videotrans.util import stretch
+        return stretch.speed_up_many(jobs)
+    return speed_up_audio_batch(jobs)
 
 
 def show_popup(title, text,parent=None):
@@ -826,20 +892,13 @@ def format_time(s_time="", separate=','):
 def is_novoice_mp4(novoice_mp4, noextname):
     # 预先创建好的
     # 判断novoice_mp4是否完成
-    t = 0
     if noextname not in config.queue_novice and vail_file(novoice_mp4):
         return True
     if noextname in config.queue_novice and config.queue_novice[noextname] == 'end':
         return True
-    last_size = 0
     while True:
         if config.current_status != 'ing':
             raise Exception("stop")
-        if vail_file(novoice_mp4):
-            current_size = os.path.getsize(novoice_mp4)
-            if last_size > 0 and current_size == last_size and t > 600:
-                return True
-            last_size = current_size
 
         if noextname not in config.queue_novice:
             msg = f"{noextname} split no voice videoerror:{config.queue_novice=}"
@@ -849,10 +908,11 @@ def is_novoice_mp4(novoice_mp4, noextname):
             raise Exception(msg)
 
         if config.queue_novice[noextname] == 'ing':
-            size = f'{round(last_size / 1024 / 1024, 2)}MB' if last_size > 0 else ""
-            set_process(f"{noextname} {'分离音频和画面' if config.defaulelang == 'zh' else 'spilt audio and video'} {size}")
+            # 进度来自 ffmpeg -progress
+            progress = config.queue_novice_progress.get(noextname)
+            progress = f'{progress}%' if progress is not None else ""
+            set_process(f"{noextname} {'分离音频和画面' if config.defaulelang == 'zh' else 'spilt audio and video'} {progress}")
             time.sleep(3)
-            t += 3
             continue
         return True
 
@@ -864,7 +924,7 @@ def match_target_amplitude(sound, target_dBFS):
 
 
 # 从视频中切出一段时间的视频片段 cuda + h264_cuvid
-def cut_from_video(*, ss="", to="", source="", pts="", out="", fps=None):
+def cut_from_video(*, ss="", to="", source="", pts="", out="", fps=None, threads=None, args=None):
     video_codec=config.settings['video_codec']
     cmd1 = [
         "-y",
@@ -886,23 +946,22 @@ def cut_from_video(*, ss="", to="", source="", pts="", out="", fps=None):
                   '-preset', config.settings['preset'],
                   f'{out}'
                   ]
+    # 多个片段同时编码时限制每个进程的线程数
+    if threads:
+        cmd[-1:-1] = ['-threads', f'{threads}']
+    # 额外的编码参数，例如和源视频一致的像素格式
+    if args:
+        cmd[-1:-1] = list(args)
     return runffmpeg(cmd, fps=fps)
 
 
-# 从音频中截取一个片段
-def cut_from_audio(*, ss, to, audio_file, out_file):
-    cmd = [
-        "-y",
-        "-i",
-        audio_file,
-        "-ss",
-        format_time(ss, '.'),
-        "-to",
-        format_time(to, '.'),
-        "-ar",
-        "16000",
-        out_file
-    ]
+# 不重新编码，直接复制从 ss 秒开始的视频流，ss 应为关键帧时间
+# frames 为复制的帧数，None 时到视频末尾，复制时 -to 按解码时间截断，会多出下一 GOP 的数据包，因此按帧数截取
+def copy_from_video(*, ss, frames=None, source="", out=""):
+    cmd = ["-y", "-ss", f"{ss:.6f}", "-i", source, "-map", "0:v:0", "-c:v", "copy", "-an"]
+    if frames is not None:
+        cmd += ["-frames:v", f"{frames}"]
+    cmd += ["-avoid_negative_ts", "make_zero", out]
     return runffmpeg(cmd)
 
 
@@ -1020,11 +1079,7 @@ def rename_move(file, *, is_dir=False):
 
 # 获取音频时长
 def get_audio_time(audio_file):
-    # 如果存在缓存并且没有禁用缓存
-    out = runffprobe(['-v', 'quiet', '-print_format', 'json', '-show_format', '-show_streams', audio_file])
-    if out is False:
-        raise Exception(f'ffprobe error:dont get video information')
-    out = json.loads(out)
+    out = probe_cache.get(audio_file)
     return float(out['format']['duration'])
 
 
@@ -1052,8 +1107,6 @@ def kill_ffmpeg_processes():
 
 # input_file_path 可能是字符串：文件路径，也可能是音频数据
 def remove_silence_from_end(input_file_path, silence_threshold=-50.0, chunk_size=10, is_start=True):
-    from pydub import AudioSegment
-    from pydub.silence import detect_nonsilent
     """
     Removes silence from the end of an audio file.
 
@@ -1062,6 +1115,9 @@ def remove_silence_from_end(input_file_path, silence_threshold=-50.0, chunk_size
     :param chunk_size: the chunk size to use in silence detection (in milliseconds)
     :return: an AudioSegment without silence at the end
     """
+    import numpy as np
+    from pydub import AudioSegment
+    from videotrans.util import silence
     # Load the audio file
     format = "wav"
     if isinstance(input_file_path, str):
@@ -1080,8 +1136,10 @@ def remove_silence_from_end(input_file_path, silence_threshold=-50.0, chunk_size
         audio = input_file_path
 
     # Detect non-silent chunks
-    nonsilent_chunks = detect_nonsilent(
-        audio,
+    detect = audio.set_sample_width(2)
+    nonsilent_chunks = silence.detect_nonsilent(
+        np.frombuffer(detect.raw_data, dtype=np.int16).reshape(-1, detect.channels),
+        detect.frame_rate,
         min_silence_len=chunk_size,
         silence_thresh=silence_threshold
     )